@@ -0,0 +1,138 @@
+"""End-to-end crawl benchmark against the local fixture site.
+
+Starts benchmarks/fixture_server.py in-process, then runs crawling/main.py
+as a subprocess in a scratch folder with CRAWLER_BASE_URL pointing at it
+(and the rate limiter opened up, so the crawler rather than the politeness
+budget is measured). Reports pages/s, CPU seconds per wall second, CPU
+per page and peak RSS of the crawler process tree.
+
+    python benchmarks/bench_crawl.py                        # blocking and pipelined engines
+    python benchmarks/bench_crawl.py --engine async --concurrency 32 --latency 0.02
+    python benchmarks/bench_crawl.py --json after.json --baseline before.json
+    python benchmarks/bench_crawl.py -- --storage archive   # extra main.py arguments after --
+
+Exits with status 1 when --baseline is given and a metric regressed by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import CRAWLING_DIR, compare_to_baseline, maxrss_mb, print_table, write_report
+from fixture_server import add_site_arguments, server_from_args
+
+COLUMNS = ('name', 'wall_sec', 'pages', 'pages_per_sec', 'chapters', 'cpu_sec', 'cpu_per_sec', 'cpu_ms_per_page', 'peak_rss_mb', 'exit')
+COMPARED = ('pages_per_sec', 'cpu_ms_per_page', 'peak_rss_mb')
+
+
+def engine_arguments(engine, args):
+    if engine == 'sync':
+        return []
+    extra = ['--concurrency', str(args.concurrency), '--per-host', str(args.concurrency)]
+    if args.extract_workers:
+        extra += ['--extract-workers', str(args.extract_workers)]
+    return extra
+
+
+def run_once(name, engine, args, extra):
+    server = server_from_args(args).start()
+    workdir = tempfile.mkdtemp(prefix='crawl-bench-')
+    try:
+        env = dict(os.environ)
+        env.update({
+            'CRAWLER_BASE_URL': server.base_url,
+            'CRAWLER_MAX_STORIES': str(args.max_stories),
+            'CRAWLER_MAX_CHAPTERS': str(args.max_chapters),
+            'CRAWLER_RATE_LIMIT_INITIAL': str(args.rate_limit),
+            'CRAWLER_RATE_LIMIT_MAX': str(args.rate_limit),
+        })
+        command = [sys.executable, os.path.join(CRAWLING_DIR, 'main.py'), '--no-resume', '--no-cache'] + engine_arguments(engine, args) + extra
+        log_path = os.path.join(workdir, 'crawl.log')
+        with open(log_path, 'w', encoding='utf-8') as log:
+            started = time.perf_counter()
+            proc = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            # wait4 gives the rusage of the crawler and every descendant it reaped (extraction workers)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stats = server.stats
+        chapters = None
+        try:
+            with open(os.path.join(workdir, 'data', 'stats.json'), 'r', encoding='utf-8') as f:
+                chapters = json.load(f)['counters'].get('chapters', {}).get('result=saved', 0)
+        except (OSError, ValueError, KeyError):
+            pass
+        cpu = rusage.ru_utime + rusage.ru_stime
+        if proc.returncode != 0:
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                sys.stderr.write(f"{name}: main.py exited with {proc.returncode}; last log lines:\n" + ''.join(f.readlines()[-20:]))
+        return {
+            'name': name,
+            'wall_sec': wall,
+            'pages': stats['pages'],
+            'requests': stats['requests'],
+            'bytes': stats['bytes'],
+            'statuses': stats['statuses'],
+            'pages_per_sec': stats['pages'] / wall if wall else 0.0,
+            'chapters': chapters,
+            'cpu_sec': cpu,
+            'cpu_per_sec': cpu / wall if wall else 0.0,
+            'cpu_ms_per_page': 1000 * cpu / stats['pages'] if stats['pages'] else None,
+            'peak_rss_mb': maxrss_mb(rusage),
+            'exit': proc.returncode,
+        }
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"{name}: kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark crawling/main.py end to end against the local fixture site',
+                                     epilog='Arguments after -- are passed to main.py.')
+    parser.add_argument('--engine', choices=('sync', 'async', 'both'), default='both', help='Blocking crawl, --concurrency pipeline, or both')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight for the async engine')
+    parser.add_argument('--extract-workers', type=int, default=0, help='main.py --extract-workers for the async engine')
+    parser.add_argument('--max-stories', type=int, default=20, help='CRAWLER_MAX_STORIES for the run')
+    parser.add_argument('--max-chapters', type=int, default=50, help='CRAWLER_MAX_CHAPTERS for the run')
+    parser.add_argument('--rate-limit', type=float, default=10000.0, help='Per-host requests/s the crawler may reach')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per engine (the fastest is reported)')
+    parser.add_argument('--json', metavar='PATH', help='Write the results as JSON (usable as a later --baseline)')
+    parser.add_argument('--baseline', metavar='PATH', help='Earlier --json report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression before failing')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch folders (data/, crawl.log)')
+    add_site_arguments(parser)
+    argv = sys.argv[1:]
+    extra = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, extra = argv[:split], argv[split + 1:]
+    args = parser.parse_args(argv)
+
+    engines = ('sync', 'async') if args.engine == 'both' else (args.engine,)
+    results = []
+    for engine in engines:
+        name = engine if engine == 'sync' else f"async-c{args.concurrency}" + (f"-x{args.extract_workers}" if args.extract_workers else '')
+        runs = [run_once(name, engine, args, extra) for _ in range(max(1, args.repeat))]
+        results.append(max(runs, key=lambda run: run['pages_per_sec']))
+
+    print_table(results, COLUMNS)
+    if args.json:
+        write_report(args.json, {'benchmark': 'crawl', 'time': time.time(), 'args': vars(args), 'extra': extra, 'results': results})
+    failed = any(row['exit'] != 0 for row in results)
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance, COMPARED)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
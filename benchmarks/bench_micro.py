@@ -0,0 +1,163 @@
+"""Microbenchmarks for the crawler's hot paths, on pages from the fixture site.
+
+    slug          textnorm.slugify on generated Vietnamese titles, memoized and uncached
+    html_to_text  textnorm.html_to_text on chapter bodies (the saved chapter text)
+    extract-*     chapter page bytes -> chapter dict (parse_html + extract_chapter_details),
+                  with targeted and full parsing, for every installed parser backend
+    save_novel    saver.save_novel of a novel with --chapters chapters into a scratch folder
+    synthetic     --batch synthetic chapter/novel field sets: one utils call per entity
+                  versus synthetic.py batches (numpy when installed, pure Python)
+
+    python benchmarks/bench_micro.py [--only extract] [--json after.json] [--baseline before.json]
+
+Each benchmark runs for at least --min-time seconds and reports ops/s, CPU
+per op and MB/s of input where that applies; peak RSS is the process's.
+"""
+import argparse
+import logging
+import shutil
+import sys
+import tempfile
+import time
+
+from common import compare_to_baseline, print_table, self_peak_rss_mb, use_crawling_modules, write_report
+from fixture_server import FixtureSite
+
+use_crawling_modules()
+from fetcher import configure_parser, extract_chapter_details, parse_html  # noqa: E402
+from parsers import BACKENDS  # noqa: E402
+from saver import save_novel  # noqa: E402
+from synthetic import BACKENDS as SYNTHETIC_BACKENDS, chapter_fields_batch, novel_fields_batch  # noqa: E402
+from textnorm import html_to_text, slugify  # noqa: E402
+from utils import generate_random_chapter_fields, generate_random_novel_numeric_fields  # noqa: E402
+
+COLUMNS = ('name', 'ops', 'ops_per_sec', 'cpu_us_per_op', 'mb_per_sec', 'peak_rss_mb')
+COMPARED = ('ops_per_sec', 'cpu_us_per_op')
+
+
+def measure(name, func, items, min_time, size=None):
+    """Calls func(item) round-robin over items until min_time has passed. size: input bytes per op (average)."""
+    ops = 0
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    while True:
+        for item in items:
+            func(item)
+        ops += len(items)
+        wall = time.perf_counter() - wall_started
+        if wall >= min_time:
+            break
+    cpu = time.process_time() - cpu_started
+    return {
+        'name': name,
+        'ops': ops,
+        'wall_sec': wall,
+        'ops_per_sec': ops / wall,
+        'cpu_us_per_op': 1e6 * cpu / ops,
+        'mb_per_sec': size * ops / wall / 1e6 if size else None,
+        'peak_rss_mb': self_peak_rss_mb(),
+    }
+
+
+def bench_slug(site, args):
+    titles = [site.novel_title(page, index) for page in range(1, 21) for index in range(50)]
+    yield measure('slug', slugify, titles, args.min_time)
+    yield measure('slug-uncached', slugify.__wrapped__, titles, args.min_time)
+
+
+def bench_html_to_text(site, args):
+    configure_parser()
+    bodies = [extract_chapter_details(parse_html(site.chapter(1, 0, number).encode('utf-8'), 'chapter'), 'http://fixture/chuong-1/', 'NOV0000001', number)['content']
+              for number in range(1, 33)]
+    size = sum(len(body.encode('utf-8')) for body in bodies) / len(bodies)
+    yield measure('html_to_text', html_to_text, bodies, args.min_time, size)
+
+
+def bench_extract(site, args):
+    pages = [site.chapter(1, 0, number).encode('utf-8') for number in range(1, 33)]
+    size = sum(len(page) for page in pages) / len(pages)
+    for backend in BACKENDS:
+        for targeted in (True, False):
+            try:
+                configure_parser(backend, targeted)
+                parse_html(pages[0], 'chapter')
+            except Exception as e:  # backend not installed
+                print(f"skipping {backend}: {e}", file=sys.stderr)
+                break
+
+            def extract(page):
+                return extract_chapter_details(parse_html(page, 'chapter'), 'http://fixture/chuong-1/', 'NOV0000001', 1)
+
+            yield measure(f"extract-{backend}-{'targeted' if targeted else 'full'}", extract, pages, args.min_time, size)
+    configure_parser()
+
+
+def bench_save_novel(site, args):
+    novel = {'novelId': 'NOV0000001', 'title': site.novel_title(1, 0), 'chapterList': [], 'chapterCount': 0}
+    configure_parser()
+    chapters = []
+    for number in range(1, args.chapters + 1):
+        page = site.chapter(1, 0, number).encode('utf-8')
+        chapters.append(extract_chapter_details(parse_html(page, 'chapter'), 'http://fixture/chuong-1/', 'NOV0000001', number))
+    size = sum(len(chapter.get('content', '')) for chapter in chapters)
+    scratch = tempfile.mkdtemp(prefix='save-bench-')
+    try:
+        def save(_):
+            # A fresh folder each time, so every chapter is really written
+            base_dir = tempfile.mkdtemp(dir=scratch)
+            save_novel(novel, chapters, base_dir)
+            shutil.rmtree(base_dir)
+
+        yield measure(f"save_novel-{args.chapters}ch", save, [None], args.min_time, size)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_synthetic(site, args):
+    n = args.batch
+    for kind, per_entity, batch in (('chapter', generate_random_chapter_fields, chapter_fields_batch),
+                                    ('novel', generate_random_novel_numeric_fields, novel_fields_batch)):
+        yield measure(f"{kind}_fields-{n}-per-entity", lambda _: [per_entity() for _ in range(n)], [None], args.min_time)
+        for backend in SYNTHETIC_BACKENDS:
+            try:
+                batch(1, seed=args.seed, backend=backend)
+            except RuntimeError as e:  # numpy not installed
+                print(f"skipping {backend}: {e}", file=sys.stderr)
+                continue
+            yield measure(f"{kind}_fields-{n}-{backend}", lambda _: batch(n, seed=args.seed, backend=backend), [None], args.min_time)
+
+
+BENCHMARKS = {'slug': bench_slug, 'html_to_text': bench_html_to_text, 'extract': bench_extract, 'save_novel': bench_save_novel,
+              'synthetic': bench_synthetic}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for slugging, HTML stripping, chapter extraction, save_novel and synthetic fields')
+    parser.add_argument('--only', action='append', choices=tuple(BENCHMARKS), help='Run only these benchmarks (repeatable)')
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds each benchmark runs for at least')
+    parser.add_argument('--page-size', type=int, default=8000, help='Approximate bytes of text per chapter page')
+    parser.add_argument('--chapters', type=int, default=50, help='Chapters written per save_novel call')
+    parser.add_argument('--batch', type=int, default=1000, help='Entities per synthetic-fields op')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='Write the results as JSON (usable as a later --baseline)')
+    parser.add_argument('--baseline', metavar='PATH', help='Earlier --json report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression before failing')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    site = FixtureSite(page_size=args.page_size, seed=args.seed)
+    results = []
+    for name in args.only or BENCHMARKS:
+        results.extend(BENCHMARKS[name](site, args))
+
+    print_table(results, COLUMNS)
+    if args.json:
+        write_report(args.json, {'benchmark': 'micro', 'time': time.time(), 'args': vars(args), 'results': results})
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance, COMPARED)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
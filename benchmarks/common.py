@@ -0,0 +1,67 @@
+"""Reporting helpers shared by the benchmark scripts."""
+import json
+import os
+import resource
+import sys
+
+CRAWLING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'crawling')
+
+
+def use_crawling_modules():
+    """Makes the crawler's flat imports (`from config import ...`) work from a benchmark script."""
+    if CRAWLING_DIR not in sys.path:
+        sys.path.insert(0, CRAWLING_DIR)
+
+
+def maxrss_mb(rusage):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def self_peak_rss_mb():
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def print_table(rows, columns):
+    """Prints dict rows as an aligned text table."""
+    cells = [[str(column) for column in columns]]
+    for row in rows:
+        cells.append([_format(row.get(column)) for column in columns])
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    for line in cells:
+        print('  '.join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(line, widths))))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.3f}" if abs(value) < 1000 else f"{value:.0f}"
+    return '' if value is None else str(value)
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+
+# Metrics where a larger value is better; for every other compared metric smaller is better.
+HIGHER_IS_BETTER = ('pages_per_sec', 'ops_per_sec', 'mb_per_sec')
+
+
+def compare_to_baseline(results, baseline_path, tolerance, metrics):
+    """Compares {name: {metric: value}} results with a saved report. Returns the list of regression messages."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {row['name']: row for row in json.load(f)['results']}
+    regressions = []
+    for row in results:
+        old = baseline.get(row['name'])
+        if old is None:
+            continue
+        for metric in metrics:
+            before, after = old.get(metric), row.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append(f"{row['name']}: {metric} {before:.3f} -> {after:.3f} ({change:+.1%})")
+    return regressions
@@ -0,0 +1,307 @@
+"""Local truyenfull-like site for offline benchmarks.
+
+Serves synthetic listing, novel, chapter-list and chapter pages with the
+markup the extractors in crawling/fetcher.py select on
+(`div.list-truyen .row h3.truyen-title > a`, `div.text-info a`, `h3.title`,
+`div.book img`, `div.info`, `div.desc-text`, `ul.list-chapter`,
+`ul.pagination`, `a.chapter-title`, `div.chapter-c`), padded with the
+navigation, ads and footer a real page carries. Every page is generated
+deterministically from --seed and its path.
+
+Knobs: site shape (--pages, --novels-per-page, --chapters, --list-size),
+chapter size (--page-size, bytes of chapter text), per-request latency
+(--latency, +- --jitter) and an error rate (--error-rate, answered with 500s
+or, for --throttle-rate, 429 + Retry-After). With --soft-404, chapters past
+the last one answer 200 with the last chapter, like a site that redirects
+missing chapters to its latest.
+
+    python benchmarks/fixture_server.py --port 8765 --latency 0.02 --error-rate 0.01
+    CRAWLER_BASE_URL=http://127.0.0.1:8765/ python crawling/main.py --no-resume
+
+The site also has a sitemap index, /sitemap.xml, with one gzipped child
+sitemap per listing page listing its novels and their chapters
+(main.py --sitemap).
+
+GET /_stats returns the request/bytes/status counters as JSON.
+"""
+import argparse
+import gzip
+import hashlib
+import html
+import http.server
+import json
+import random
+import re
+import threading
+import time
+
+LISTING_PATH = 'danh-sach/truyen-hot/'
+SITEMAP_LASTMOD = '2024-01-01T00:00:00+00:00'
+
+SYLLABLES = (
+    'một', 'hai', 'ba', 'người', 'kiếm', 'tiên', 'đạo', 'thiên', 'hạ', 'long', 'phượng', 'sơn', 'hà', 'nguyệt',
+    'quang', 'minh', 'vô', 'cực', 'huyền', 'thoại', 'truyền', 'thuyết', 'ma', 'thần', 'vương', 'đế', 'hồn',
+    'tâm', 'phong', 'vân', 'lôi', 'điện', 'hỏa', 'băng', 'tuyết', 'xuân', 'thu', 'đông', 'hạ', 'trường',
+    'sinh', 'tử', 'mộng', 'ảo', 'ước', 'nguyện', 'chiến', 'thắng', 'bại', 'của', 'và', 'là', 'không', 'có',
+)
+GENRES = ('Tiên Hiệp', 'Kiếm Hiệp', 'Ngôn Tình', 'Đô Thị', 'Huyền Huyễn', 'Xuyên Không', 'Trinh Thám', 'Quân Sự')
+
+PAGE_HEAD = ('<!DOCTYPE html><html lang="vi"><head><meta charset="utf-8"><title>{title}</title>'
+             '<link rel="stylesheet" href="/static/main.css"><script src="/static/app.js"></script></head><body>'
+             '<div class="navbar"><ul class="nav">' + ''.join(f'<li><a href="/the-loai/{i}/">Thể loại {i}</a></li>' for i in range(12)) +
+             '</ul></div><div class="container">')
+PAGE_FOOT = ('</div><div class="ads-google">quảng cáo</div><div class="footer"><p>Đọc truyện online, truyện hay.</p>'
+             + ''.join(f'<a href="/tag/{i}/">tag {i}</a>' for i in range(20)) + '</div></body></html>')
+
+
+class FixtureSite:
+    """Generates the pages of one synthetic site."""
+
+    def __init__(self, pages=4, novels_per_page=25, chapters=50, list_size=50, page_size=8000, seed=0, soft_404=False):
+        self.pages = pages
+        self.novels_per_page = novels_per_page
+        self.chapters = chapters
+        self.list_size = max(1, list_size)
+        self.page_size = page_size
+        self.seed = seed
+        self.soft_404 = soft_404
+
+    def _rng(self, *key):
+        digest = hashlib.blake2b(repr((self.seed,) + key).encode('utf-8'), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, 'big'))
+
+    @staticmethod
+    def _words(rng, n):
+        return ' '.join(rng.choice(SYLLABLES) for _ in range(n))
+
+    @staticmethod
+    def novel_slug(page, index):
+        return f"truyen-thu-{page}-{index}"
+
+    def novel_title(self, page, index):
+        rng = self._rng('title', page, index)
+        return f"{self._words(rng, 3).title()} {page}-{index}"
+
+    def listing(self, page):
+        rows = []
+        for index in range(self.novels_per_page):
+            slug = self.novel_slug(page, index)
+            rows.append(
+                f'<div class="row"><div class="col-xs-3"><div class="lazyimg" data-image="/cover/{slug}.jpg"></div></div>'
+                f'<div class="col-xs-7"><h3 class="truyen-title"><a href="/{slug}/" title="{html.escape(self.novel_title(page, index))}">'
+                f'{html.escape(self.novel_title(page, index))}</a></h3><span class="author">Tác Giả {index}</span></div>'
+                f'<div class="col-xs-2 text-info"><div><a href="/{slug}/chuong-{self.chapters}/">Chương {self.chapters}</a></div></div></div>')
+        pagination = ''.join(f'<li><a href="/{LISTING_PATH}trang-{p}/">{p}</a></li>' for p in range(1, self.pages + 1))
+        return (PAGE_HEAD.format(title='Truyện hot') + f'<div class="list list-truyen col-xs-12">{"".join(rows)}</div>'
+                f'<ul class="pagination">{pagination}</ul>' + PAGE_FOOT)
+
+    def novel(self, page, index, list_page=1):
+        rng = self._rng('novel', page, index)
+        slug = self.novel_slug(page, index)
+        title = html.escape(self.novel_title(page, index))
+        genres = ', '.join(f'<a itemprop="genre" href="/the-loai/{i}/">{GENRES[i]}</a>' for i in sorted(rng.sample(range(len(GENRES)), 2)))
+        first = (list_page - 1) * self.list_size + 1
+        last = min(self.chapters, list_page * self.list_size)
+        chapters = ''.join(f'<li><a href="/{slug}/chuong-{c}/" title="Chương {c}">Chương {c}: {self._words(self._rng("ct", page, index, c), 4)}</a></li>'
+                           for c in range(first, last + 1))
+        list_pages = max(1, -(-self.chapters // self.list_size))
+        pagination = ''.join(f'<li><a href="/{slug}/trang-{p}/#list-chapter">{p}</a></li>' for p in range(1, list_pages + 1))
+        return (PAGE_HEAD.format(title=title) +
+                f'<h3 class="title" itemprop="name">{title}</h3>'
+                f'<div class="book"><img itemprop="image" src="/cover/{slug}.jpg" alt="{title}"></div>'
+                f'<div class="info"><div><h3>Tác giả:</h3><a itemprop="author" href="/tac-gia/{index}/">Tác Giả {index}</a></div>'
+                f'<div><h3>Thể loại:</h3>{genres}</div><div><h3>Nguồn:</h3><span class="source">Sưu tầm</span></div>'
+                f'<div><h3>Trạng thái:</h3><span class="text-success">Full</span></div></div>'
+                f'<div class="desc-text" itemprop="description">{self._words(rng, 60)}<br/><b>{self._words(rng, 8)}</b></div>'
+                f'<div id="list-chapter"><ul class="list-chapter">{chapters}</ul><ul class="pagination">{pagination}</ul></div>'
+                + PAGE_FOOT)
+
+    def chapter(self, page, index, number):
+        rng = self._rng('chapter', page, index, number)
+        title = self._words(self._rng('ct', page, index, number), 4)
+        paragraphs = []
+        size = 0
+        while size < self.page_size:
+            paragraph = self._words(rng, rng.randint(20, 60)).capitalize() + '.'
+            paragraphs.append(f'<p>{paragraph}</p>')
+            size += len(paragraph.encode('utf-8'))
+            if len(paragraphs) % 8 == 0:
+                paragraphs.append('<div class="ads-google"><script>ads()</script>quảng cáo</div>')
+        return (PAGE_HEAD.format(title=f'Chương {number}') +
+                f'<a class="chapter-title" href="/{self.novel_slug(page, index)}/chuong-{number}/">Chương {number}: {title}</a>'
+                f'<div class="chapter-nav"><a href="#">Chương trước</a><a href="#">Chương tiếp</a></div>'
+                f'<div class="chapter-c" id="chapter-c">{"".join(paragraphs)}</div>' + PAGE_FOOT)
+
+    def sitemap_index(self, base_url):
+        children = ''.join(f'<sitemap><loc>{base_url}sitemap-novels-{page}.xml.gz</loc><lastmod>{SITEMAP_LASTMOD}</lastmod></sitemap>'
+                           for page in range(1, self.pages + 1))
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{children}</sitemapindex>'
+
+    def sitemap(self, base_url, page):
+        urls = []
+        for index in range(self.novels_per_page):
+            slug = self.novel_slug(page, index)
+            urls.append(f'<url><loc>{base_url}{slug}/</loc><lastmod>{SITEMAP_LASTMOD}</lastmod></url>')
+            urls.extend(f'<url><loc>{base_url}{slug}/chuong-{number}/</loc><lastmod>{SITEMAP_LASTMOD}</lastmod></url>'
+                        for number in range(1, self.chapters + 1))
+        body = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{"".join(urls)}</urlset>'
+        return gzip.compress(body.encode('utf-8'), mtime=0)
+
+    def render(self, path, base_url='/'):
+        """(status, body) for a request path; body is bytes for the gzipped sitemaps."""
+        if path == '/sitemap.xml':
+            return 200, self.sitemap_index(base_url)
+        m = re.match(r'^/sitemap-novels-(\d+)\.xml\.gz$', path)
+        if m:
+            page = int(m.group(1))
+            return (200, self.sitemap(base_url, page)) if 1 <= page <= self.pages else (404, 'not found')
+        m = re.match(r'^/danh-sach/truyen-hot/(?:trang-(\d+)/)?$', path)
+        if m:
+            page = int(m.group(1) or 1)
+            return (200, self.listing(page)) if page <= self.pages else (404, 'not found')
+        m = re.match(r'^/truyen-thu-(\d+)-(\d+)/(?:trang-(\d+)/)?$', path)
+        if m:
+            page, index = int(m.group(1)), int(m.group(2))
+            if page > self.pages or index >= self.novels_per_page:
+                return 404, 'not found'
+            return 200, self.novel(page, index, int(m.group(3) or 1))
+        m = re.match(r'^/truyen-thu-(\d+)-(\d+)/chuong-(\d+)/$', path)
+        if m:
+            page, index, number = int(m.group(1)), int(m.group(2)), int(m.group(3))
+            if self.soft_404 and number > self.chapters:
+                number = self.chapters
+            if page > self.pages or index >= self.novels_per_page or not 1 <= number <= self.chapters:
+                return 404, 'not found'
+            return 200, self.chapter(page, index, number)
+        return 404, 'not found'
+
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server for a FixtureSite with latency and error injection."""
+
+    daemon_threads = True
+
+    def __init__(self, site, port=0, host='127.0.0.1', latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0):
+        super().__init__((host, port), _Handler)
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self.stats = {'requests': 0, 'pages': 0, 'bytes': 0, 'statuses': {}}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _count(self, status, size):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += size
+            if status == 200:
+                self.stats['pages'] += 1
+            self.stats['statuses'][str(status)] = self.stats['statuses'].get(str(status), 0) + 1
+
+    def _fault(self, path):
+        """None, or the injected status for this attempt at path (deterministic per path and attempt)."""
+        if not (self.error_rate or self.throttle_rate):
+            return None
+        with self._lock:
+            attempt = self._attempts[path] = self._attempts.get(path, 0) + 1
+        roll = self.site._rng('fault', path, attempt).random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def start(self):
+        """Serves on a daemon thread; returns self."""
+        threading.Thread(target=self.serve_forever, name='fixture-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=()):
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server._count(status, len(data))
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?', 1)[0]
+        if path == '/_stats':
+            with server._lock:
+                body = json.dumps(server.stats)
+            self._send(200, body, 'application/json')
+            return
+        if server.latency or server.jitter:
+            time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        fault = server._fault(path)
+        if fault == 429:
+            self._send(429, 'slow down', headers=(('Retry-After', '1'),))
+            return
+        if fault:
+            self._send(fault, 'injected error')
+            return
+        status, body = server.site.render(path, server.base_url)
+        if path.startswith('/sitemap'):
+            self._send(status, body, 'application/x-gzip' if isinstance(body, bytes) else 'application/xml')
+        else:
+            self._send(status, body)
+
+
+def add_site_arguments(parser):
+    parser.add_argument('--pages', type=int, default=4, help='Listing pages')
+    parser.add_argument('--novels-per-page', type=int, default=25, help='Novels on each listing page')
+    parser.add_argument('--chapters', type=int, default=50, help='Chapters per novel')
+    parser.add_argument('--list-size', type=int, default=50, help='Chapters per chapter-list page')
+    parser.add_argument('--page-size', type=int, default=8000, help='Approximate bytes of text per chapter')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform +- seconds around --latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429 + Retry-After')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated content and faults')
+    parser.add_argument('--soft-404', action='store_true', help='Answer chapters past the last one with the last chapter instead of 404')
+
+
+def server_from_args(args, port=0):
+    site = FixtureSite(args.pages, args.novels_per_page, args.chapters, args.list_size, args.page_size, args.seed, args.soft_404)
+    return FixtureServer(site, port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, throttle_rate=args.throttle_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic truyenfull-like site for offline benchmarks')
+    parser.add_argument('--port', type=int, default=8765)
+    add_site_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args, args.port)
+    print(f"Serving fixture site on {server.base_url} (CRAWLER_BASE_URL={server.base_url})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
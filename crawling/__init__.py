@@ -1 +1,19 @@
-"""crawling package init - makes the folder a proper package for relative imports."""
+"""crawling package init - makes the folder a proper package for relative imports.
+
+The library API (api.py) is re-exported lazily, so `import crawling` does not
+load requests, BeautifulSoup or aiohttp:
+
+    from crawling import iter_novels, iter_chapters
+"""
+
+_API = ('Crawler', 'settings', 'iter_novel_urls', 'iter_novels', 'iter_chapters',
+        'iter_novel_urls_async', 'iter_novels_async', 'iter_chapters_async')
+
+__all__ = list(_API)
+
+
+def __getattr__(name):
+    if name in _API:
+        from . import api
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,314 @@
+"""Library API: the crawl as iterators, for programs that embed the crawler.
+
+    import crawling
+
+    crawler = crawling.Crawler(config={'MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL': 20})
+    for novel in crawler.iter_novels(limit=5):
+        for chapter in crawler.iter_chapters(novel):
+            ingest(novel, chapter)
+
+The module-level iter_novel_urls, iter_novels and iter_chapters (and their
+*_async twins, async generators) build a Crawler from their keyword
+arguments. Every page is fetched when the consumer asks for the next item,
+so a slow consumer slows the crawl down instead of letting pages pile up in
+memory; the async chapter iterator fetches at most CHAPTER_WINDOW chapters
+ahead. Nothing is written to disk unless a storage is given.
+
+Listing pages are walked in order without the frontier's Bloom filter or
+the state store: resuming and deduplicating across runs is left to the
+caller (or to main.py, which does both).
+
+requests, BeautifulSoup and aiohttp are imported on first use, so
+importing crawling costs next to nothing.
+"""
+import asyncio
+import collections
+import collections.abc
+import contextlib
+import importlib
+import itertools
+import logging
+import types
+from urllib.parse import urljoin
+
+try:
+    from . import config as _config_module
+except Exception:
+    import config as _config_module
+
+# Novel dict keys that only carry what iter_chapters needs; they are left out of a saved metadata.json
+_SCRAPED_KEYS = ('scraped_chapter_links', 'scraped_chapter_list_pages')
+
+
+def _load(name):
+    """Imports a crawler module on first use (crawling.<name>, or <name> when run from inside crawling/)."""
+    return importlib.import_module(f"{__package__}.{name}" if __package__ else name)
+
+
+def settings(config=None):
+    """The crawler settings: every UPPER_CASE name of config.py, overridden by config (a mapping or an object)."""
+    values = {name: getattr(_config_module, name) for name in dir(_config_module) if name.isupper()}
+    if config is not None:
+        overrides = config if isinstance(config, collections.abc.Mapping) else vars(config)
+        values.update((name, value) for name, value in overrides.items() if name.isupper())
+    return types.SimpleNamespace(**values)
+
+
+class Crawler:
+    """Crawl iterators over injectable settings, fetchers and storage.
+
+    config: overrides of config.py names, e.g. BASE_URL, SEED_LISTS, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL,
+      CHAPTER_WINDOW or CHAPTER_STORAGE (see settings()).
+    fetcher: object with fetch_raw(url, kind) -> bytes or None for the sync iterators (default: the fetcher
+      module, with its HTTP cache, rate limiter and retries).
+    async_fetcher: object with a coroutine fetch_raw(url, kind) for the async iterators (default: an
+      async_fetcher.AsyncFetcher opened for each iteration).
+    storage: None to only yield chapters, a directory to also save each novel there with saver.NovelWriter,
+      or a callable novel -> writer with add(chapter), update_metadata(novel) and close(); the novel passed
+      (and saved) has its chapterList, chapterCount and wordCount filled in as chapters are yielded.
+    genres: genres.GenreRegistry that turns each novel's scraped_genre_names into its genreList (default: none).
+    """
+
+    def __init__(self, config=None, fetcher=None, async_fetcher=None, storage=None, genres=None):
+        self.config = settings(config)
+        self._fetcher = fetcher
+        self._async_fetcher = async_fetcher
+        self.storage = storage
+        self.genres = genres
+
+    @property
+    def fetcher(self):
+        if self._fetcher is None:
+            self._fetcher = _load('fetcher')
+        return self._fetcher
+
+    @contextlib.asynccontextmanager
+    async def _open_async(self):
+        if self._async_fetcher is not None:
+            yield self._async_fetcher
+            return
+        async with _load('async_fetcher').AsyncFetcher() as fetcher:
+            yield fetcher
+
+    # --- extraction from raw pages ---------------------------------------------------
+    def _listing_page_url(self, path, page_num):
+        if page_num == 1:
+            return urljoin(self.config.BASE_URL, path)
+        return urljoin(self.config.BASE_URL, f"{path}trang-{page_num}/")
+
+    @staticmethod
+    def _soup(content, kind):
+        return _load('fetcher').parse_html(content, kind) if content else None
+
+    def _listing_urls(self, content, page_url):
+        soup = self._soup(content, 'listing')
+        return [url for url, _, _ in _load('fetcher').extract_listing_entries(soup, page_url)] if soup else []
+
+    def _novel(self, content, novel_url):
+        soup = self._soup(content, 'novel')
+        if soup is None:
+            logging.getLogger(__name__).warning("Failed to scrape details for novel: %s. Skipping.", novel_url)
+            return None
+        novel = _load('fetcher').extract_novel_details(soup, novel_url)
+        if self.genres is not None:
+            novel['genreList'] = self.genres.register(novel.pop('scraped_genre_names', []))
+        return novel
+
+    def _chapter(self, content, novel, number, chapter_url):
+        soup = self._soup(content, 'chapter')
+        return _load('fetcher').extract_chapter_details(soup, chapter_url, novel['novelId'], number) if soup else None
+
+    def novel_url(self, novel):
+        """The URL of a novel dict from iter_novels (its slug is the last part of the URL)."""
+        return urljoin(self.config.BASE_URL, novel['slug'] + '/')
+
+    def _open_writer(self, novel):
+        """(writer, the novel dict it saves), or (None, None) without storage."""
+        if self.storage is None:
+            return None, None
+        metadata = {key: value for key, value in novel.items() if key not in _SCRAPED_KEYS}
+        metadata.update(chapterList=[], chapterCount=0, wordCount=0)
+        if callable(self.storage):
+            return self.storage(metadata), metadata
+        return _load('saver').NovelWriter(metadata, base_dir=self.storage, storage=self.config.CHAPTER_STORAGE), metadata
+
+    @staticmethod
+    def _save(writer, metadata, chapter):
+        if writer is None:
+            return
+        metadata['chapterList'].append(chapter['chapterId'])
+        metadata['chapterCount'] += 1
+        metadata['wordCount'] += chapter.get('wordCount', 0)
+        writer.add(chapter)
+
+    @staticmethod
+    def _close_writer(writer, metadata):
+        if writer is not None:
+            writer.update_metadata(metadata)
+            writer.close()
+
+    # --- sync iterators ----------------------------------------------------------------
+    def iter_novel_urls(self, seed_lists=None):
+        """Novel URLs of each seed list (default SEED_LISTS), page by page, until a listing page comes back empty."""
+        seen = set()
+        for path in seed_lists or self.config.SEED_LISTS:
+            for page_num in itertools.count(1):
+                page_url = self._listing_page_url(path, page_num)
+                urls = self._listing_urls(self.fetcher.fetch_raw(page_url, 'listing'), page_url)
+                if not urls:
+                    break
+                for url in urls:
+                    if url not in seen:
+                        seen.add(url)
+                        yield url
+
+    def iter_novels(self, urls=None, limit=None):
+        """Novel dicts, as extract_novel_details builds them, of urls (default: iter_novel_urls()); at most limit of them.
+
+        Novels whose page cannot be fetched are skipped.
+        """
+        count = 0
+        for novel_url in (urls if urls is not None else self.iter_novel_urls()):
+            if limit is not None and count >= limit:
+                return
+            novel = self._novel(self.fetcher.fetch_raw(novel_url, 'novel'), novel_url)
+            if novel is not None:
+                count += 1
+                yield novel
+
+    def iter_chapters(self, novel, start_chapter=1):
+        """Chapter dicts of a novel from iter_novels, in order, from start_chapter up to MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL.
+
+        Chapters come from the novel's chapter list; a novel without one is probed
+        chuong-1/, chuong-2/, ... until a page is missing. Listed chapters that
+        cannot be fetched are skipped.
+        """
+        fetcher = self.fetcher
+        novel_url = self.novel_url(novel)
+        fetch_soup = lambda url, kind: self._soup(fetcher.fetch_raw(url, kind), kind)
+        plan = _load('fetcher').discover_chapters(novel_url, novel.get('scraped_chapter_links'), novel.get('scraped_chapter_list_pages', 1),
+                                                  start_chapter, self.config.MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, fetch=fetch_soup)
+        probing = plan is None
+        if probing:
+            plan = ((number, urljoin(novel_url, f"chuong-{number}/")) for number in range(start_chapter, self.config.MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL + 1))
+        writer, metadata = self._open_writer(novel)
+        try:
+            for number, chapter_url in plan:
+                chapter = self._chapter(fetcher.fetch_raw(chapter_url, 'chapter'), novel, number, chapter_url)
+                if chapter is None:
+                    if probing:
+                        return
+                    logging.getLogger(__name__).warning("  Skipping chapter %d of '%s' (URL: %s) after an error.", number, novel.get('title'), chapter_url)
+                    continue
+                self._save(writer, metadata, chapter)
+                yield chapter
+        finally:
+            self._close_writer(writer, metadata)
+
+    # --- async iterators ---------------------------------------------------------------
+    async def iter_novel_urls_async(self, seed_lists=None):
+        """Async version of iter_novel_urls."""
+        async with self._open_async() as fetcher:
+            async for url in self._novel_urls_async(fetcher, seed_lists):
+                yield url
+
+    async def _novel_urls_async(self, fetcher, seed_lists):
+        seen = set()
+        for path in seed_lists or self.config.SEED_LISTS:
+            for page_num in itertools.count(1):
+                page_url = self._listing_page_url(path, page_num)
+                urls = self._listing_urls(await fetcher.fetch_raw(page_url, 'listing'), page_url)
+                if not urls:
+                    break
+                for url in urls:
+                    if url not in seen:
+                        seen.add(url)
+                        yield url
+
+    async def iter_novels_async(self, urls=None, limit=None):
+        """Async version of iter_novels; urls may be an iterable or an async iterable."""
+        async with self._open_async() as fetcher:
+            if urls is None:
+                urls = self._novel_urls_async(fetcher, None)
+            elif not hasattr(urls, '__aiter__'):
+                urls = _aiter(urls)
+            count = 0
+            async for novel_url in urls:
+                if limit is not None and count >= limit:
+                    return
+                novel = self._novel(await fetcher.fetch_raw(novel_url, 'novel'), novel_url)
+                if novel is not None:
+                    count += 1
+                    yield novel
+
+    async def iter_chapters_async(self, novel, start_chapter=1):
+        """Async version of iter_chapters. Listed chapters are fetched up to CHAPTER_WINDOW ahead of the consumer."""
+        async with self._open_async() as fetcher:
+            novel_url = self.novel_url(novel)
+            plan = await _load('async_fetcher').discover_chapters_async(
+                fetcher, novel_url, novel.get('scraped_chapter_links'), novel.get('scraped_chapter_list_pages', 1),
+                start_chapter, self.config.MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL)
+            writer, metadata = self._open_writer(novel)
+            try:
+                if plan is None:
+                    for number in range(start_chapter, self.config.MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL + 1):
+                        chapter_url = urljoin(novel_url, f"chuong-{number}/")
+                        chapter = self._chapter(await fetcher.fetch_raw(chapter_url, 'chapter'), novel, number, chapter_url)
+                        if chapter is None:
+                            return
+                        self._save(writer, metadata, chapter)
+                        yield chapter
+                    return
+                ahead = collections.deque()
+                planned = iter(plan)
+                try:
+                    while True:
+                        while len(ahead) < max(1, int(self.config.CHAPTER_WINDOW)):
+                            item = next(planned, None)
+                            if item is None:
+                                break
+                            ahead.append((*item, asyncio.ensure_future(fetcher.fetch_raw(item[1], 'chapter'))))
+                        if not ahead:
+                            return
+                        number, chapter_url, fetch = ahead.popleft()
+                        chapter = self._chapter(await fetch, novel, number, chapter_url)
+                        if chapter is None:
+                            logging.getLogger(__name__).warning("  Skipping chapter %d of '%s' (URL: %s) after an error.", number, novel.get('title'), chapter_url)
+                            continue
+                        self._save(writer, metadata, chapter)
+                        yield chapter
+                finally:
+                    for _, _, fetch in ahead:
+                        fetch.cancel()
+            finally:
+                self._close_writer(writer, metadata)
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+# --- module-level shortcuts (keyword arguments go to Crawler) -------------------------
+def iter_novel_urls(seed_lists=None, **options):
+    return Crawler(**options).iter_novel_urls(seed_lists)
+
+
+def iter_novels(urls=None, limit=None, **options):
+    return Crawler(**options).iter_novels(urls, limit)
+
+
+def iter_chapters(novel, start_chapter=1, **options):
+    return Crawler(**options).iter_chapters(novel, start_chapter)
+
+
+def iter_novel_urls_async(seed_lists=None, **options):
+    return Crawler(**options).iter_novel_urls_async(seed_lists)
+
+
+def iter_novels_async(urls=None, limit=None, **options):
+    return Crawler(**options).iter_novels_async(urls, limit)
+
+
+def iter_chapters_async(novel, start_chapter=1, **options):
+    return Crawler(**options).iter_chapters_async(novel, start_chapter)
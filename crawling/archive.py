@@ -0,0 +1,267 @@
+"""Packed per-novel chapter archive.
+
+An alternative to one `NNN - CHAxxxxxxx - title.txt` file per chapter: all
+chapters of a novel are appended to `chapters.pack` as compressed frames,
+and `chapters.idx` holds one fixed-size record per frame:
+
+    chapterNumber (u32) | offset (u64) | length (u32) | codec (u8)
+
+Each frame decompresses to a one-line JSON header (chapterNumber, chapterId,
+title) followed by the chapter text. The index is read in one go and the
+pack is mmapped, so any chapter is a dict lookup plus one decompress, and
+progress checks never list the folder. A chapter appended again (e.g.
+re-fetched) gets a new frame and its later index record wins.
+
+Frames are written to the pack before their index record, so a crash can at
+worst leave unreferenced bytes at the end of the pack.
+
+Command line converters:
+    python crawling/archive.py pack data/<novel-slug> [--codec zstd] [--remove]
+    python crawling/archive.py unpack data/<novel-slug> [--remove]
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+try:
+    from .config import ARCHIVE_CODEC
+    from .saver import chapter_filename, chapter_text, parse_chapter_filename, _fsync_path
+except Exception:
+    from config import ARCHIVE_CODEC
+    from saver import chapter_filename, chapter_text, parse_chapter_filename, _fsync_path
+
+PACK_NAME = 'chapters.pack'
+INDEX_NAME = 'chapters.idx'
+INDEX_MAGIC = b'TFCHIDX1'
+INDEX_RECORD = struct.Struct('<IQIB')
+
+CODECS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+
+def has_archive(novel_dir):
+    return os.path.exists(os.path.join(novel_dir, INDEX_NAME))
+
+
+def codec_available(name):
+    return name in ('none', 'zlib') or (name == 'zstd' and zstandard is not None)
+
+
+def _compress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.compress(data, 6)
+    if codec == CODECS['zstd']:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def _decompress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data)
+    if codec == CODECS['zstd']:
+        if zstandard is None:
+            raise RuntimeError("Archive frame is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+
+def _encode_frame(chapter):
+    header = {
+        'chapterNumber': chapter.get('chapterNumber', 0),
+        'chapterId': chapter.get('chapterId') or '',
+        'title': chapter.get('title') or '',
+    }
+    return json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n' + chapter_text(chapter).encode('utf-8')
+
+
+def _decode_frame(data):
+    header, _, text = data.partition(b'\n')
+    chapter = json.loads(header)
+    chapter['text'] = text.decode('utf-8')
+    return chapter
+
+
+def read_index(novel_dir):
+    """{chapterNumber: (offset, length, codec)} from the novel's index file (empty when there is none)."""
+    path = os.path.join(novel_dir, INDEX_NAME)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    if not data.startswith(INDEX_MAGIC):
+        raise ValueError(f"{path} is not a chapter index")
+    body = memoryview(data)[len(INDEX_MAGIC):]
+    # Ignore a torn trailing record from an interrupted append.
+    body = body[:len(body) - len(body) % INDEX_RECORD.size]
+    return {number: (offset, length, codec) for number, offset, length, codec in INDEX_RECORD.iter_unpack(body)}
+
+
+class ChapterArchive:
+    """Random-access reader over a novel's archive (mmap of the pack file)."""
+
+    def __init__(self, novel_dir):
+        self.novel_dir = novel_dir
+        self._file = None
+        self._map = None
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the index and remaps the pack, e.g. after a writer appended to it."""
+        self._close_map()
+        self.index = read_index(self.novel_dir)
+        pack_path = os.path.join(self.novel_dir, PACK_NAME)
+        if self.index and os.path.getsize(pack_path):
+            self._file = open(pack_path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def numbers(self):
+        return sorted(self.index)
+
+    def max_number(self):
+        return max(self.index, default=0)
+
+    def __contains__(self, number):
+        return number in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, number):
+        """The chapter as {chapterNumber, chapterId, title, text}; KeyError if it is not archived."""
+        offset, length, codec = self.index[number]
+        return _decode_frame(_decompress(codec, self._map[offset:offset + length]))
+
+    def __iter__(self):
+        for number in self.numbers():
+            yield self.read(number)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._close_map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ArchiveWriter:
+    """Appends chapters to a novel's archive. Not thread-safe; NovelWriter serialises calls."""
+
+    def __init__(self, novel_dir, codec=ARCHIVE_CODEC):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec {codec!r}; expected one of {', '.join(CODECS)}")
+        if not codec_available(codec):
+            logging.getLogger(__name__).warning("Archive codec %s is not installed; falling back to zlib", codec)
+            codec = 'zlib'
+        self.novel_dir = novel_dir
+        self.codec = CODECS[codec]
+        os.makedirs(novel_dir, exist_ok=True)
+        self.index = read_index(novel_dir)
+        self.pack_path = os.path.join(novel_dir, PACK_NAME)
+        self.index_path = os.path.join(novel_dir, INDEX_NAME)
+        self._pack = open(self.pack_path, 'ab')
+        new_index = not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < len(INDEX_MAGIC)
+        self._index = open(self.index_path, 'ab')
+        if new_index:
+            self._index.truncate(0)
+            self._index.write(INDEX_MAGIC)
+        else:
+            # Drop a torn trailing record (read_index ignores it) so new records stay aligned
+            records = (os.path.getsize(self.index_path) - len(INDEX_MAGIC)) // INDEX_RECORD.size
+            self._index.truncate(len(INDEX_MAGIC) + records * INDEX_RECORD.size)
+
+    def append(self, chapter):
+        number = chapter.get('chapterNumber', 0)
+        frame = _compress(self.codec, _encode_frame(chapter))
+        offset = self._pack.tell()
+        self._pack.write(frame)
+        self._pack.flush()
+        self._index.write(INDEX_RECORD.pack(number, offset, len(frame), self.codec))
+        self._index.flush()
+        self.index[number] = (offset, len(frame), self.codec)
+
+    def sync(self):
+        os.fsync(self._pack.fileno())
+        os.fsync(self._index.fileno())
+
+    def close(self):
+        self._pack.close()
+        self._index.close()
+
+
+def pack_novel(novel_dir, codec=ARCHIVE_CODEC, remove=False):
+    """Moves a novel's `NNN - CHAxxxxxxx - title.txt` files into its archive. Returns the number packed."""
+    files = []
+    for name in os.listdir(novel_dir):
+        parsed = parse_chapter_filename(name)
+        if parsed:
+            files.append(parsed + (name,))
+    files.sort()
+    writer = ArchiveWriter(novel_dir, codec)
+    try:
+        for number, chapter_id, title, name in files:
+            with open(os.path.join(novel_dir, name), 'r', encoding='utf-8') as f:
+                text = f.read()
+            writer.append({'chapterNumber': number, 'chapterId': chapter_id, 'title': title, 'plainTextContent': text})
+        writer.sync()
+    finally:
+        writer.close()
+    _fsync_path(novel_dir)
+    if remove:
+        for _, _, _, name in files:
+            os.remove(os.path.join(novel_dir, name))
+    return len(files)
+
+
+def unpack_novel(novel_dir, remove=False):
+    """Writes every archived chapter back out as `NNN - CHAxxxxxxx - title.txt`. Returns the number written."""
+    with ChapterArchive(novel_dir) as archive:
+        count = 0
+        for chapter in archive:
+            chapter['plainTextContent'] = chapter.pop('text')
+            with open(os.path.join(novel_dir, chapter_filename(chapter)), 'w', encoding='utf-8') as f:
+                f.write(chapter['plainTextContent'])
+            count += 1
+    if remove:
+        for name in (PACK_NAME, INDEX_NAME):
+            if os.path.exists(os.path.join(novel_dir, name)):
+                os.remove(os.path.join(novel_dir, name))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert novel folders between .txt chapters and the packed archive')
+    parser.add_argument('action', choices=('pack', 'unpack'))
+    parser.add_argument('novel_dirs', nargs='+', help='Novel folders, e.g. data/<novel-slug>')
+    parser.add_argument('--codec', choices=tuple(CODECS), default=ARCHIVE_CODEC, help='Frame compression for pack')
+    parser.add_argument('--remove', action='store_true', help='Delete the source files after converting')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    for novel_dir in args.novel_dirs:
+        if args.action == 'pack':
+            count = pack_novel(novel_dir, args.codec, args.remove)
+        else:
+            count = unpack_novel(novel_dir, args.remove)
+        logging.getLogger(__name__).info("%sed %d chapters in %s", args.action.capitalize(), count, novel_dir)
+
+
+if __name__ == '__main__':
+    main()
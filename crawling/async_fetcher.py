@@ -0,0 +1,262 @@
+"""Asyncio counterpart of fetcher.py.
+
+A single pooled aiohttp session is shared by every request. Concurrency is
+bounded twice: a global cap on requests in flight and a smaller cap per host,
+so raising the global limit never hammers one origin harder than configured.
+Extraction, the on-disk response cache, the raw archive and the adaptive
+rate limiter are shared with the blocking fetcher, and so are the retry
+policy and circuit breaker from retry.py.
+"""
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for --concurrency mode
+    aiohttp = None
+
+try:
+    from .config import CONCURRENCY, PER_HOST_CONCURRENCY, REQUEST_TIMEOUT
+    from .ratelimit import get_rate_limiter, parse_retry_after
+    from .retry import get_retry_policy, get_circuit_breaker, failure_reason
+    from .metrics import get_metrics
+    from .fetcher import (HEADERS, get_response_cache, get_raw_archive, parse_html, extract_listing_entries, extract_novel_details, extract_chapter_details,
+                          extract_chapter_links, chapter_list_page_url, chapter_list_pages_to_fetch, plan_chapters)
+except Exception:
+    from config import CONCURRENCY, PER_HOST_CONCURRENCY, REQUEST_TIMEOUT
+    from ratelimit import get_rate_limiter, parse_retry_after
+    from retry import get_retry_policy, get_circuit_breaker, failure_reason
+    from metrics import get_metrics
+    from fetcher import (HEADERS, get_response_cache, get_raw_archive, parse_html, extract_listing_entries, extract_novel_details, extract_chapter_details,
+                         extract_chapter_links, chapter_list_page_url, chapter_list_pages_to_fetch, plan_chapters)
+
+# Errors without a response that are worth another attempt
+RETRYABLE_ERRORS = (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) if aiohttp else ()
+
+
+def _timing_trace_config(metrics):
+    """aiohttp tracing hooks that time DNS lookups and new connections into stage_seconds."""
+    trace_config = aiohttp.TraceConfig()
+
+    def start(attr):
+        async def on_start(session, ctx, params):
+            setattr(ctx, attr, time.perf_counter())
+        return on_start
+
+    def end(attr, stage):
+        async def on_end(session, ctx, params):
+            started = getattr(ctx, attr, None)
+            if started is not None:
+                metrics.observe_stage(stage, time.perf_counter() - started)
+        return on_end
+
+    trace_config.on_dns_resolvehost_start.append(start('dns_started'))
+    trace_config.on_dns_resolvehost_end.append(end('dns_started', 'dns'))
+    trace_config.on_connection_create_start.append(start('connect_started'))
+    trace_config.on_connection_create_end.append(end('connect_started', 'connect'))
+    return trace_config
+
+
+class AsyncFetcher:
+    """Pooled HTTP client with a global and a per-host in-flight cap.
+
+    Use as an async context manager so the session is closed on exit:
+
+        async with AsyncFetcher(max_in_flight=32) as fetcher:
+            soup = await fetcher.fetch_page(url)
+    """
+
+    def __init__(self, max_in_flight=CONCURRENCY, per_host=PER_HOST_CONCURRENCY, timeout=REQUEST_TIMEOUT, cache=None, limiter=None,
+                 retry_policy=None, breaker=None, archive=None):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the async fetcher (pip install aiohttp)")
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.per_host = max(1, min(int(per_host), self.max_in_flight))
+        self.timeout = timeout
+        self.cache = cache if cache is not None else get_response_cache()
+        self.archive = archive if archive is not None else get_raw_archive()
+        self.limiter = limiter if limiter is not None else get_rate_limiter()
+        self.retry_policy = retry_policy if retry_policy is not None else get_retry_policy()
+        self.breaker = breaker if breaker is not None else get_circuit_breaker()
+        self._session = None
+        self._global_slots = None
+        self._host_slots = {}
+        self.in_flight = 0
+        self.metrics = get_metrics()
+        self.metrics.gauge('requests_in_flight', lambda: self.in_flight)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.per_host, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            trace_configs=[_timing_trace_config(self.metrics)],
+        )
+        self._global_slots = asyncio.Semaphore(self.max_in_flight)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.metrics.drop_gauges('requests_in_flight')
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return slot
+
+    async def fetch_raw(self, url, kind=None):
+        """Returns the response body as bytes, or None on any HTTP or network error.
+
+        Timeouts, dropped connections, 429 and 5xx are retried with backoff (see retry.py); 404 is final.
+        kind labels the page in the raw archive, when one is configured.
+        """
+        cache = self.cache
+        metrics = self.metrics
+        entry = cache.get(url) if cache else None
+        if entry and cache.is_fresh(entry, kind):
+            logging.getLogger(__name__).debug("Cache hit for %s", url)
+            metrics.inc('cache', result='hit')
+            if self.archive is not None:
+                self.archive.record(url, entry['body'], kind=kind, missing_only=True)
+            return entry['body']
+
+        await self.open()
+        failures = 0  # failed attempts charged to this URL (circuit-breaker trials are not)
+        retries = 0
+        while True:
+            trial = await self.breaker.wait_async(url)
+            try:
+                content = await self._request(url, entry, kind)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+                self.breaker.record(url, status)
+                headers = getattr(e, 'headers', None) if status is not None else None
+                retry_after = parse_retry_after(headers.get('Retry-After')) if headers else None
+                reason = failure_reason(status, e)
+                if not trial:  # a failed circuit-breaker trial says nothing about this URL
+                    failures += 1
+                delay = self.retry_policy.retry_delay(failures, status, isinstance(e, RETRYABLE_ERRORS), retry_after)
+                if delay is None:
+                    logging.getLogger(__name__).warning("Error fetching %s: %s", url, e)
+                    self.retry_policy.finished(url, retries, reason, status)
+                    return None
+                self.retry_policy.retrying(url, failures, reason, delay)
+                await asyncio.sleep(delay)
+                retries += 1
+                continue
+            self.breaker.record(url, 200)
+            self.retry_policy.finished(url, retries)
+            return content
+
+    async def _request(self, url, entry, kind=None):
+        """One GET of url (conditional when a cached entry exists). Raises aiohttp errors on failure."""
+        cache = self.cache
+        metrics = self.metrics
+        async with self._global_slots, self._host_slot(url):
+            await self.limiter.acquire_async(url)
+            started = time.monotonic()
+            metrics.inc('http_requests')
+            self.in_flight += 1
+            try:
+                headers = cache.conditional_headers(entry) if entry else None
+                async with self._session.get(url, headers=headers) as response:
+                    headers_at = time.monotonic()
+                    metrics.observe_stage('ttfb', headers_at - started)
+                    metrics.inc('http_responses', status=response.status)
+                    self.limiter.record(url, response.status, headers_at - started,
+                                        parse_retry_after(response.headers.get('Retry-After')))
+                    if response.status == 304 and entry:
+                        logging.getLogger(__name__).debug("Not modified: %s", url)
+                        metrics.inc('cache', result='revalidated')
+                        body = cache.revalidated(url, entry, response.headers)
+                        if self.archive is not None:
+                            self.archive.record(url, body, response.headers, kind, missing_only=True)
+                        return body
+                    response.raise_for_status()
+                    content = await response.read()
+                    metrics.observe_stage('download', time.monotonic() - headers_at)
+                    metrics.inc('http_bytes', len(content))
+                    if cache:
+                        cache.store(url, content, response.headers)
+                    if self.archive is not None:
+                        self.archive.record(url, content, response.headers, kind, response.status)
+                    return content
+            except aiohttp.ClientResponseError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.limiter.record(url)  # network-level failure, no status to report
+                metrics.inc('http_errors', error=type(e).__name__)
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def fetch_page(self, url, kind=None):
+        """Fetches and parses a web page."""
+        content = await self.fetch_raw(url, kind)
+        if content is None:
+            return None
+        with self.metrics.timer('parse'):
+            return parse_html(content, kind)
+
+
+async def get_novel_urls_from_list_page_async(fetcher, page_url):
+    """Async version of fetcher.get_novel_urls_from_list_page."""
+    return [url for url, _, _ in await get_listing_entries_async(fetcher, page_url)]
+
+
+async def get_listing_entries_async(fetcher, page_url):
+    """Async version of fetcher.get_listing_entries."""
+    soup = await fetcher.fetch_page(page_url, 'listing')
+    if not soup:
+        return []
+    with fetcher.metrics.timer('extract'):
+        return extract_listing_entries(soup, page_url)
+
+
+async def scrape_novel_details_async(fetcher, novel_url):
+    """Async version of fetcher.scrape_novel_details."""
+    logging.getLogger(__name__).info("Scraping novel details from: %s", novel_url)
+    soup = await fetcher.fetch_page(novel_url, 'novel')
+    if not soup:
+        return None
+    with fetcher.metrics.timer('extract'):
+        return extract_novel_details(soup, novel_url)
+
+
+async def scrape_chapter_details_async(fetcher, chapter_url, novel_id_str, chapter_number_expected):
+    """Async version of fetcher.scrape_chapter_details."""
+    logging.getLogger(__name__).info("  Attempting to scrape chapter: %s", chapter_url)
+    soup = await fetcher.fetch_page(chapter_url, 'chapter')
+    if not soup:
+        logging.getLogger(__name__).warning("  Chapter not found or error fetching: %s", chapter_url)
+        return None
+    with fetcher.metrics.timer('extract'):
+        return extract_chapter_details(soup, chapter_url, novel_id_str, chapter_number_expected)
+
+
+async def discover_chapters_async(fetcher, novel_url, links, page_count, start_chapter, max_chapters):
+    """Async version of fetcher.discover_chapters; the extra list pages are fetched concurrently."""
+    if not links:
+        return None
+    links = list(links)
+    page_urls = [chapter_list_page_url(novel_url, page_num)
+                 for page_num in chapter_list_pages_to_fetch(len(links), page_count, start_chapter, max_chapters)]
+    for page_url, soup in zip(page_urls, await asyncio.gather(*(fetcher.fetch_page(url, 'chapter_list') for url in page_urls))):
+        if soup:
+            links.extend(extract_chapter_links(soup, page_url))
+    return plan_chapters(links, start_chapter, max_chapters)
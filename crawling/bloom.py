@@ -0,0 +1,140 @@
+"""Scalable Bloom filter for large URL sets.
+
+A million URLs kept as Python strings cost well over 100 MB; a Bloom filter
+answers "seen before?" for the same set in a few MB (about 3.6 bytes per URL
+at a false-positive rate of 1e-6). A negative answer is always right; a
+positive one is wrong with probability error_rate.
+
+The filter grows in slices: once a slice holds `capacity` keys a new one is
+added with twice the capacity and half the error rate, so the overall rate
+stays below 2 x error_rate however many keys arrive and memory grows with
+the set instead of being sized for the worst case up front. Bit positions
+come from one 128-bit blake2b digest per key (double hashing), so they are
+the same in every process and run.
+
+save(path) writes the bit arrays to disk (atomically); BloomFilter.load(path)
+reads them back, or starts an empty filter when the file is missing or
+unreadable.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+
+MAGIC = b'BLOOM\x00\x01\n'
+_HEADER = struct.Struct('!8sQdI')  # magic, first slice capacity, error rate, slice count
+_SLICE = struct.Struct('!QIQQ')  # bits, hash count, keys added, capacity
+GROWTH = 2  # capacity multiplier for each new slice...
+TIGHTENING = 0.5  # ...and error rate multiplier
+
+
+def _hashes(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+
+class _Slice:
+    def __init__(self, capacity, error_rate, bits=None, hash_count=None, count=0, data=None):
+        self.capacity = capacity
+        self.bits = bits or max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = hash_count or max(1, round(self.bits / capacity * math.log(2)))
+        self.count = count
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+
+    def positions(self, h1, h2):
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hash_count)]
+
+    def __contains__(self, hashes):
+        data = self.data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(*hashes))
+
+    def add(self, hashes):
+        data = self.data
+        for pos in self.positions(*hashes):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+class BloomFilter:
+    """Set membership with false positives but no false negatives; add() only, no removal."""
+
+    def __init__(self, capacity=100_000, error_rate=1e-6):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate between 0 and 1")
+        self.capacity = int(capacity)
+        self.error_rate = error_rate
+        self._slices = [_Slice(self.capacity, error_rate)]
+
+    def __len__(self):
+        """Keys added (a key that looked present already is not counted)."""
+        return sum(s.count for s in self._slices)
+
+    def __contains__(self, key):
+        hashes = _hashes(key)
+        return any(hashes in s for s in self._slices)
+
+    @property
+    def nbytes(self):
+        return sum(len(s.data) for s in self._slices)
+
+    def add(self, key):
+        """Adds the key; returns True when it was not (apparently) in the filter yet."""
+        hashes = _hashes(key)
+        if any(hashes in s for s in self._slices):
+            return False
+        last = self._slices[-1]
+        if last.count >= last.capacity:
+            last = _Slice(last.capacity * GROWTH, self.error_rate * TIGHTENING ** len(self._slices))
+            self._slices.append(last)
+        last.add(hashes)
+        return True
+
+    def clear(self):
+        self._slices = [_Slice(self.capacity, self.error_rate)]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.bloom-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, self.capacity, self.error_rate, len(self._slices)))
+                for s in self._slices:
+                    f.write(_SLICE.pack(s.bits, s.hash_count, s.count, s.capacity))
+                    f.write(s.data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path, capacity=100_000, error_rate=1e-6):
+        """The filter saved at path, or a new empty one (capacity, error_rate) when there is none."""
+        try:
+            with open(path, 'rb') as f:
+                magic, saved_capacity, saved_rate, count = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != MAGIC:
+                    raise ValueError("not a Bloom filter file")
+                bloom = cls(saved_capacity, saved_rate)
+                slices = []
+                for _ in range(count):
+                    bits, hash_count, added, slice_capacity = _SLICE.unpack(f.read(_SLICE.size))
+                    data = bytearray(f.read((bits + 7) // 8))
+                    if len(data) != (bits + 7) // 8:
+                        raise ValueError("truncated file")
+                    slices.append(_Slice(slice_capacity, saved_rate, bits, hash_count, added, data))
+        except FileNotFoundError:
+            return cls(capacity, error_rate)
+        except (OSError, ValueError, struct.error) as e:
+            logging.getLogger(__name__).warning("Could not load Bloom filter %s (%s); starting an empty one.", path, e)
+            return cls(capacity, error_rate)
+        if slices:
+            bloom._slices = slices
+        return bloom
@@ -0,0 +1,113 @@
+"""Persistent HTTP response cache with conditional revalidation.
+
+Each response body is stored gzip-compressed under `data/http_cache/`, one file
+per URL, together with its ETag / Last-Modified validators. Entries younger
+than the TTL of the first matching rule in CACHE_TTL_RULES are served without
+touching the network; older ones are revalidated with a conditional GET and a
+304 answer refreshes the entry instead of re-downloading it. Page kinds in
+revalidate_kinds (set by main.py --update) are revalidated whatever their age.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+try:
+    from .config import HTTP_CACHE_DIR, CACHE_TTL_RULES, CACHE_DEFAULT_TTL
+except Exception:
+    from config import HTTP_CACHE_DIR, CACHE_TTL_RULES, CACHE_DEFAULT_TTL
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, ttl_rules=CACHE_TTL_RULES, default_ttl=CACHE_DEFAULT_TTL, revalidate_kinds=()):
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        self.revalidate_kinds = frozenset(revalidate_kinds)
+        self._ttl_rules = [(re.compile(pattern), ttl) for pattern, ttl in ttl_rules]
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.gz')
+
+    def ttl_for(self, url):
+        """Seconds a cached copy of url stays fresh without revalidation."""
+        for pattern, ttl in self._ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def get(self, url):
+        """Returns the cached entry dict (with the body under 'body'), or None."""
+        try:
+            with gzip.open(self._path(url), 'rb') as f:
+                header = json.loads(f.readline())
+                header['body'] = f.read()
+        except (OSError, ValueError, EOFError):
+            return None
+        if header.get('url') != url:
+            return None
+        return header
+
+    def is_fresh(self, entry, kind=None):
+        """Whether entry may be served without a request; pages of a kind in revalidate_kinds never are."""
+        if entry is None or kind in self.revalidate_kinds:
+            return False
+        return time.time() - entry.get('stored_at', 0) < self.ttl_for(entry['url'])
+
+    def conditional_headers(self, entry):
+        """Request headers that turn a GET into a conditional GET for entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, body, response_headers=None):
+        response_headers = response_headers or {}
+        header = {
+            'url': url,
+            'stored_at': time.time(),
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+        }
+        self._write(url, header, body)
+
+    def revalidated(self, url, entry, response_headers=None):
+        """Refreshes entry after a 304 Not Modified and returns its cached body."""
+        response_headers = response_headers or {}
+        header = {
+            'url': url,
+            'stored_at': time.time(),
+            'etag': response_headers.get('ETag') or entry.get('etag'),
+            'last_modified': response_headers.get('Last-Modified') or entry.get('last_modified'),
+        }
+        self._write(url, header, entry['body'])
+        return entry['body']
+
+    def _write(self, url, header, body):
+        # A cache that cannot be written must never fail the fetch itself.
+        path = self._path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        except OSError as e:
+            logging.getLogger(__name__).warning("Could not cache %s: %s", url, e)
+            return
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                f.write(body)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.getLogger(__name__).warning("Could not cache %s: %s", url, e)
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
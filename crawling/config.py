@@ -1,7 +1,102 @@
 # Configuration constants for the crawler
-BASE_URL = "https://truyenfull.vision/"
+# A few settings can be overridden with CRAWLER_* environment variables, e.g. to point a run at the
+# local benchmark fixture server (benchmarks/fixture_server.py) without editing this file.
+import os
+
+BASE_URL = os.environ.get("CRAWLER_BASE_URL", "https://truyenfull.vision/")
+DATA_DIR = os.environ.get("CRAWLER_DATA_DIR", "data")  # Novel folders, genres.json and every state file below
 HOT_NOVELS_PATH = "danh-sach/truyen-hot/"
-MAX_STORIES_TO_CRAWL = 200  # You can change this value
-MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL = 100  # New constant
-REQUEST_DELAY = 1  # Seconds to wait between requests
+SEED_LISTS = [path for path in os.environ.get("CRAWLER_SEED_LISTS", HOT_NOVELS_PATH).split(",") if path]  # Listing paths walked in order, e.g. add "danh-sach/truyen-full/"
+FRONTIER_PREFETCH = 2  # Listing pages fetched ahead of the novel workers
+FRONTIER_BLOOM_PATH = os.path.join(DATA_DIR, "frontier.bloom")  # Novel URLs already decided, kept across runs (see frontier.py)
+FRONTIER_BLOOM_CAPACITY = 100_000  # URLs in the filter's first slice; it grows in doubling slices past that
+FRONTIER_BLOOM_ERROR_RATE = 1e-6  # Chance that a new novel URL is mistaken for a seen one
+SITEMAP_URL = os.environ.get("CRAWLER_SITEMAP_URL", BASE_URL + "sitemap.xml")  # Sitemap index read by main.py --sitemap (see sitemap.py)
+SITEMAP_SKIP_SEGMENTS = ("danh-sach", "the-loai", "tac-gia", "tim-kiem", "ajax.php")  # First path segments of sitemap URLs that are not novels
+SITEMAP_BATCH = 1000  # Novels recorded in the state store per transaction while a sitemap is read
+MAX_STORIES_TO_CRAWL = int(os.environ.get("CRAWLER_MAX_STORIES", 200))  # You can change this value
+MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL = int(os.environ.get("CRAWLER_MAX_CHAPTERS", 100))  # New constant
+REQUEST_DELAY = 1  # Starting gap between requests to one host; the adaptive limiter tunes it from there
 DEFAULT_MISSING_INFO = "Không có thông tin"
+REQUEST_TIMEOUT = 30  # Seconds before a single request is abandoned
+CONCURRENCY = 16  # Global cap on in-flight requests for --concurrency mode
+PIPELINE_WORKERS = {  # Workers per stage of the --concurrency pipeline
+    "listing": FRONTIER_PREFETCH,  # listing pages fetched concurrently ahead of the novel workers
+    "novel": 2,
+    "chapter": 8,  # each worker probes one novel's chapters at a time
+    "parse": 2,
+    "persist": 2,
+}
+SCHEDULER_WINDOW = 64  # Frontier entries ranked together; the best one is crawled first (1 keeps listing order)
+SCHEDULER_WEIGHTS = {  # Novel priority = weighted sum of scores in [0, 1] (see scheduler.py)
+    "rank": 1.0,  # listed early
+    "staleness": 0.5,  # not crawled for a while
+    "missing": 1.0,  # chapters listed but not saved yet
+    "failures": 1.0,  # failed chapters and fetches (subtracted)
+}
+SCHEDULER_RANK_SCALE = 100  # Listing position at which the rank score halves
+SCHEDULER_STALE_DAYS = 7.0  # Days since a novel was last touched at which staleness scores 1
+SCHEDULER_FAILURE_SCALE = 10  # Failures at which the failure score reaches 1
+SCHEDULER_REQUEST_BUDGET = int(os.environ.get("CRAWLER_REQUEST_BUDGET", 0))  # Page fetches per run; 0: unlimited
+SCHEDULER_NOVEL_REQUEST_BUDGET = int(os.environ.get("CRAWLER_NOVEL_REQUEST_BUDGET", 0))  # Page fetches per novel per run; 0: unlimited
+SCHEDULER_ACTIVE_NOVELS = 4  # Novels crawled side by side, taking turns (the pipeline keeps at least one per chapter worker)
+SCHEDULER_CHAPTER_SLICE = 8  # Chapters a novel fetches per turn before the next novel's turn
+EXTRACT_WORKERS = 0  # Processes for HTML extraction in --concurrency mode; 0 extracts on the event loop
+CHAPTER_WINDOW = 8  # Chapters of one novel fetched concurrently when its chapter list is known
+PIPELINE_QUEUE_SIZE = 32  # Bound on each inter-stage queue; keeps memory flat via backpressure
+PER_HOST_CONCURRENCY = 4  # Cap on in-flight requests to any single host
+HTTP_CACHE_ENABLED = True  # Keep fetched pages on disk and revalidate them with conditional GETs
+HTTP_CACHE_DIR = os.path.join(DATA_DIR, "http_cache")
+WARC_DIR = os.path.join(DATA_DIR, "warc")  # Raw response archive written with main.py --warc and read by --replay (see warc.py)
+WARC_MAX_FILE_SIZE = 1024 ** 3  # Bytes of compressed records per .warc.gz file before a new one is started
+REPLAY_WORKERS = os.cpu_count() or 4  # Processes re-extracting and saving novels in main.py --replay
+WRITER_METADATA_EVERY = 20  # Rewrite a novel's metadata.json after this many new chapters...
+WRITER_METADATA_INTERVAL = 10.0  # ...or after this many seconds, whichever comes first (and always when the novel ends)
+WRITER_FSYNC_BATCH = 16  # Chapter files fsynced together; 0 leaves flushing to the OS
+WRITER_BACKGROUND = True  # Write chapter files on a per-novel thread so fetching never waits on disk
+CHAPTER_STORAGE = "txt"  # "txt": one file per chapter; "archive": compressed frames in data/<novel>/chapters.pack
+ARCHIVE_CODEC = "zlib"  # Frame compression for the archive: zlib, zstd (needs the zstandard package) or none
+SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search.db")  # Full-text index of saved chapters kept with main.py --search-index (see search.py)
+SEARCH_FLUSH_DOCS = 256  # Chapters buffered before their postings are written in one transaction
+SEARCH_MAX_BLOCKS = 8  # Posting blocks a term may have before its newest ones are merged
+EXPORT_DIR = "export"  # Where NDJSON exports for mongoimport go (main.py --export, export.py)
+EXPORT_WORKERS = 4  # Novel folders exported in parallel by export.py
+STATE_DB_PATH = os.environ.get("CRAWLER_STATE_DB", os.path.join(DATA_DIR, "state.db"))  # SQLite (WAL) crawl state; a legacy data/state.json is imported once
+ID_BLOCK_SIZE = 1000  # NOV/CHA/GEN IDs reserved per database round trip (see ids.py)
+COORDINATOR_PATH = os.path.join(DATA_DIR, "coordinator.db")  # Shared work queue for several crawler processes (main.py --coordinator)
+COORDINATOR_LEASE = 300.0  # Seconds a worker holds a novel without a heartbeat before others may reclaim it
+COORDINATOR_HEARTBEAT = 60.0  # Seconds between a worker's lease renewals
+COORDINATOR_LEASE_BATCH = 4  # Novels leased per queue round trip
+COORDINATOR_QUEUE_AHEAD = 64  # Novels a --discover worker keeps queued for the others
+COORDINATOR_MAX_ATTEMPTS = 3  # Leases of one novel that may fail or expire before it is set aside as failed
+COORDINATOR_POLL = 5.0  # Seconds an idle worker waits for other workers' leases to finish or expire
+METRICS_FILE = os.path.join(DATA_DIR, "stats.json")  # Periodic JSON snapshot of crawl metrics (see metrics.py)
+METRICS_INTERVAL = 10.0  # Seconds between stats file rewrites
+METRICS_PORT = 0  # Serve Prometheus text on 127.0.0.1:PORT/metrics; 0 disables the endpoint
+PROFILE_PATH = os.path.join(DATA_DIR, "profile.pstats")  # Where main.py --profile dumps cProfile stats
+DUPLICATE_DETECTION = True  # Skip chapters that repeat another chapter of the novel, and stop probing at one (soft 404)
+SIMHASH_MAX_DISTANCE = 3  # Differing SimHash bits (of 64) still counted as the same text; must stay below 4
+NEAR_DUPLICATE_MIN_WORDS = 30  # Shorter chapters are only compared by exact hash
+CACHE_DEFAULT_TTL = 24 * 3600  # Seconds a cached page is served without revalidation
+CACHE_TTL_RULES = [  # (URL regex, TTL seconds); first match wins
+    (r"/danh-sach/", 15 * 60),  # listing pages change constantly
+    (r"sitemap[^/]*\.xml", 60 * 60),  # sitemaps are regenerated a few times a day
+    (r"/chuong-\d+/", 365 * 24 * 3600),  # chapter pages practically never change
+]
+UPDATE_REVALIDATE_KINDS = ('novel', 'chapter_list', 'chapter')  # Pages --update revalidates with a conditional GET however fresh the cached copy is
+RATE_LIMIT_INITIAL = float(os.environ.get("CRAWLER_RATE_LIMIT_INITIAL", 1.0 / max(REQUEST_DELAY, 0.05)))  # Requests/s per host before any feedback
+RATE_LIMIT_MIN = 0.2  # Never slow a host below this many requests/s
+RATE_LIMIT_MAX = float(os.environ.get("CRAWLER_RATE_LIMIT_MAX", 20.0))  # Never exceed this many requests/s per host
+RATE_LIMIT_BURST = 2  # Tokens a host bucket can hold
+RATE_LIMIT_INCREASE = 0.1  # Additive increase (requests/s) per healthy response
+RATE_LIMIT_DECREASE = 0.5  # Multiplicative decrease on 429/503, Retry-After, errors or latency spikes
+RATE_LIMIT_LATENCY_FACTOR = 3.0  # Latency above baseline x factor counts as the origin struggling
+RETRY_MAX_ATTEMPTS = 4  # Attempts per page for timeouts, dropped connections, 429 and 5xx; 404 is never retried
+RETRY_BASE_DELAY = 1.0  # Backoff before retry n is uniform in [0, base x 2^n] (full jitter)...
+RETRY_MAX_DELAY = 30.0  # ...capped at this many seconds
+RETRY_AFTER_MAX = 300.0  # Longest Retry-After honoured before a retry
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive network errors/5xx from one host that pause all requests to it
+CIRCUIT_COOLDOWN = 30.0  # Seconds a host stays paused before one trial request...
+CIRCUIT_MAX_COOLDOWN = 600.0  # ...doubling after each failed trial, up to this
+PARSER_BACKEND = "html.parser"  # "html.parser" or "lxml" (faster, needs the lxml package)
+TARGETED_PARSING = True  # Build only the page sub-trees the extractors read
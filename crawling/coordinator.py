@@ -0,0 +1,387 @@
+"""Work queue shared by several crawler processes, possibly on several machines.
+
+A Coordinator is a SQLite database (COORDINATOR_PATH) on a volume every
+worker can reach. It holds:
+
+  work       one row per novel URL: queued, leased (to a worker, until
+             lease_until), done or failed, plus its listing signals
+  workers    the processes taking part, their last heartbeat and whether
+             they are still discovering novels
+  id_blocks  next free NOV/CHA/GEN number (see ids.py); a worker reserves
+             ID_BLOCK_SIZE at a time and mints them without asking again
+  genres     genre name -> genreId, so every worker gives a genre the same ID
+
+A worker started with --discover walks the seed lists and keeps
+COORDINATOR_QUEUE_AHEAD novels queued. Workers lease a few novels at a
+time (COORDINATOR_LEASE_BATCH), and a heartbeat thread renews the worker's
+leases every COORDINATOR_HEARTBEAT seconds. A lease that runs out (its worker died or hung) goes back to the queue at the
+next lease or heartbeat of any worker; after COORDINATOR_MAX_ATTEMPTS
+expired or failed leases the novel is set aside as failed; a lease handed
+back untouched (release() when a budget ran out, or close()) does not count.
+A worker that finishes a novel whose lease was meanwhile taken over is
+ignored. An idle worker waits while others still hold leases or discover, and stops once
+the queue is drained.
+
+The database uses SQLite's rollback journal rather than WAL, since WAL
+needs shared memory that processes on different machines do not have. It
+relies on the shared file system's POSIX locks, which NFS setups do not
+always provide. Each machine should keep its own state.db (CRAWLER_STATE_DB):
+a novel picked up by another worker resumes from the chapters on the shared
+volume.
+
+LeasedFrontier gives the crawl the same interface as frontier.Frontier:
+entries() yields the novels this process leased, and decided() reports
+back. Given a frontier, the process also walks the seed lists and
+enqueues what it finds.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    from .config import (COORDINATOR_PATH, COORDINATOR_LEASE, COORDINATOR_HEARTBEAT, COORDINATOR_LEASE_BATCH,
+                         COORDINATOR_MAX_ATTEMPTS, COORDINATOR_POLL, COORDINATOR_QUEUE_AHEAD)
+    from .frontier import FrontierEntry, WAITING
+    from .ids import ID_BLOCKS_SCHEMA, generate_genre_id, reserve_block
+    from .metrics import get_metrics
+except Exception:
+    from config import (COORDINATOR_PATH, COORDINATOR_LEASE, COORDINATOR_HEARTBEAT, COORDINATOR_LEASE_BATCH,
+                        COORDINATOR_MAX_ATTEMPTS, COORDINATOR_POLL, COORDINATOR_QUEUE_AHEAD)
+    from frontier import FrontierEntry, WAITING
+    from ids import ID_BLOCKS_SCHEMA, generate_genre_id, reserve_block
+    from metrics import get_metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work (
+    url TEXT PRIMARY KEY,
+    seed TEXT,
+    page INTEGER,
+    latest INTEGER,
+    label TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS work_state ON work (state, enqueued_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    discovering INTEGER NOT NULL DEFAULT 0,
+    started_at REAL,
+    heartbeat_at REAL
+);
+CREATE TABLE IF NOT EXISTS genres (
+    name TEXT PRIMARY KEY,
+    genre_id TEXT NOT NULL
+);
+"""
+BUSY_TIMEOUT = 60.0  # Seconds a statement waits for another process's write lock
+
+
+class Coordinator:
+    """One worker's handle on the shared queue. start() joins the crawl, close() leaves it."""
+
+    def __init__(self, path=COORDINATOR_PATH, worker_id=None, lease_seconds=COORDINATOR_LEASE,
+                 heartbeat_seconds=COORDINATOR_HEARTBEAT, max_attempts=COORDINATOR_MAX_ATTEMPTS):
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = min(heartbeat_seconds, lease_seconds / 3)
+        self.max_attempts = max(1, int(max_attempts))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute(ID_BLOCKS_SCHEMA)
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _write(self, func):
+        """Runs func(conn) in one write transaction (BEGIN IMMEDIATE) and returns its result."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- membership ------------------------------------------------------------------
+    def start(self, discovering=False):
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO workers (id, host, pid, discovering, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)",
+                      (self.worker_id, socket.gethostname(), os.getpid(), int(discovering), now, now))
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='coordinator-heartbeat', daemon=True)
+        self._heartbeat.start()
+        logging.getLogger(__name__).info("Joined crawl coordinator %s as %s", self.path, self.worker_id)
+        return self
+
+    def close(self):
+        """Stops the heartbeat, hands back unfinished leases and leaves the crawl."""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        with self._lock:
+            released = self._execute("""UPDATE work SET state = 'queued', owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?
+                                        WHERE owner = ? AND state = 'leased'""", (time.time(), self.worker_id)).rowcount
+            self._execute("DELETE FROM workers WHERE id = ?", (self.worker_id,))
+            self._conn.close()
+        if released:
+            logging.getLogger(__name__).info("Handed %d unfinished novels back to the queue", released)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except sqlite3.Error as e:
+                logging.getLogger(__name__).warning("Coordinator heartbeat failed: %s", e)
+
+    def heartbeat(self):
+        """Renews this worker's leases and reclaims everyone's expired ones."""
+        now = time.time()
+
+        def renew(conn):
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE id = ?", (now, self.worker_id))
+            conn.execute("UPDATE work SET lease_until = ? WHERE owner = ? AND state = 'leased'", (now + self.lease_seconds, self.worker_id))
+            return self._reclaim(conn, now)
+
+        return self._write(renew)
+
+    def _reclaim(self, conn, now):
+        failed = conn.execute("""UPDATE work SET state = 'failed', owner = NULL, lease_until = NULL, updated_at = ?
+                                 WHERE state = 'leased' AND lease_until < ? AND attempts >= ?""", (now, now, self.max_attempts)).rowcount
+        requeued = conn.execute("""UPDATE work SET state = 'queued', owner = NULL, lease_until = NULL, updated_at = ?
+                                   WHERE state = 'leased' AND lease_until < ?""", (now, now)).rowcount
+        if failed or requeued:
+            get_metrics().inc('coordinator_reclaims', failed + requeued)
+            logging.getLogger(__name__).warning("Reclaimed %d expired leases (%d set aside after %d attempts)", failed + requeued, failed, self.max_attempts)
+        return failed + requeued
+
+    # --- the queue -------------------------------------------------------------------
+    def enqueue(self, entries, reopen=False):
+        """Adds FrontierEntry-like items to the queue; known URLs are left as they are unless reopen is set
+        (then a done or failed novel is queued again). Returns how many were queued."""
+        now = time.time()
+        rows = [(entry.url, entry.seed, entry.page, entry.latest, entry.label, now, now) for entry in entries]
+        if not rows:
+            return 0
+        conflict = ("DO UPDATE SET state = 'queued', attempts = 0, updated_at = excluded.updated_at WHERE state IN ('done', 'failed')"
+                    if reopen else "DO NOTHING")
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany(f"""INSERT INTO work (url, seed, page, latest, label, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT (url) {conflict}""", rows)
+            return conn.total_changes - before
+
+        queued = self._write(insert)
+        get_metrics().inc('coordinator_enqueued', queued)
+        return queued
+
+    def lease(self, count=COORDINATOR_LEASE_BATCH):
+        """Leases up to count queued novels to this worker, oldest first, as FrontierEntry items."""
+        now = time.time()
+
+        def take(conn):
+            self._reclaim(conn, now)
+            rows = conn.execute("SELECT url, seed, page, latest, label FROM work WHERE state = 'queued' ORDER BY enqueued_at, url LIMIT ?",
+                                (count,)).fetchall()
+            conn.executemany("UPDATE work SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE url = ?",
+                             [(self.worker_id, now + self.lease_seconds, now, row['url']) for row in rows])
+            return [FrontierEntry(row['url'], row['latest'], row['label'], row['seed'], row['page']) for row in rows]
+
+        leased = self._write(take)
+        if leased:
+            get_metrics().inc('coordinator_leases', len(leased))
+        return leased
+
+    def finish(self, url, ok=True):
+        """Reports a leased novel as done, or (ok=False) hands it back for another attempt. False when the lease was lost."""
+        now = time.time()
+        with self._lock:
+            if ok:
+                cursor = self._execute("UPDATE work SET state = 'done', owner = NULL, lease_until = NULL, updated_at = ? WHERE url = ? AND owner = ? AND state = 'leased'",
+                                       (now, url, self.worker_id))
+            else:
+                cursor = self._execute("""UPDATE work SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                                          owner = NULL, lease_until = NULL, updated_at = ? WHERE url = ? AND owner = ? AND state = 'leased'""",
+                                       (self.max_attempts, now, url, self.worker_id))
+        if not cursor.rowcount:
+            logging.getLogger(__name__).warning("Lease on %s expired before it finished; another worker may redo it.", url)
+        return bool(cursor.rowcount)
+
+    def release(self, url):
+        """Hands a leased novel back to the queue without using up an attempt (e.g. a request budget stopped it). False when the lease was lost."""
+        with self._lock:
+            cursor = self._execute("""UPDATE work SET state = 'queued', owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?
+                                      WHERE url = ? AND owner = ? AND state = 'leased'""", (time.time(), url, self.worker_id))
+        if not cursor.rowcount:
+            logging.getLogger(__name__).warning("Lease on %s expired before it was handed back; another worker may redo it.", url)
+        return bool(cursor.rowcount)
+
+    def discovery_finished(self):
+        self._execute("UPDATE workers SET discovering = 0 WHERE id = ?", (self.worker_id,))
+
+    def others_busy(self):
+        """Whether novels may still arrive: leases held (they come back if they expire) or a live worker discovering."""
+        with self._lock:
+            if self._execute("SELECT 1 FROM work WHERE state = 'leased' LIMIT 1").fetchone():
+                return True
+            return self._execute("SELECT 1 FROM workers WHERE discovering = 1 AND id != ? AND heartbeat_at > ? LIMIT 1",
+                                 (self.worker_id, time.time() - self.lease_seconds)).fetchone() is not None
+
+    def counts(self):
+        """Novels per state: {'queued': n, 'leased': n, 'done': n, 'failed': n}."""
+        counts = dict.fromkeys(('queued', 'leased', 'done', 'failed'), 0)
+        for row in self._execute("SELECT state, COUNT(*) AS n FROM work GROUP BY state"):
+            counts[row['state']] = row['n']
+        return counts
+
+    # --- shared IDs ------------------------------------------------------------------
+    def reserve_ids(self, kind, count, floor=0):
+        with self._lock:
+            return reserve_block(self._conn, kind, count, floor)
+
+    def genre_id(self, name):
+        """The crawl-wide genreId of a genre name, minted on first use."""
+        with self._lock:
+            row = self._execute("SELECT genre_id FROM genres WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                return row['genre_id']
+            candidate = generate_genre_id()
+
+            def claim(conn):
+                conn.execute("INSERT INTO genres (name, genre_id) VALUES (?, ?) ON CONFLICT (name) DO NOTHING", (name, candidate))
+                return conn.execute("SELECT genre_id FROM genres WHERE name = ?", (name,)).fetchone()['genre_id']
+
+            return self._write(claim)
+
+
+class LeasedFrontier:
+    """frontier.Frontier's interface over a Coordinator: this process crawls the novels it leases.
+
+    With a frontier given, the process also discovers: before leasing it walks
+    the seed lists far enough to keep `ahead` novels queued (incomplete novels
+    of this process's state store are queued again first). Without one it only
+    works off the queue, waiting while other workers hold leases or discover.
+    `order`, if set, sorts each leased batch (CrawlScheduler.rank). While
+    leases are held but none is free, entries() yields frontier.WAITING
+    instead of blocking, so the caller can crawl the novels it has; the
+    caller sleeps `poll` seconds when it has none.
+    """
+
+    def __init__(self, coordinator, frontier=None, batch=COORDINATOR_LEASE_BATCH, ahead=COORDINATOR_QUEUE_AHEAD, poll=COORDINATOR_POLL):
+        self.coordinator = coordinator
+        self.frontier = frontier
+        self.batch = max(1, int(batch))
+        self.ahead = max(self.batch, int(ahead))
+        self.poll = poll
+        self.order = None
+
+    def _enqueue(self, chunk):
+        self.coordinator.enqueue([e for e in chunk if e.seed is None], reopen=True)
+        self.coordinator.enqueue([e for e in chunk if e.seed is not None])
+        for entry in chunk:
+            # Handed over to the queue: from the local frontier's point of view the novel is decided.
+            self.frontier.decided(entry)
+
+    def _wants_more(self):
+        return self.coordinator.counts()['queued'] < self.ahead
+
+    def _finish_discovery(self):
+        self.coordinator.discovery_finished()
+        logging.getLogger(__name__).info("Discovery finished; working off the queue.")
+
+    def entries(self, fetch_entries):
+        discovered = self.frontier.entries(fetch_entries) if self.frontier is not None else None
+        try:
+            while True:
+                if discovered is not None and self._wants_more():
+                    chunk = [entry for _, entry in zip(range(self.batch), discovered)]
+                    if chunk:
+                        self._enqueue(chunk)
+                    else:
+                        discovered = None
+                        self._finish_discovery()
+                    continue
+                leased = self.coordinator.lease(self.batch)
+                if leased:
+                    yield from (self.order(leased) if self.order else leased)
+                elif discovered is None and self.coordinator.others_busy():
+                    # The caller may hold leased novels itself: let it crawl them (and sleep when it has none)
+                    yield WAITING
+                elif discovered is None:
+                    return
+        finally:
+            if discovered is not None:
+                discovered.close()
+
+    async def entries_async(self, fetch_entries, prefetch=None):
+        discovered = self.frontier.entries_async(fetch_entries, prefetch) if self.frontier is not None else None
+        try:
+            while True:
+                if discovered is not None and await asyncio.to_thread(self._wants_more):
+                    chunk = []
+                    async for entry in discovered:
+                        chunk.append(entry)
+                        if len(chunk) >= self.batch:
+                            break
+                    if chunk:
+                        await asyncio.to_thread(self._enqueue, chunk)
+                    else:
+                        await discovered.aclose()
+                        discovered = None
+                        await asyncio.to_thread(self._finish_discovery)
+                    continue
+                leased = await asyncio.to_thread(self.coordinator.lease, self.batch)
+                if leased and self.order:
+                    leased = await asyncio.to_thread(self.order, leased)
+                if leased:
+                    for entry in leased:
+                        yield entry
+                elif discovered is None and await asyncio.to_thread(self.coordinator.others_busy):
+                    await asyncio.sleep(self.poll)
+                elif discovered is None:
+                    return
+        finally:
+            if discovered is not None:
+                await discovered.aclose()
+
+    def decided(self, entry, remember=True):
+        self.coordinator.finish(entry.url, remember)
+
+    def deferred(self, entry):
+        self.coordinator.release(entry.url)
+
+    def reset(self):
+        if self.frontier is not None:
+            self.frontier.reset()
+
+    def save(self):
+        if self.frontier is not None:
+            self.frontier.save()
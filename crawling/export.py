@@ -0,0 +1,250 @@
+"""Streaming NDJSON export of novels, chapters and genres for mongoimport.
+
+Each collection goes to its own file with one JSON document per line
+(`novels.ndjson`, `chapters.ndjson`, `genres.ndjson`, optionally gzipped),
+ready for e.g.
+
+    mongoimport --collection chapters --file export/chapters.ndjson
+
+(gunzip -c first for .gz files). Documents are written as they are produced and never
+collected, so memory stays flat however large the crawl is. Every document
+carries its novelId/chapterId/genreId as `_id`, so re-imports and a resumed
+or --update crawl export can be loaded with `mongoimport --mode upsert`
+(the last copy of a document wins).
+
+Two sources:
+- CrawlExporter streams entities while the crawl runs (main.py --export DIR);
+- export_data_dir rebuilds them from a data/ folder, one novel folder per
+  worker process. Workers write per-novel part files that are concatenated
+  in folder order, so the output does not depend on the worker count.
+
+Rebuilt chapters carry the saved plain text as `content` and fresh synthetic
+fields (views, dates), drawn in batches per novel from a generator seeded
+with the novelId (synthetic.py), so an export is reproducible. Novels get
+chapterList/chapterCount/wordCount from the chapters actually on disk.
+
+    python crawling/export.py [--data-dir data] [--out export] [--gzip] [--workers N]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from .config import EXPORT_DIR, EXPORT_WORKERS, DATA_DIR
+    from .saver import iter_saved_chapters
+    from .utils import generate_random_chapter_fields
+    from .synthetic import iter_chapter_fields, seed_for
+    from .textnorm import word_count
+except Exception:
+    from config import EXPORT_DIR, EXPORT_WORKERS, DATA_DIR
+    from saver import iter_saved_chapters
+    from utils import generate_random_chapter_fields
+    from synthetic import iter_chapter_fields, seed_for
+    from textnorm import word_count
+
+COLLECTIONS = ('novels', 'chapters', 'genres')
+DOCUMENT_IDS = {'novels': 'novelId', 'chapters': 'chapterId', 'genres': 'genreId'}
+
+
+def collection_filename(collection, compress=False):
+    return f"{collection}.ndjson" + ('.gz' if compress else '')
+
+
+def _open_text(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def with_id(collection, doc):
+    """doc with its stable ID (novelId/chapterId/genreId) as the MongoDB `_id`."""
+    return {'_id': doc[DOCUMENT_IDS[collection]], **doc}
+
+
+def dumps(doc):
+    return json.dumps(doc, ensure_ascii=False, separators=(',', ':'))
+
+
+class NdjsonWriter:
+    """Thread-safe line writer for one collection file."""
+
+    def __init__(self, path, compress=False, append=False):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = _open_text(path, 'a' if append else 'w', compress)
+
+    def write(self, doc):
+        line = dumps(doc) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CrawlExporter:
+    """Streams entities into out_dir while crawling.
+
+    Files are appended to, so a resumed crawl continues the same export
+    (a gzip file then simply holds several gzip members). A chapter saved
+    again (--update, replaced chapters) or a novel finished again is
+    written again under the same `_id`; import with --mode upsert.
+    """
+
+    def __init__(self, out_dir=EXPORT_DIR, compress=False):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self._writers = {c: NdjsonWriter(os.path.join(out_dir, collection_filename(c, compress)), compress, append=True)
+                         for c in COLLECTIONS}
+
+    def novel(self, novel):
+        self._writers['novels'].write(with_id('novels', novel))
+
+    def chapter(self, chapter):
+        self._writers['chapters'].write(with_id('chapters', chapter))
+
+    def genre(self, genre):
+        self._writers['genres'].write(with_id('genres', genre))
+
+    def counts(self):
+        return {c: w.count for c, w in self._writers.items()}
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def chapter_document(novel_id, saved, fields=None):
+    """A ChapterEntity rebuilt from a saved chapter (see saver.iter_saved_chapters).
+
+    fields: its synthetic fields (see synthetic.py); drawn on the spot when omitted.
+    """
+    chapter = {
+        'novelId': novel_id,
+        'chapterId': saved['chapterId'],
+        'chapterNumber': saved['chapterNumber'],
+        'title': saved['title'],
+        'content': saved['text'],
+        'status': "PUBLISHED",
+        'approved': True,
+        '_class': "com.content.content_service.models.ChapterEntity",
+    }
+    chapter.update(fields if fields is not None else generate_random_chapter_fields())
+    chapter['wordCount'] = word_count(saved['text'])
+    return chapter
+
+
+def _export_novel_dir(novel_dir, parts_dir, part_name, compress):
+    """Writes one novel folder's chapters and novel document to part files. Returns (novel part, chapter part, chapters)."""
+    with open(os.path.join(novel_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+        novel = json.load(f)
+    chapter_part = os.path.join(parts_dir, f"{part_name}.chapters")
+    novel_part = os.path.join(parts_dir, f"{part_name}.novels")
+    chapter_ids = []
+    word_count = 0
+    with _open_text(chapter_part, 'w', compress) as out:
+        synthetic = iter_chapter_fields(seed_for(novel.get('novelId')))
+        for saved, fields in zip(iter_saved_chapters(novel_dir), synthetic):
+            chapter = chapter_document(novel.get('novelId'), saved, fields)
+            out.write(dumps(with_id('chapters', chapter)) + '\n')
+            chapter_ids.append(chapter['chapterId'])
+            word_count += chapter['wordCount']
+    novel['chapterList'] = chapter_ids
+    novel['chapterCount'] = len(chapter_ids)
+    novel['wordCount'] = word_count
+    with _open_text(novel_part, 'w', compress) as out:
+        out.write(dumps(with_id('novels', novel)) + '\n')
+    return novel_part, chapter_part, len(chapter_ids)
+
+
+def _export_novel_job(args):
+    return _export_novel_dir(*args)
+
+
+def novel_dirs(data_dir):
+    """Novel folders under data_dir (those holding a metadata.json), sorted by name."""
+    for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'metadata.json')):
+            yield entry.path
+
+
+def _append_part(part_path, out):
+    with open(part_path, 'rb') as part:
+        shutil.copyfileobj(part, out)
+    os.remove(part_path)
+
+
+def export_data_dir(data_dir=DATA_DIR, out_dir=EXPORT_DIR, compress=False, workers=EXPORT_WORKERS):
+    """Exports every novel folder under data_dir (plus data_dir/genres.json) to NDJSON files in out_dir.
+
+    Returns {collection: documents written}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    counts = dict.fromkeys(COLLECTIONS, 0)
+
+    genres_path = os.path.join(data_dir, 'genres.json')
+    genres_writer = NdjsonWriter(os.path.join(out_dir, collection_filename('genres', compress)), compress)
+    try:
+        if os.path.exists(genres_path):
+            with open(genres_path, 'r', encoding='utf-8') as f:
+                for genre in json.load(f):
+                    genres_writer.write(with_id('genres', genre))
+    finally:
+        genres_writer.close()
+    counts['genres'] = genres_writer.count
+
+    parts_dir = tempfile.mkdtemp(prefix='.export-parts-', dir=out_dir)
+    jobs = ((novel_dir, parts_dir, f"{i:08d}", compress) for i, novel_dir in enumerate(novel_dirs(data_dir)))
+    try:
+        # Part files are raw bytes (gzip members when compressing), so they concatenate into valid output.
+        with open(os.path.join(out_dir, collection_filename('novels', compress)), 'wb') as novels_out, \
+                open(os.path.join(out_dir, collection_filename('chapters', compress)), 'wb') as chapters_out:
+            if workers and int(workers) > 1:
+                with ProcessPoolExecutor(max_workers=int(workers)) as executor:
+                    results = executor.map(_export_novel_job, jobs, chunksize=4)
+                    for novel_part, chapter_part, chapter_count in results:
+                        _append_part(novel_part, novels_out)
+                        _append_part(chapter_part, chapters_out)
+                        counts['novels'] += 1
+                        counts['chapters'] += chapter_count
+            else:
+                for job in jobs:
+                    novel_part, chapter_part, chapter_count = _export_novel_job(job)
+                    _append_part(novel_part, novels_out)
+                    _append_part(chapter_part, chapters_out)
+                    counts['novels'] += 1
+                    counts['chapters'] += chapter_count
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export data/ as NDJSON files for mongoimport')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Crawl output folder to read')
+    parser.add_argument('--out', default=EXPORT_DIR, help='Folder for novels/chapters/genres .ndjson files')
+    parser.add_argument('--gzip', action='store_true', help='Write gzip-compressed .ndjson.gz files')
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS, metavar='N', help='Novel folders exported in parallel (processes)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    counts = export_data_dir(args.data_dir, args.out, args.gzip, args.workers)
+    logging.getLogger(__name__).info("Exported %d novels, %d chapters, %d genres to %s", counts['novels'], counts['chapters'], counts['genres'], args.out)
+
+
+if __name__ == '__main__':
+    main()
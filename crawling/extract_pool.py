@@ -0,0 +1,159 @@
+"""HTML extraction off the main thread.
+
+BeautifulSoup parsing and the selector passes in fetcher.py are pure CPU work
+and hold the GIL, so once fetching is concurrent they become the ceiling.
+ExtractionPool ships raw response bytes to a process pool and gets the plain
+chapter/novel dicts back. InlineExtractor has the same interface but extracts
+in the calling thread, which is what the pipeline uses when no pool is set.
+
+IDs are the one thing a worker process cannot mint: they come from ID blocks
+reserved by the parent (ids.py). Workers use throwaway local counters and
+their IDs are replaced in the parent, so the dicts match what the
+in-process extractors return.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from .config import EXTRACT_WORKERS
+    from .ids import generate_novel_id, generate_chapter_id, use_local_counters
+    from .metrics import get_metrics
+    from .fetcher import configure_parser, get_parser, parse_html, extract_listing_entries, extract_novel_details, extract_chapter_details
+except Exception:
+    from config import EXTRACT_WORKERS
+    from ids import generate_novel_id, generate_chapter_id, use_local_counters
+    from metrics import get_metrics
+    from fetcher import configure_parser, get_parser, parse_html, extract_listing_entries, extract_novel_details, extract_chapter_details
+
+
+def _init_worker(log_level, parser_name, targeted):
+    logging.basicConfig(level=log_level, format='%(asctime)s %(levelname)s %(name)s[%(process)d]: %(message)s')
+    configure_parser(parser_name, targeted)
+    use_local_counters()  # a forked worker must not touch the parent's ID database connection
+
+
+def _timed_extract(kind, extract, content, *args):
+    # Timings travel back with the result: a worker process's own metrics never reach the parent.
+    started = time.perf_counter()
+    soup = parse_html(content, kind)
+    parsed = time.perf_counter()
+    return extract(soup, *args), parsed - started, time.perf_counter() - parsed
+
+
+def _record(timed):
+    result, parse_seconds, extract_seconds = timed
+    metrics = get_metrics()
+    metrics.observe_stage('parse', parse_seconds)
+    metrics.observe_stage('extract', extract_seconds)
+    return result
+
+
+def _listing_entries_from_bytes(content, page_url):
+    return _timed_extract('listing', extract_listing_entries, content, page_url)
+
+
+def _novel_from_bytes(content, novel_url):
+    return _timed_extract('novel', extract_novel_details, content, novel_url)
+
+
+def _chapter_from_bytes(content, chapter_url, novel_id_str, chapter_number_expected):
+    return _timed_extract('chapter', extract_chapter_details, content, chapter_url, novel_id_str, chapter_number_expected)
+
+
+class InlineExtractor:
+    """Extracts in the calling thread."""
+
+    def listing_entries(self, content, page_url):
+        return _record(_listing_entries_from_bytes(content, page_url))
+
+    def novel_urls(self, content, page_url):
+        return [url for url, _, _ in self.listing_entries(content, page_url)]
+
+    def novel(self, content, novel_url):
+        return _record(_novel_from_bytes(content, novel_url))
+
+    def chapter(self, content, chapter_url, novel_id_str, chapter_number_expected):
+        return _record(_chapter_from_bytes(content, chapter_url, novel_id_str, chapter_number_expected))
+
+    async def listing_entries_async(self, content, page_url):
+        return self.listing_entries(content, page_url)
+
+    async def novel_urls_async(self, content, page_url):
+        return [url for url, _, _ in await self.listing_entries_async(content, page_url)]
+
+    async def novel_async(self, content, novel_url):
+        return self.novel(content, novel_url)
+
+    async def chapter_async(self, content, chapter_url, novel_id_str, chapter_number_expected):
+        return self.chapter(content, chapter_url, novel_id_str, chapter_number_expected)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ExtractionPool(InlineExtractor):
+    """Extracts in a pool of worker processes.
+
+    Use as a context manager so the workers are shut down on exit.
+    """
+
+    def __init__(self, workers=EXTRACT_WORKERS):
+        self.workers = max(1, int(workers))
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(logging.getLogger().getEffectiveLevel(), get_parser().name, get_parser().targeted),
+        )
+
+    @staticmethod
+    def _assign_novel_id(novel):
+        if novel is not None:
+            novel['novelId'] = generate_novel_id()
+        return novel
+
+    @staticmethod
+    def _assign_chapter_id(chapter):
+        if chapter is not None:
+            chapter['chapterId'] = generate_chapter_id()
+        return chapter
+
+    def listing_entries(self, content, page_url):
+        return _record(self._executor.submit(_listing_entries_from_bytes, content, page_url).result())
+
+    def novel(self, content, novel_url):
+        return self._assign_novel_id(_record(self._executor.submit(_novel_from_bytes, content, novel_url).result()))
+
+    def chapter(self, content, chapter_url, novel_id_str, chapter_number_expected):
+        future = self._executor.submit(_chapter_from_bytes, content, chapter_url, novel_id_str, chapter_number_expected)
+        return self._assign_chapter_id(_record(future.result()))
+
+    async def listing_entries_async(self, content, page_url):
+        loop = asyncio.get_running_loop()
+        return _record(await loop.run_in_executor(self._executor, _listing_entries_from_bytes, content, page_url))
+
+    async def novel_async(self, content, novel_url):
+        loop = asyncio.get_running_loop()
+        return self._assign_novel_id(_record(await loop.run_in_executor(self._executor, _novel_from_bytes, content, novel_url)))
+
+    async def chapter_async(self, content, chapter_url, novel_id_str, chapter_number_expected):
+        loop = asyncio.get_running_loop()
+        chapter = await loop.run_in_executor(self._executor, _chapter_from_bytes, content, chapter_url, novel_id_str, chapter_number_expected)
+        return self._assign_chapter_id(_record(chapter))
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def make_extractor(workers=EXTRACT_WORKERS):
+    """A process pool for workers >= 1, otherwise the in-process extractor."""
+    if workers and int(workers) >= 1:
+        return ExtractionPool(workers)
+    return InlineExtractor()
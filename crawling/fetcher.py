@@ -1,57 +1,236 @@
 import requests
-from bs4 import BeautifulSoup
 import time
 import re
 from urllib.parse import urljoin
 import logging
-from config import BASE_URL, REQUEST_DELAY, DEFAULT_MISSING_INFO
-from ids import generate_novel_id, generate_chapter_id
-from utils import create_slug_from_text, generate_random_novel_numeric_fields, generate_random_chapter_fields
+try:
+    from .config import BASE_URL, REQUEST_TIMEOUT, DEFAULT_MISSING_INFO, HTTP_CACHE_ENABLED, PARSER_BACKEND, TARGETED_PARSING
+    from .cache import ResponseCache
+    from .warc import WarcWriter
+    from .parsers import ParserBackend
+    from .ratelimit import get_rate_limiter, parse_retry_after
+    from .retry import get_retry_policy, get_circuit_breaker, failure_reason
+    from .metrics import get_metrics
+    from .ids import generate_novel_id, generate_chapter_id
+    from .utils import generate_random_novel_numeric_fields, generate_random_chapter_fields
+    from .textnorm import slugify, element_text, word_count
+except Exception:
+    from config import BASE_URL, REQUEST_TIMEOUT, DEFAULT_MISSING_INFO, HTTP_CACHE_ENABLED, PARSER_BACKEND, TARGETED_PARSING
+    from cache import ResponseCache
+    from warc import WarcWriter
+    from parsers import ParserBackend
+    from ratelimit import get_rate_limiter, parse_retry_after
+    from retry import get_retry_policy, get_circuit_breaker, failure_reason
+    from metrics import get_metrics
+    from ids import generate_novel_id, generate_chapter_id
+    from utils import generate_random_novel_numeric_fields, generate_random_chapter_fields
+    from textnorm import slugify, element_text, word_count
 
-def fetch_page(url):
-    """Fetches and parses a web page."""
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+_parser = ParserBackend()
+
+def configure_parser(name=PARSER_BACKEND, targeted=TARGETED_PARSING):
+    """Selects the parser backend used by every extraction path."""
+    global _parser
+    _parser = ParserBackend(name, targeted)
+
+def get_parser():
+    return _parser
+
+def parse_html(content, kind=None):
+    """Parses raw page bytes (or text) into a BeautifulSoup tree.
+
+    kind ('listing', 'novel' or 'chapter') lets the backend build only the sub-trees that page's extractor reads.
+    """
+    return _parser.parse(content, kind)
+
+_response_cache = ResponseCache() if HTTP_CACHE_ENABLED else None
+
+def configure_cache(enabled=True, cache_dir=None, revalidate_kinds=()):
+    """Turns the shared on-disk response cache on or off for every fetcher.
+
+    Cached pages of a kind in revalidate_kinds are always revalidated (main.py --update).
+    """
+    global _response_cache
+    if not enabled:
+        _response_cache = None
+        return
+    if cache_dir:
+        _response_cache = ResponseCache(cache_dir=cache_dir)
+    elif _response_cache is None:
+        _response_cache = ResponseCache()
+    _response_cache.revalidate_kinds = frozenset(revalidate_kinds)
+
+def get_response_cache():
+    return _response_cache
+
+_raw_archive = None
+
+def configure_raw_archive(directory=None):
+    """Archives every page fetched from now on as WARC records in directory (see warc.py); None closes the archive."""
+    global _raw_archive
+    if _raw_archive is not None:
+        _raw_archive.close()
+    _raw_archive = WarcWriter(directory) if directory else None
+    return _raw_archive
+
+def get_raw_archive():
+    return _raw_archive
+
+# Errors without a response that are worth another attempt
+RETRYABLE_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+def fetch_raw(url, kind=None):
+    """Fetches a page body as bytes, serving or revalidating cached copies. Returns None on error.
+
+    Timeouts, dropped connections, 429 and 5xx are retried with backoff (see retry.py); 404 is final.
+    kind labels the page in the raw archive, when one is configured.
+    """
+    cache = _response_cache
+    metrics = get_metrics()
+    entry = cache.get(url) if cache else None
+    if entry and cache.is_fresh(entry, kind):
+        logging.getLogger(__name__).debug("Cache hit for %s", url)
+        metrics.inc('cache', result='hit')
+        if _raw_archive is not None:
+            _raw_archive.record(url, entry['body'], kind=kind, missing_only=True)
+        return entry['body']
+    policy = get_retry_policy()
+    breaker = get_circuit_breaker()
+    failures = 0  # failed attempts charged to this URL (circuit-breaker trials are not)
+    retries = 0
+    while True:
+        trial = breaker.wait(url)
+        try:
+            content = _request(url, cache, entry, metrics, kind)
+        except requests.exceptions.RequestException as e:
+            response = getattr(e, 'response', None)
+            status = response.status_code if response is not None else None
+            breaker.record(url, status)
+            retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+            reason = failure_reason(status, e)
+            if not trial:  # a failed circuit-breaker trial says nothing about this URL
+                failures += 1
+            delay = policy.retry_delay(failures, status, isinstance(e, RETRYABLE_ERRORS), retry_after)
+            if delay is None:
+                logging.getLogger(__name__).warning("Error fetching %s: %s", url, e)
+                policy.finished(url, retries, reason, status)
+                return None
+            policy.retrying(url, failures, reason, delay)
+            time.sleep(delay)
+            retries += 1
+            continue
+        breaker.record(url, 200)
+        policy.finished(url, retries)
+        return content
+
+def _request(url, cache, entry, metrics, kind=None):
+    """One GET of url (conditional when a cached entry exists). Raises requests exceptions on failure."""
+    limiter = get_rate_limiter()
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=30)
+        headers = dict(HEADERS)
+        if entry:
+            headers.update(cache.conditional_headers(entry))
+        limiter.acquire(url)
+        started = time.monotonic()
+        metrics.inc('http_requests')
+        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        elapsed = time.monotonic() - started
+        # requests reads the whole body before returning; `elapsed` stops at the response headers
+        metrics.observe_stage('ttfb', response.elapsed.total_seconds())
+        metrics.observe_stage('download', max(0.0, elapsed - response.elapsed.total_seconds()))
+        metrics.inc('http_responses', status=response.status_code)
+        metrics.inc('http_bytes', len(response.content))
+        limiter.record(url, response.status_code, elapsed,
+                       parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code == 304 and entry:
+            logging.getLogger(__name__).debug("Not modified: %s", url)
+            metrics.inc('cache', result='revalidated')
+            body = cache.revalidated(url, entry, response.headers)
+            if _raw_archive is not None:
+                _raw_archive.record(url, body, response.headers, kind, missing_only=True)
+            return body
         response.raise_for_status()
-        time.sleep(REQUEST_DELAY)
-        return BeautifulSoup(response.content, 'html.parser')
+        if cache:
+            cache.store(url, response.content, response.headers)
+        if _raw_archive is not None:
+            _raw_archive.record(url, response.content, response.headers, kind, response.status_code)
+        return response.content
     except requests.exceptions.RequestException as e:
-        logging.getLogger(__name__).warning("Error fetching %s: %s", url, e)
+        if getattr(e, 'response', None) is None:
+            limiter.record(url)  # network-level failure, no status to report
+            metrics.inc('http_errors', error=type(e).__name__)
+        raise
+
+def fetch_page(url, kind=None):
+    """Fetches and parses a web page."""
+    content = fetch_raw(url, kind)
+    if content is None:
         return None
+    with get_metrics().timer('parse'):
+        return parse_html(content, kind)
 
 def get_novel_urls_from_list_page(page_url):
     """Extracts novel URLs from a listing page."""
-    soup = fetch_page(page_url)
+    return [url for url, _, _ in get_listing_entries(page_url)]
+
+def get_listing_entries(page_url):
+    """(novel_url, latest_chapter_number, latest_chapter_label) for each novel on a listing page."""
+    soup = fetch_page(page_url, 'listing')
     if not soup:
         return []
-    
-    novel_links = []
+    with get_metrics().timer('extract'):
+        return extract_listing_entries(soup, page_url)
+
+def extract_novel_urls(soup, page_url):
+    """Extracts novel URLs from an already parsed listing page."""
+    return [url for url, _, _ in extract_listing_entries(soup, page_url)]
+
+def extract_listing_entries(soup, page_url):
+    """Extracts (novel_url, latest_chapter_number, latest_chapter_label) from an already parsed listing page.
+
+    The latest chapter comes from the row's "text-info" link; number and label are None when a row has none.
+    """
+    entries = []
     story_elements = soup.select('div.list-truyen .row div.col-xs-7 > h3.truyen-title > a')
     if not story_elements:
          story_elements = soup.select('h3.truyen-title > a')
 
     for link_tag in story_elements:
         href = link_tag.get('href')
-        if href:
-            novel_links.append(urljoin(BASE_URL, href))
-    logging.getLogger(__name__).info("Found %d novels on %s", len(novel_links), page_url)
-    return novel_links
+        if not href:
+            continue
+        latest_number = latest_label = None
+        row = link_tag.find_parent('div', class_='row')
+        latest_tag = row.select_one('div.text-info a') if row else None
+        if latest_tag:
+            latest_label = latest_tag.get_text(" ", strip=True) or None
+            number_match = re.search(r'chuong-(\d+)', latest_tag.get('href') or '')
+            if number_match:
+                latest_number = int(number_match.group(1))
+        entries.append((urljoin(page_url, href), latest_number, latest_label))
+    logging.getLogger(__name__).info("Found %d novels on %s", len(entries), page_url)
+    return entries
 
 def scrape_novel_details(novel_url):
     logging.getLogger(__name__).info("Scraping novel details from: %s", novel_url)
-    soup = fetch_page(novel_url)
+    soup = fetch_page(novel_url, 'novel')
     if not soup:
         return None
+    with get_metrics().timer('extract'):
+        return extract_novel_details(soup, novel_url)
 
+def extract_novel_details(soup, novel_url):
+    """Builds the novel dict from an already parsed novel page."""
     novel_data = {}
     title_tag = soup.select_one('h3.title')
     novel_data['title'] = title_tag.get_text(strip=True) if title_tag else DEFAULT_MISSING_INFO
 
     cover_art_tag = soup.select_one('div.book img[itemprop="image"]')
-    novel_data['coverArt'] = urljoin(BASE_URL, cover_art_tag['src']) if cover_art_tag and cover_art_tag.get('src') else DEFAULT_MISSING_INFO
+    novel_data['coverArt'] = urljoin(novel_url, cover_art_tag['src']) if cover_art_tag and cover_art_tag.get('src') else DEFAULT_MISSING_INFO
     
     author_tag = soup.select_one('div.info a[itemprop="author"]')
     novel_data['scraped_author_name'] = author_tag.get_text(strip=True) if author_tag else DEFAULT_MISSING_INFO
@@ -91,7 +270,7 @@ def scrape_novel_details(novel_url):
             novel_data['scraped_status'] = DEFAULT_MISSING_INFO
 
     novel_data['novelId'] = generate_novel_id()
-    novel_data['altTitle'] = create_slug_from_text(novel_data['title'])
+    novel_data['altTitle'] = slugify(novel_data['title'])
     base_novel_slug_from_url = novel_url.rstrip('/').split('/')[-1]
     novel_data['slug'] = base_novel_slug_from_url
     
@@ -109,15 +288,82 @@ def scrape_novel_details(novel_url):
     novel_data['wordCount'] = 0
     novel_data['chapterCount'] = 0
 
+    # Chapter list on the novel page; popped by the crawler before the novel is saved.
+    novel_data['scraped_chapter_links'] = extract_chapter_links(soup, novel_url)
+    novel_data['scraped_chapter_list_pages'] = extract_chapter_list_page_count(soup)
+
     return novel_data
 
+def extract_chapter_links(soup, page_url=BASE_URL):
+    """Returns [(chapter_number, url)] from a novel page's (or chapter list page's) chapter list; page_url resolves relative links."""
+    links = []
+    for link_tag in soup.select('ul.list-chapter li a'):
+        href = link_tag.get('href')
+        number_match = re.search(r'chuong-(\d+)', href or '')
+        if number_match:
+            links.append((int(number_match.group(1)), urljoin(page_url, href)))
+    return links
+
+def extract_chapter_list_page_count(soup):
+    """Number of chapter list pages, read from the list's pagination (1 when there is none)."""
+    page_numbers = [1]
+    for link_tag in soup.select('ul.pagination li a'):
+        page_match = re.search(r'trang-(\d+)', link_tag.get('href') or '')
+        if page_match:
+            page_numbers.append(int(page_match.group(1)))
+    return max(page_numbers)
+
+def chapter_list_page_url(novel_url, page_num):
+    return urljoin(novel_url.rstrip('/') + '/', f"trang-{page_num}/")
+
+def chapter_list_pages_to_fetch(links_per_page, page_count, start_chapter, max_chapters):
+    """List pages beyond the novel page that should hold chapters start_chapter..max_chapters."""
+    if links_per_page <= 0:
+        return []
+    first_page = max(2, (start_chapter - 1) // links_per_page + 1)
+    last_page = min(page_count, -(-max_chapters // links_per_page))
+    return list(range(first_page, last_page + 1))
+
+def plan_chapters(links, start_chapter, max_chapters):
+    """Dedupes chapter links and keeps start_chapter..max_chapters, ordered by chapter number.
+
+    A URL listed under several numbers is kept under the first one only, so it is fetched once.
+    """
+    by_number = {}
+    seen_urls = set()
+    for number, url in links:
+        if start_chapter <= number <= max_chapters and number not in by_number and url not in seen_urls:
+            by_number[number] = url
+            seen_urls.add(url)
+    return sorted(by_number.items())
+
+def discover_chapters(novel_url, links, page_count, start_chapter, max_chapters, fetch=None):
+    """Chapter plan [(number, url)] built from the novel's chapter list and its pagination.
+
+    Returns None when the novel page has no chapter list, so callers can fall back to probing.
+    fetch(url, kind) -> soup or None gets the extra list pages (default: fetch_page).
+    """
+    if not links:
+        return None
+    links = list(links)
+    for page_num in chapter_list_pages_to_fetch(len(links), page_count, start_chapter, max_chapters):
+        page_url = chapter_list_page_url(novel_url, page_num)
+        soup = (fetch or fetch_page)(page_url, 'chapter_list')
+        if soup:
+            links.extend(extract_chapter_links(soup, page_url))
+    return plan_chapters(links, start_chapter, max_chapters)
+
 def scrape_chapter_details(chapter_url, novel_id_str, chapter_number_expected):
     logging.getLogger(__name__).info("  Attempting to scrape chapter: %s", chapter_url)
-    soup = fetch_page(chapter_url)
+    soup = fetch_page(chapter_url, 'chapter')
     if not soup:
         logging.getLogger(__name__).warning("  Chapter not found or error fetching: %s", chapter_url)
         return None
+    with get_metrics().timer('extract'):
+        return extract_chapter_details(soup, chapter_url, novel_id_str, chapter_number_expected)
 
+def extract_chapter_details(soup, chapter_url, novel_id_str, chapter_number_expected):
+    """Builds the chapter dict from an already parsed chapter page, or None if it has no content."""
     chapter_data = {}
     chapter_data['novelId'] = novel_id_str
     chapter_data['chapterId'] = generate_chapter_id()
@@ -141,13 +387,7 @@ def scrape_chapter_details(chapter_url, novel_id_str, chapter_number_expected):
     if content_div:
         for unwanted_tag in content_div.find_all(['script', 'style', 'div', 'span'], class_=re.compile(r'(ads|google|display)', re.I)):
             unwanted_tag.decompose()
-        
-        paragraphs = content_div.find_all('p')
-        if paragraphs:
-            raw_content_text = "\n".join(p.get_text(separator=" ", strip=True) for p in paragraphs)
-        else:
-            raw_content_text = content_div.get_text(separator=" ", strip=True)
-        
+        raw_content_text = element_text(content_div)
         chapter_data['content'] = content_div.decode_contents()
         if not raw_content_text.strip() and not chapter_data['content'].strip():
             logging.getLogger(__name__).warning("  Chapter content is empty for: %s", chapter_url)
@@ -155,14 +395,12 @@ def scrape_chapter_details(chapter_url, novel_id_str, chapter_number_expected):
         logging.getLogger(__name__).warning("  Chapter content div not found for: %s. Assuming chapter does not exist.", chapter_url)
         return None
 
-    word_count = len(raw_content_text.split())
-
     chapter_data['status'] = "PUBLISHED"
     chapter_data['approved'] = True
     chapter_data['_class'] = "com.content.content_service.models.ChapterEntity"
     
     chapter_data.update(generate_random_chapter_fields())
-    chapter_data['wordCount'] = word_count
+    chapter_data['wordCount'] = word_count(raw_content_text)
 
     logging.getLogger(__name__).info("    Successfully scraped Chapter %s: %s", chapter_data['chapterNumber'], chapter_data['title'])
     return chapter_data
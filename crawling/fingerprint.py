@@ -0,0 +1,115 @@
+"""Chapter fingerprints for soft-404 and duplicate detection.
+
+Sites answer a missing chapter with a redirect to the latest one, a
+placeholder page or a mirrored copy, all of which still carry a
+`div.chapter-c`. Every extracted chapter therefore gets two fingerprints:
+
+- the exact content hash (saver.content_hash, blake2b of the saved text);
+- a 64-bit SimHash over 3-word shingles of the folded text, where a small
+  Hamming distance means near-identical text (the same chapter with a
+  different ad line, counter or footer).
+
+A FingerprintIndex holds the fingerprints of one novel's saved chapters and
+answers "does this chapter repeat another one?". Near matches are found
+through four 16-bit bands of the SimHash: with a distance threshold below
+four, two close signatures always share at least one band exactly.
+"""
+import hashlib
+from collections import Counter
+
+try:
+    from .config import SIMHASH_MAX_DISTANCE, NEAR_DUPLICATE_MIN_WORDS
+    from .textnorm import fold_text
+except Exception:
+    from config import SIMHASH_MAX_DISTANCE, NEAR_DUPLICATE_MIN_WORDS
+    from textnorm import fold_text
+
+SIMHASH_BITS = 64
+SHINGLE_WORDS = 3
+BANDS = 4
+_BAND_BITS = SIMHASH_BITS // BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# Byte value -> the same 8 bits spread into 16-bit lanes, so adding spread
+# bytes counts how often each bit is set in one big-int addition.
+_LANE = 16
+_SPREAD = [sum(1 << (_LANE * bit) for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def simhash(text):
+    """64-bit SimHash of the text's word shingles (0 for text without words)."""
+    words = fold_text(text).split()
+    if not words:
+        return 0
+    if len(words) < SHINGLE_WORDS:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    digests = b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    half = len(shingles) / 2
+    value = 0
+    for byte_index in range(8):
+        # Column of this byte across all digests; per-bit set counts come out of the lanes.
+        lanes = sum(_SPREAD[byte] * count for byte, count in Counter(digests[byte_index::8]).items())
+        for bit in range(8):
+            if (lanes >> (_LANE * bit)) & 0xFFFF > half:
+                value |= 1 << (byte_index * 8 + bit)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed(value):
+    """SimHash as a signed 64-bit integer, the range SQLite INTEGER stores."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class FingerprintIndex:
+    """Fingerprints of one novel's chapters: exact hashes plus banded SimHashes."""
+
+    def __init__(self, max_distance=SIMHASH_MAX_DISTANCE, min_words=NEAR_DUPLICATE_MIN_WORDS):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS} for the banded lookup")
+        self.max_distance = max_distance
+        self.min_words = min_words
+        self._by_hash = {}  # content hash -> chapter number
+        self._simhashes = {}  # chapter number -> simhash
+        self._bands = [{} for _ in range(BANDS)]  # band value -> [chapter numbers]
+
+    def __len__(self):
+        return len(self._simhashes)
+
+    def add(self, number, content_hash, simhash_value=None):
+        if content_hash:
+            self._by_hash.setdefault(content_hash, number)
+        if simhash_value is not None:
+            self._simhashes[number] = simhash_value
+            for band, table in enumerate(self._bands):
+                table.setdefault((simhash_value >> (band * _BAND_BITS)) & _BAND_MASK, []).append(number)
+
+    def find_duplicate(self, number, content_hash, simhash_value=None, words=None):
+        """(other chapter number, 'exact' or 'near') when the chapter repeats another one, else None.
+
+        Near matches are only reported for chapters of at least min_words words;
+        short texts make SimHash unreliable.
+        """
+        other = self._by_hash.get(content_hash)
+        if other is not None and other != number:
+            return other, 'exact'
+        if simhash_value is None or (words is not None and words < self.min_words):
+            return None
+        seen = set()
+        for band, table in enumerate(self._bands):
+            for candidate in table.get((simhash_value >> (band * _BAND_BITS)) & _BAND_MASK, ()):
+                if candidate == number or candidate in seen:
+                    continue
+                seen.add(candidate)
+                if hamming(self._simhashes[candidate], simhash_value) <= self.max_distance:
+                    return candidate, 'near'
+        return None
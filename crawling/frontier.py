@@ -0,0 +1,293 @@
+"""Crawl frontier: the novels to crawl next, discovered from one or more seed lists.
+
+The crawl used to fetch danh-sach/truyen-hot/trang-N/ only once every novel
+on page N-1 was done, and nothing stopped a novel listed on two pages (the
+hot list shifts while it is walked) or on two lists from being crawled
+twice. The Frontier:
+
+- walks every seed list (SEED_LISTS: listing paths under BASE_URL, such as
+  danh-sach/truyen-hot/ and danh-sach/truyen-full/) page by page, one list
+  after the other;
+- fetches listing pages up to `prefetch` pages ahead of the novel workers:
+  on a background thread for the blocking crawl, as concurrent tasks in the
+  pipeline;
+- drops novel URLs seen before, through a Bloom filter (bloom.py) saved to
+  FRONTIER_BLOOM_PATH, so deduplication costs a few bytes per URL however
+  long the crawl runs and carries over to the next run;
+- keeps, per list, the first page that still has an undecided novel
+  (meta key frontier_pages), and a resumed crawl starts there.
+
+The consumer calls decided(entry) once it is done with a novel it was
+handed: skipped, or registered in the state store by prepare_novel. Only
+then does the URL go into the filter and can the list's page move on, so
+novels still queued when the crawl stops are listed again next run. A
+novel a budget kept from starting is handed back with deferred(entry)
+instead: it stays out of the filter and its page does not move on.
+Incomplete novels would now be filtered out of the listings, so a resumed
+crawl hands them out first, straight from the state store. Novels found in
+the site's sitemaps (sitemap.py) come next, from the state store's
+sitemap_novels table, before the first listing page. Their lastmod is
+compared first: a completed novel whose lastmod has not moved since it was
+last crawled is dropped on the spot, and one whose lastmod is newer is
+reopened in the state store and handed out even though the filter has it.
+The filter only decides for novels with no lastmod to compare.
+
+An update pass (--update) walks every list from its first page with an
+empty in-memory filter and leaves the saved filter and pages alone.
+"""
+import asyncio
+import collections
+import logging
+import queue
+import threading
+from urllib.parse import urljoin
+
+try:
+    from .bloom import BloomFilter
+    from .config import (BASE_URL, HOT_NOVELS_PATH, SEED_LISTS, FRONTIER_PREFETCH, FRONTIER_BLOOM_PATH,
+                         FRONTIER_BLOOM_CAPACITY, FRONTIER_BLOOM_ERROR_RATE)
+    from .metrics import get_metrics
+except Exception:
+    from bloom import BloomFilter
+    from config import (BASE_URL, HOT_NOVELS_PATH, SEED_LISTS, FRONTIER_PREFETCH, FRONTIER_BLOOM_PATH,
+                        FRONTIER_BLOOM_CAPACITY, FRONTIER_BLOOM_ERROR_RATE)
+    from metrics import get_metrics
+
+PAGES_META_KEY = 'frontier_pages'
+SITEMAP_SEED = 'sitemap'  # the seed of entries found in the sitemaps
+
+FrontierEntry = collections.namedtuple('FrontierEntry', 'url latest label seed page lastmod', defaults=(None,))
+FrontierEntry.listing = property(lambda self: (self.latest, self.label))
+# Yielded by a blocking entries() with nothing to hand out yet that may have more later (coordinator.LeasedFrontier)
+WAITING = object()
+# Returned by the crawl for a novel a request or story budget kept from starting; see deferred()
+DEFERRED = object()
+
+_DONE = object()
+
+
+def listing_page_url(path, page_num):
+    """URL of page page_num of the listing at path (page 1 has no trang-N/ suffix)."""
+    if page_num == 1:
+        return urljoin(BASE_URL, path)
+    return urljoin(BASE_URL, f"{path}trang-{page_num}/")
+
+
+class _SeedList:
+    def __init__(self, path, start_page):
+        self.path = path
+        self.start_page = start_page  # first page to fetch this run
+        self.resume_page = start_page  # first page with a novel not decided yet
+        self.outstanding = collections.OrderedDict()  # page -> novels handed out but not decided
+
+
+class Frontier:
+    """Hands out listing entries of every seed list, deduplicated, with listing pages prefetched."""
+
+    def __init__(self, store, seed_lists=None, update=False, prefetch=FRONTIER_PREFETCH, bloom_path=FRONTIER_BLOOM_PATH):
+        self.store = store
+        self.update = update
+        self.prefetch = max(1, int(prefetch))
+        self.bloom_path = None if update else bloom_path
+        if self.bloom_path:
+            self.seen = BloomFilter.load(self.bloom_path, FRONTIER_BLOOM_CAPACITY, FRONTIER_BLOOM_ERROR_RATE)
+        else:
+            self.seen = BloomFilter(FRONTIER_BLOOM_CAPACITY, FRONTIER_BLOOM_ERROR_RATE)
+        self._pending = set()  # URLs handed out and not decided yet
+        pages = {} if update else self.store.get_meta(PAGES_META_KEY) or {HOT_NOVELS_PATH: self.store.current_page}
+        paths = [path.strip('/') + '/' for path in (SEED_LISTS if seed_lists is None else seed_lists)]
+        self.lists = [_SeedList(path, int(pages.get(path, 1))) for path in dict.fromkeys(paths)]
+        self._by_path = {seed.path: seed for seed in self.lists}
+
+    def reset(self):
+        """Forgets seen URLs and list pages (--no-resume)."""
+        self.seen.clear()
+        for seed in self.lists:
+            seed.start_page = seed.resume_page = 1
+        self.save()
+
+    def save(self):
+        if self.update:
+            return
+        self.store.set_meta(PAGES_META_KEY, {seed.path: seed.resume_page for seed in self.lists})
+        if self.bloom_path:
+            self.seen.save(self.bloom_path)
+
+    # --- handing out entries ---------------------------------------------------------
+    def entries(self, fetch_entries):
+        """Listing entries (FrontierEntry) in crawl order; fetch_entries(page_url) -> [(url, latest, label)].
+
+        Listing pages are fetched on a background thread, up to `prefetch` pages ahead.
+        """
+        yield from self._resume_entries()
+        yield from self._sitemap_entries()
+        pages = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._prefetch_pages, args=(fetch_entries, pages, stop), name='frontier-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = pages.get()
+                if item is _DONE:
+                    return
+                yield from self._page_entries(*item)
+        finally:
+            stop.set()
+            while thread.is_alive():
+                try:
+                    pages.get(timeout=0.1)  # unblock a pending put
+                except queue.Empty:
+                    pass
+
+    def _prefetch_pages(self, fetch_entries, pages, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for seed in self.lists:
+                page_num = seed.start_page
+                while not stop.is_set():
+                    page_url = listing_page_url(seed.path, page_num)
+                    try:
+                        entries = self._fetch(fetch_entries, page_url)
+                    except Exception:
+                        logging.getLogger(__name__).exception("Listing fetch failed for %s", page_url)
+                        entries = []
+                    if not put((seed, page_num, page_url, entries)) or not entries:
+                        break
+                    page_num += 1
+        finally:
+            put(_DONE)
+
+    async def entries_async(self, fetch_entries, prefetch=None):
+        """entries() for the event loop; fetch_entries is a coroutine function. Up to `prefetch` pages are fetched concurrently."""
+        prefetch = max(1, int(prefetch or self.prefetch))
+        for entry in self._resume_entries():
+            yield entry
+        for entry in self._sitemap_entries():
+            yield entry
+        for seed in self.lists:
+            ahead = collections.deque()
+            next_page = seed.start_page
+            try:
+                while True:
+                    while len(ahead) < prefetch:
+                        page_url = listing_page_url(seed.path, next_page)
+                        ahead.append((next_page, page_url, asyncio.ensure_future(self._fetch_async(fetch_entries, page_url))))
+                        next_page += 1
+                    page_num, page_url, task = ahead.popleft()
+                    entries = await task
+                    for entry in self._page_entries(seed, page_num, page_url, entries):
+                        yield entry
+                    if not entries:
+                        break
+            finally:
+                for _, _, task in ahead:
+                    task.cancel()
+                await asyncio.gather(*(task for _, _, task in ahead), return_exceptions=True)
+
+    def _fetch(self, fetch_entries, page_url):
+        logging.getLogger(__name__).info("\nFetching novel list from: %s", page_url)
+        return fetch_entries(page_url)
+
+    async def _fetch_async(self, fetch_entries, page_url):
+        logging.getLogger(__name__).info("\nFetching novel list from: %s", page_url)
+        try:
+            return await fetch_entries(page_url)
+        except Exception:
+            logging.getLogger(__name__).exception("Listing fetch failed for %s", page_url)
+            return []
+
+    def _resume_entries(self):
+        if self.update:
+            return
+        for url in self.store.incomplete_novels():
+            if url not in self._pending:
+                self._pending.add(url)
+                yield FrontierEntry(url, None, None, None, None)
+
+    def _sitemap_entries(self):
+        store = self.store
+        for row in store.sitemap_novels():
+            url = row['url']
+            if url in self._pending:
+                continue
+            progress = store.novel(url)
+            recorded = progress['sitemap_lastmod'] if progress is not None else None
+            result = 'new'
+            if recorded is None or row['lastmod'] is None:
+                # Nothing to compare lastmod against, so the filter decides
+                if url in self.seen:
+                    store.remove_sitemap_novel(url)
+                    get_metrics().inc('frontier_entries', result='seen')
+                    continue
+            elif row['lastmod'] <= recorded:
+                if progress['completed']:
+                    store.remove_sitemap_novel(url)
+                    get_metrics().inc('frontier_entries', result='unchanged')
+                    continue
+            elif progress['completed']:
+                # Changed since it was crawled: reopen it so its new chapters are fetched
+                store.mark_novel(url, False)
+                result = 'changed'
+            self._pending.add(url)
+            get_metrics().inc('frontier_entries', result=result)
+            yield FrontierEntry(url, row['latest'], None, SITEMAP_SEED, None, row['lastmod'])
+
+    def _page_entries(self, seed, page_num, page_url, entries):
+        """Registers one fetched listing page and yields its entries that were not seen before."""
+        self.store.record_page(page_url, seed.path, page_num, len(entries))
+        if not entries:
+            logging.getLogger(__name__).info("No more novels found on page %d of %s. Stopping.", page_num, seed.path)
+            return
+        fresh = []
+        for url, latest, label in entries:
+            url = url.rstrip('/') + '/'
+            if url in self._pending or url in self.seen:
+                continue
+            self._pending.add(url)
+            fresh.append(FrontierEntry(url, latest, label, seed.path, page_num))
+        get_metrics().inc('frontier_entries', len(fresh), result='new')
+        get_metrics().inc('frontier_entries', len(entries) - len(fresh), result='seen')
+        seed.outstanding[page_num] = len(fresh)
+        self._advance(seed)
+        yield from fresh
+
+    # --- bookkeeping -----------------------------------------------------------------
+    def decided(self, entry, remember=True):
+        """The consumer is done with entry; remember=False leaves the URL out of the filter (e.g. its page failed)."""
+        self._pending.discard(entry.url)
+        if remember:
+            self.seen.add(entry.url)
+            if entry.seed == SITEMAP_SEED:
+                self.store.remove_sitemap_novel(entry.url)
+                if entry.lastmod is not None:
+                    self.store.set_sitemap_lastmod(entry.url, entry.lastmod)
+        seed = self._by_path.get(entry.seed)
+        if seed is not None and entry.page in seed.outstanding:
+            seed.outstanding[entry.page] -= 1
+            self._advance(seed)
+
+    def deferred(self, entry):
+        """The consumer hands entry back untouched (a budget ran out): it is listed again next run."""
+        self._pending.discard(entry.url)
+
+    def _advance(self, seed):
+        moved = False
+        while seed.outstanding:
+            page_num, remaining = next(iter(seed.outstanding.items()))
+            if remaining > 0:
+                break
+            seed.outstanding.popitem(last=False)
+            seed.resume_page = page_num + 1
+            moved = True
+        if moved and not self.update:
+            pages = self.store.get_meta(PAGES_META_KEY) or {}
+            pages[seed.path] = seed.resume_page
+            self.store.set_meta(PAGES_META_KEY, pages)
@@ -0,0 +1,115 @@
+"""Genre entities shared by every novel of a crawl.
+
+Genres are loaded from data/genres.json when the crawl starts, so names seen
+in earlier runs keep their IDs, and the file is rewritten (atomically) as
+soon as a new genre appears instead of once at the end of the run. When
+several crawler processes share data/, IDs come from the coordinator
+(id_for) and each rewrite keeps the genres other processes added to the file.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+try:
+    from .ids import generate_genre_id, advance_genre_id_counter
+    from .utils import generate_random_genre_dates
+    from .textnorm import slugify
+    from .config import DATA_DIR
+except Exception:
+    from ids import generate_genre_id, advance_genre_id_counter
+    from utils import generate_random_genre_dates
+    from textnorm import slugify
+    from config import DATA_DIR
+
+GENRES_PATH = os.path.join(DATA_DIR, 'genres.json')
+
+
+class GenreRegistry:
+    """Maps genre names to genre IDs, creating and persisting GenreEntity dicts for unseen names.
+
+    on_new(genre) is called for every genre created, e.g. to stream it to an exporter.
+    id_for(name) -> genreId replaces local ID minting (coordinator.Coordinator.genre_id).
+    """
+
+    def __init__(self, path=GENRES_PATH, on_new=None, id_for=None):
+        self.path = path
+        self.on_new = on_new
+        self.id_for = id_for
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self.genres = []
+        self._adopt(self._read())
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logging.getLogger(__name__).warning("Ignoring unreadable %s: %s", self.path, e)
+        return []
+
+    def _adopt(self, genres):
+        """Takes over genres (from genres.json) whose names are not known yet."""
+        for genre in genres:
+            if genre['name'] in self._by_name:
+                continue
+            self.genres.append(genre)
+            self._by_name[genre['name']] = genre['genreId']
+            m = re.match(r'^GEN(\d+)$', genre['genreId'])
+            if m:
+                advance_genre_id_counter(int(m.group(1)))
+
+    def __len__(self):
+        return len(self.genres)
+
+    def register(self, genre_names):
+        """Genre IDs for a novel's scraped genre names (deduplicated)."""
+        processed_genre_ids_for_novel = []
+        created = []
+        with self._lock:
+            for genre_name in genre_names:
+                if not genre_name: continue
+                genre_name_clean = genre_name.strip()
+                if genre_name_clean not in self._by_name:
+                    genre_id_str = self.id_for(genre_name_clean) if self.id_for else generate_genre_id()
+                    created_g, updated_g = generate_random_genre_dates()
+                    new_genre = {
+                        "genreId": genre_id_str,
+                        "name": genre_name_clean,
+                        "description": f"{genre_name_clean} {genre_id_str}",
+                        "slug": slugify(genre_name_clean),
+                        "isActive": True,
+                        "created": created_g,
+                        "updated": updated_g,
+                        "_class": "com.content.content_service.models.GenreEntity"
+                    }
+                    self.genres.append(new_genre)
+                    self._by_name[genre_name_clean] = genre_id_str
+                    created.append(new_genre)
+                processed_genre_ids_for_novel.append(self._by_name[genre_name_clean])
+            if created:
+                self._write()
+        for genre in created:
+            if self.on_new is not None:
+                self.on_new(genre)
+        return list(set(processed_genre_ids_for_novel))
+
+    def _write(self):
+        if self.id_for is not None:
+            self._adopt(self._read())  # genres other processes wrote since
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.genres.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.genres, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
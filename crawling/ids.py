@@ -1,19 +1,109 @@
 # ID counters and generators
+#
+# Without configuration IDs come from per-process counters starting at 1, which
+# is what extraction worker processes and the benchmarks use. main.py calls
+# configure_id_blocks() so IDs are minted from blocks reserved in a persistent
+# id_blocks table (data/state.db, or the coordinator's database when several
+# processes share a data/ tree): unique across runs and processes, with one
+# database round trip per ID_BLOCK_SIZE IDs.
+import threading
+
+try:
+    from .config import ID_BLOCK_SIZE
+except Exception:
+    from config import ID_BLOCK_SIZE
+
 novel_id_counter = 0
 chapter_id_counter = 0
 genre_id_counter = 0
 
+ID_BLOCKS_SCHEMA = "CREATE TABLE IF NOT EXISTS id_blocks (kind TEXT PRIMARY KEY, next INTEGER NOT NULL)"
+
+_blocks = None
+
+
+def reserve_block(conn, kind, count, floor=0):
+    """Reserves IDs [start, start + count) of kind in the id_blocks table and returns start.
+
+    conn is a sqlite3 connection in autocommit mode (isolation_level=None); start is always above floor.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("INSERT INTO id_blocks (kind, next) VALUES (?, 1) ON CONFLICT (kind) DO NOTHING", (kind,))
+        start = max(conn.execute("SELECT next FROM id_blocks WHERE kind = ?", (kind,)).fetchone()[0], floor + 1)
+        conn.execute("UPDATE id_blocks SET next = ? WHERE kind = ?", (start + count, kind))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return start
+
+
+class IdBlocks:
+    """Mints IDs locally from blocks handed out by reserve(kind, count, floor) -> first ID of the block."""
+
+    def __init__(self, reserve, block_size=ID_BLOCK_SIZE, floors=None):
+        self._reserve = reserve
+        self.block_size = max(1, int(block_size))
+        self._floors = dict(floors or {})  # kind -> highest ID known to be taken
+        self._next = {}
+        self._end = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, kind):
+        with self._lock:
+            number = self._next.get(kind, 0)
+            if number >= self._end.get(kind, 0):
+                number = self._reserve(kind, self.block_size, self._floors.get(kind, 0))
+                self._end[kind] = number + self.block_size
+            self._next[kind] = number + 1
+            return number
+
+    def advance(self, kind, at_least):
+        """Makes sure IDs minted from now on are above at_least."""
+        with self._lock:
+            self._floors[kind] = max(self._floors.get(kind, 0), at_least)
+            if self._next.get(kind, 0) <= at_least:
+                self._end[kind] = 0  # the next ID comes from a new block above the floor
+
+
+def configure_id_blocks(reserve, block_size=ID_BLOCK_SIZE, floors=None):
+    """Mints every ID of this process from persistent blocks (see IdBlocks)."""
+    global _blocks
+    _blocks = IdBlocks(reserve, block_size, floors)
+    return _blocks
+
+
+def use_local_counters():
+    """Back to the per-process counters (extraction workers, whose IDs the parent replaces)."""
+    global _blocks
+    _blocks = None
+
+
 def generate_novel_id():
     global novel_id_counter
+    if _blocks is not None:
+        return f"NOV{_blocks.next_id('novel'):07d}"
     novel_id_counter += 1
     return f"NOV{novel_id_counter:07d}"
 
 def generate_chapter_id():
     global chapter_id_counter
+    if _blocks is not None:
+        return f"CHA{_blocks.next_id('chapter'):07d}"
     chapter_id_counter += 1
     return f"CHA{chapter_id_counter:07d}"
 
 def generate_genre_id():
     global genre_id_counter
+    if _blocks is not None:
+        return f"GEN{_blocks.next_id('genre'):07d}"
     genre_id_counter += 1
     return f"GEN{genre_id_counter:07d}"
+
+def advance_genre_id_counter(at_least):
+    """Makes sure new genre IDs come after GEN<at_least> (e.g. genres loaded from genres.json)."""
+    global genre_id_counter
+    genre_id_counter = max(genre_id_counter, at_least)
+    if _blocks is not None:
+        _blocks.advance('genre', at_least)
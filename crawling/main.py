@@ -1,180 +1,622 @@
 import argparse
-import json
+import asyncio
+import collections
+import cProfile
+import io
 import logging
 import os
+import pstats
+import time
+from functools import partial
 from urllib.parse import urljoin
-from config import BASE_URL, HOT_NOVELS_PATH, MAX_STORIES_TO_CRAWL, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL
-from utils import initialize_json_files, generate_random_genre_dates, create_slug_from_text, load_state, save_state
-from ids import generate_genre_id
-from fetcher import get_novel_urls_from_list_page, scrape_novel_details, scrape_chapter_details
-from saver import save_novel, get_existing_chapter_max
-
-# --- DATA STORAGE ---
-novels_data = []
-chapters_data = []
-genres_data = []
-existing_genre_names_to_id = {}
+try:
+    from .config import PARSER_BACKEND, TARGETED_PARSING, MAX_STORIES_TO_CRAWL, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, PER_HOST_CONCURRENCY, EXTRACT_WORKERS, CHAPTER_STORAGE, EXPORT_DIR, METRICS_FILE, METRICS_INTERVAL, METRICS_PORT, PROFILE_PATH, DUPLICATE_DETECTION, SEED_LISTS, COORDINATOR_PATH, WARC_DIR, REPLAY_WORKERS, SCHEDULER_REQUEST_BUDGET, SCHEDULER_NOVEL_REQUEST_BUDGET, SCHEDULER_WINDOW, DATA_DIR, SITEMAP_URL, SEARCH_INDEX_PATH, UPDATE_REVALIDATE_KINDS
+    from .utils import initialize_json_files
+    from .textnorm import slugify
+    from .fetcher import configure_cache, configure_raw_archive, configure_parser, get_listing_entries, scrape_novel_details, scrape_chapter_details, discover_chapters, chapter_list_pages_to_fetch
+    from .saver import NovelWriter, STORAGES, configure_storage, configure_search_index, get_search_index, chapter_summary, chapter_text, text_hash, get_existing_chapter_max
+    from .fingerprint import FingerprintIndex, simhash
+    from .ratelimit import get_rate_limiter
+    from .retry import get_retry_policy
+    from .metrics import get_metrics, StatsReporter, serve_metrics
+    from .async_fetcher import AsyncFetcher
+    from .pipeline import CrawlPipeline, NovelJob, STAGES
+    from .frontier import Frontier, WAITING, DEFERRED
+    from .scheduler import CrawlScheduler
+    from .coordinator import Coordinator, LeasedFrontier
+    from .ids import configure_id_blocks
+    from .extract_pool import make_extractor
+    from .parsers import BACKENDS
+    from .state_store import StateStore
+    from .genres import GenreRegistry
+    from .export import CrawlExporter
+    from .replay import replay_archive
+    from .sitemap import discover_sitemap
+    from .search import update_index
+except Exception:
+    from config import PARSER_BACKEND, TARGETED_PARSING, MAX_STORIES_TO_CRAWL, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, PER_HOST_CONCURRENCY, EXTRACT_WORKERS, CHAPTER_STORAGE, EXPORT_DIR, METRICS_FILE, METRICS_INTERVAL, METRICS_PORT, PROFILE_PATH, DUPLICATE_DETECTION, SEED_LISTS, COORDINATOR_PATH, WARC_DIR, REPLAY_WORKERS, SCHEDULER_REQUEST_BUDGET, SCHEDULER_NOVEL_REQUEST_BUDGET, SCHEDULER_WINDOW, DATA_DIR, SITEMAP_URL, SEARCH_INDEX_PATH, UPDATE_REVALIDATE_KINDS
+    from utils import initialize_json_files
+    from textnorm import slugify
+    from fetcher import configure_cache, configure_raw_archive, configure_parser, get_listing_entries, scrape_novel_details, scrape_chapter_details, discover_chapters, chapter_list_pages_to_fetch
+    from saver import NovelWriter, STORAGES, configure_storage, configure_search_index, get_search_index, chapter_summary, chapter_text, text_hash, get_existing_chapter_max
+    from fingerprint import FingerprintIndex, simhash
+    from ratelimit import get_rate_limiter
+    from retry import get_retry_policy
+    from metrics import get_metrics, StatsReporter, serve_metrics
+    from async_fetcher import AsyncFetcher
+    from pipeline import CrawlPipeline, NovelJob, STAGES
+    from frontier import Frontier, WAITING, DEFERRED
+    from scheduler import CrawlScheduler
+    from coordinator import Coordinator, LeasedFrontier
+    from ids import configure_id_blocks
+    from extract_pool import make_extractor
+    from parsers import BACKENDS
+    from state_store import StateStore
+    from genres import GenreRegistry
+    from export import CrawlExporter
+    from replay import replay_archive
+    from sitemap import discover_sitemap
+    from search import update_index
 
-def main():
-    global novels_data, chapters_data, genres_data, existing_genre_names_to_id
+def chapter_list_signal(chapter_links, chapter_list_pages):
+    """Compact signature of a novel page's chapter list: page count and highest chapter shown."""
+    return f"{chapter_list_pages}:{max((number for number, _ in chapter_links), default=0)}"
+
+class CrawlSession:
+    """Crawl bookkeeping shared by the blocking crawl and CrawlPipeline (whose hooks these methods are).
+
+    Holds the state store, the genre registry, the scheduler (ordering,
+    request budgets, chapter turns) and the optional exporter. In
+    update mode (--update) completed novels are re-examined: they are only
+    fetched when their listing or chapter-list signals moved, and then only
+    from their last saved chapter on. With dedup on, a chapter whose text
+    repeats another chapter of the same novel (a redirect to the latest
+    chapter, a placeholder page, a mirrored copy) is not saved.
+    """
+
+    def __init__(self, store, genres, exporter=None, update=False, dedup=DUPLICATE_DETECTION, scheduler=None):
+        self.store = store
+        self.genres = genres
+        self.scheduler = scheduler if scheduler is not None else CrawlScheduler(store)
+        self.exporter = exporter
+        self.update = update
+        self.dedup = dedup
+        self.finished = 0  # novels finished in this run
+        self.counted = 0  # of which counted toward MAX_STORIES_TO_CRAWL
+
+    @property
+    def already_crawled(self):
+        return 0 if self.update else self.store.stories_crawled_count
+
+    def counts_toward_budget(self, novel_url):
+        """Whether finishing the novel uses up one of the run's MAX_STORIES_TO_CRAWL (a resumed novel was counted already)."""
+        if self.update:
+            return True
+        progress = self.store.novel(novel_url)
+        return progress is None or not progress['counted']
+
+    def should_fetch_novel(self, novel_url, listing_latest=None, listing_label=None):
+        """Decides from the listing row alone whether the novel page is worth fetching."""
+        progress = self.store.novel(novel_url)
+        if progress is None or not progress['completed']:
+            return True
+        if self.update:
+            if listing_latest is not None:
+                changed = min(listing_latest, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL) > progress['last_chapter']
+            elif listing_label is not None:
+                changed = listing_label != progress['listing_label']
+            else:
+                changed = True  # no listing signal; let the novel page decide
+            if changed:
+                return True
+            logging.getLogger(__name__).info("Skipping unchanged novel: %s", novel_url)
+            return False
+        logging.getLogger(__name__).info("Skipping already completed novel: %s", novel_url)
+        return False
+
+    def prepare_novel(self, novel_detail, novel_url, listing=(None, None), chapter_links=(), chapter_list_pages=1):
+        """Registers genres and works out where chapter scraping should resume.
+
+        Returns (folder_name, start_chapter), or (None, None) when the novel needs no more work.
+        """
+        store = self.store
+        novel_detail['genreList'] = self.genres.register(novel_detail.pop('scraped_genre_names', []))
+
+        # decide folder name early so we can detect existing progress
+        folder_name = slugify(novel_detail.get('title') or novel_detail.get('slug') or novel_detail['novelId'])
+        novel_dir = os.path.join(DATA_DIR, folder_name)
+
+        progress = store.novel(novel_url, folder_name)
+        if progress and progress['novel_id']:
+            # A novel keeps the ID it was first saved under; the one just minted is dropped
+            novel_detail['novelId'] = progress['novel_id']
+        store.upsert_novel(novel_url, folder_name, novel_detail.get('title'), novel_detail.get('novelId'))
+        signal = chapter_list_signal(chapter_links, chapter_list_pages)
+
+        if progress and progress['completed']:
+            if not self.update:
+                # If already completed, skip (the URL is now on record, so later runs skip before fetching the page)
+                logging.getLogger(__name__).info("Skipping already completed novel: %s (%s)", novel_detail.get('title'), folder_name)
+                return None, None
+            last_chapter = progress['last_chapter']
+            if last_chapter >= MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL:
+                unchanged = True
+            elif listing[0] is not None:
+                unchanged = listing[0] <= last_chapter
+            else:
+                # The signal only sees the first chapter-list page, so a paginated list may have
+                # grown on its last page without changing it
+                unchanged = progress['chapter_signal'] == signal and chapter_list_pages <= 1
+            store.set_signals(novel_url, listing[0], listing[1], signal)
+            if unchanged:
+                logging.getLogger(__name__).info("No new chapters for novel '%s'.", novel_detail.get('title'))
+                return None, None
+            # Reopen the novel until this pass finishes. Its latest saved chapter is fetched
+            # again because sites often extend it; an unchanged copy is not rewritten.
+            store.mark_novel(novel_url, False)
+            return folder_name, max(1, last_chapter)
+
+        store.set_signals(novel_url, listing[0], listing[1], signal)
+        if progress is None:
+            # Unknown to the state store: chapters may still be on disk from an earlier run
+            last_chapter = get_existing_chapter_max(novel_dir)
+            if last_chapter:
+                store.mark_novel(novel_url, False, last_chapter)
+        else:
+            last_chapter = progress['last_chapter']
+
+        # Resume after the last saved chapter, or at the first one that failed last time
+        start_chapter = last_chapter + 1
+        first_failed = store.first_failed_chapter(novel_url)
+        if first_failed is not None and first_failed < start_chapter:
+            start_chapter = first_failed
+        if start_chapter > MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL:
+            logging.getLogger(__name__).info("Novel folder already has max chapters (%d). Marking completed.", last_chapter)
+            store.mark_novel(novel_url, True, last_chapter)
+            return None, None
+        return folder_name, start_chapter
+
+    def pending_chapters(self, novel_url, chapter_plan, start_chapter):
+        """Drops chapters that are already saved, or known duplicates, from a chapter plan (the start chapter is always kept)."""
+        if chapter_plan is None:
+            return None
+        saved = self.store.saved_chapters(novel_url, ('saved', 'duplicate'))
+        return [(number, url) for number, url in chapter_plan if number not in saved or number == start_chapter]
+
+    def open_writer(self, novel_detail):
+        """Opens the incremental writer for the novel's folder under data/."""
+        return NovelWriter(novel_detail, base_dir=DATA_DIR)
+
+    def save_chapter(self, job, chapter_number, chapter_detail):
+        """Hands a scraped chapter to the novel's writer, unless the same text is already saved.
+
+        A changed chapter replaces the saved one and keeps its chapterId.
+        Returns False when the chapter was rejected as a repeat of another
+        chapter or an empty placeholder (a soft 404), True otherwise.
+        """
+        text = chapter_text(chapter_detail)
+        digest = text_hash(text)
+        saved = self.store.chapter(job.url, chapter_number)
+        replace = saved is not None and saved['status'] == 'saved'
+        if replace:
+            previous = saved['content_hash']
+            if previous is None:
+                saved_text = job.writer.saved_text(chapter_number)
+                previous = text_hash(saved_text) if saved_text is not None else None
+            if previous == digest:
+                get_metrics().inc('chapters', result='unchanged')
+                logging.getLogger(__name__).debug("  Chapter %d of '%s' is unchanged; not rewriting it.", chapter_number, job.detail['title'])
+                if saved['content_hash'] is None:
+                    self.store.record_chapter(job.url, chapter_number, content_hash=digest, word_count=chapter_detail.get('wordCount'))
+                job.chapters.append(chapter_summary(chapter_detail))
+                return True
+        signature = None
+        if self.dedup:
+            with get_metrics().timer('fingerprint'):
+                signature = simhash(text)
+            repeated = self.repeated_chapter(job, chapter_number, text, digest, signature, chapter_detail.get('wordCount'))
+            if repeated is not None:
+                get_metrics().inc('chapters', result='duplicate')
+                logging.getLogger(__name__).warning("  Chapter %d of '%s' %s; not saving it.", chapter_number, job.detail['title'], repeated)
+                if not replace:
+                    # A saved chapter keeps its row; it simply is not overwritten with the repeat.
+                    self.store.record_chapter(job.url, chapter_number, status='duplicate', content_hash=digest)
+                return False
+            job.fingerprints.add(chapter_number, digest, signature)
+        if replace and saved['chapter_id']:
+            chapter_detail['chapterId'] = saved['chapter_id']
+        job.chapters.append(chapter_summary(chapter_detail))
+        # The writer appends the chapter and updates state once it is on disk
+        job.writer.add(chapter_detail, partial(self.record_chapter, job, chapter_number, chapter_detail, digest, signature), replace=replace)
+        return True
+
+    def repeated_chapter(self, job, chapter_number, text, digest, signature, words):
+        """Why the chapter looks like a soft 404 (no text, or the text of another chapter), or None.
+
+        Loads the novel's fingerprint index from the state store on first use.
+        """
+        if job.fingerprints is None:
+            job.fingerprints = FingerprintIndex()
+            for number, saved_digest, saved_signature in self.store.chapter_fingerprints(job.url):
+                job.fingerprints.add(number, saved_digest, saved_signature)
+        if not text:
+            return "has no text"
+        match = job.fingerprints.find_duplicate(chapter_number, digest, signature, words)
+        if match is None:
+            return None
+        return f"repeats chapter {match[0]} ({match[1]} match)"
+
+    def record_chapter(self, job, chapter_number, chapter_detail, digest=None, signature=None):
+        """Records one saved chapter (or a failed one when chapter_detail is None) in the state store and the export."""
+        if chapter_detail is None:
+            get_metrics().inc('chapters', result='failed')
+            self.store.record_chapter(job.url, chapter_number, status='failed')
+            return
+        get_metrics().inc('chapters', result='saved')
+        self.store.record_chapter(job.url, chapter_number, chapter_detail['chapterId'], 'saved', content_hash=digest, word_count=chapter_detail.get('wordCount', 0), simhash=signature)
+        if self.exporter is not None:
+            self.exporter.chapter(chapter_detail)
+
+    def summarize_novel(self, job):
+        """Fills in the novel's chapter list and totals from every chapter saved for it so far."""
+        novel_detail = job.detail
+        summaries = self.store.chapter_summaries(job.url)
+        novel_detail['chapterList'] = [chapter_id for _, chapter_id, _ in summaries]
+        novel_detail['chapterCount'] = len(summaries)
+        novel_detail['wordCount'] = sum(word_count for _, _, word_count in summaries)
+
+        logging.getLogger(__name__).info("  Scraped %d chapters for novel '%s'.", len(job.chapters), novel_detail['title'])
+
+    def finalize_novel(self, job):
+        """Drains the novel's writer, fills in chapter totals and writes the final metadata.
+
+        Failures are logged; returns the folder or None.
+        """
+        novel_detail = job.detail
+        try:
+            job.writer.flush()  # every chapter is recorded in the store once this returns
+            self.summarize_novel(job)
+            job.writer.update_metadata(novel_detail)
+            novel_dir = job.writer.close()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Failed to save novel '%s' to disk: %s", novel_detail.get('title'), e)
+            return None
+        if job.writer.error is not None:
+            logging.getLogger(__name__).warning("Failed to save novel '%s' to disk: %s", novel_detail.get('title'), job.writer.error)
+            return None
+        return novel_dir
+
+    def finish_novel(self, job, novel_dir, complete):
+        """Marks the novel completed (when nothing is left to fetch), exports it once complete and counts it as crawled."""
+        if complete:
+            self.store.mark_novel(job.url, True)
+            if self.exporter is not None:
+                self.exporter.novel(job.detail)
+        self.finished += 1
+        if self.counts_toward_budget(job.url):
+            self.counted += 1
+        get_metrics().inc('novels', result='complete' if complete else 'partial')
+        if self.update:
+            logging.getLogger(__name__).info("Successfully updated novel %d/%d: %s", self.finished, MAX_STORIES_TO_CRAWL, job.detail['title'])
+        else:
+            crawled = self.store.increment_stories_crawled(job.url)
+            logging.getLogger(__name__).info("Successfully processed novel %d/%d: %s", crawled, MAX_STORIES_TO_CRAWL, job.detail['title'])
+        if novel_dir:
+            logging.getLogger(__name__).info("  Saved to: %s", novel_dir)
+        logging.getLogger(__name__).info("  Request rate: %s", get_rate_limiter().describe())
+        logging.getLogger(__name__).debug("  Metrics: %s", get_metrics().describe())
 
+def main():
     parser = argparse.ArgumentParser(description='Crawl novels and save to data/ folder')
     parser.add_argument('--no-resume', dest='resume', action='store_false', help='Do not resume from previous run; start fresh')
+    parser.add_argument('--seed-list', dest='seed_lists', action='append', metavar='PATH', help=f"Listing path to discover novels from, e.g. danh-sach/truyen-full/ (repeatable; default: {', '.join(SEED_LISTS)})")
+    parser.add_argument('--sitemap', nargs='?', const=SITEMAP_URL, metavar='URL', help=f'Discover novels from the sitemap index at URL instead of the listing pages, unless --seed-list is given too (default: {SITEMAP_URL})')
+    parser.add_argument('--coordinator', nargs='?', const=COORDINATOR_PATH, metavar='PATH', help=f'Crawl novels leased from a work queue shared with other crawler processes (default: {COORDINATOR_PATH})')
+    parser.add_argument('--discover', action='store_true', help='With --coordinator: also walk the seed lists and queue the novels found')
+    parser.add_argument('--request-budget', type=int, default=SCHEDULER_REQUEST_BUDGET, metavar='N', help='Stop starting work once N pages were fetched this run (0: unlimited)')
+    parser.add_argument('--novel-request-budget', type=int, default=SCHEDULER_NOVEL_REQUEST_BUDGET, metavar='N', help='Fetch at most N pages per novel this run; the rest waits for the next run (0: unlimited)')
+    parser.add_argument('--update', action='store_true', help='Re-check completed novels from the first listing page and fetch only chapters that are new or changed')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--concurrency', type=int, default=1, metavar='N', help='Fetch with up to N requests in flight using the asyncio engine (default: 1, blocking)')
+    parser.add_argument('--per-host', type=int, default=PER_HOST_CONCURRENCY, metavar='N', help='Cap on in-flight requests per host in --concurrency mode')
+    parser.add_argument('--workers', action='append', default=[], metavar='STAGE=N', help=f"Worker count for one pipeline stage in --concurrency mode; stages: {', '.join(STAGES)} (repeatable)")
+    parser.add_argument('--extract-workers', type=int, default=EXTRACT_WORKERS, metavar='N', help='Run HTML extraction in N worker processes in --concurrency mode (0: on the event loop)')
+    parser.add_argument('--parser', choices=BACKENDS, default=PARSER_BACKEND, help='HTML parser backend used for extraction')
+    parser.add_argument('--full-parse', dest='targeted_parse', action='store_false', default=TARGETED_PARSING, help='Parse whole pages instead of only the sub-trees the extractors read')
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help='Bypass the on-disk HTTP response cache')
+    parser.add_argument('--warc', nargs='?', const=WARC_DIR, metavar='DIR', help=f'Also archive every page read as WARC records, indexed by URL, in DIR (default: {WARC_DIR})')
+    parser.add_argument('--replay', nargs='?', const=WARC_DIR, metavar='DIR', help=f'Do not crawl: re-extract and re-save every archived novel from the --warc archive in DIR (default: {WARC_DIR})')
+    parser.add_argument('--replay-workers', type=int, default=REPLAY_WORKERS, metavar='N', help='Processes used by --replay (1: in this process)')
+    parser.add_argument('--export', nargs='?', const=EXPORT_DIR, metavar='DIR', help=f'Also stream novels, chapters and genres as NDJSON for mongoimport into DIR (default: {EXPORT_DIR})')
+    parser.add_argument('--export-gzip', action='store_true', help='Gzip the --export files')
+    parser.add_argument('--search-index', nargs='?', const=SEARCH_INDEX_PATH, metavar='PATH', help=f'Also add every chapter saved to the full-text index at PATH (default: {SEARCH_INDEX_PATH}); query it with crawling/search.py')
+    parser.add_argument('--storage', choices=STORAGES, default=CHAPTER_STORAGE, help='Store chapters as .txt files or in a packed per-novel archive')
+    parser.add_argument('--keep-duplicates', dest='dedup', action='store_false', default=DUPLICATE_DETECTION, help='Save chapters even when their text repeats another chapter of the novel, and keep probing past them')
+    parser.add_argument('--stats-file', default=METRICS_FILE, metavar='PATH', help=f'Rewrite crawl metrics as JSON to PATH every --stats-interval seconds (default: {METRICS_FILE})')
+    parser.add_argument('--stats-interval', type=float, default=METRICS_INTERVAL, metavar='SECONDS', help='Seconds between --stats-file rewrites')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, metavar='PORT', help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (0: off)')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PATH, metavar='PATH', help=f'Run under cProfile, log the top functions and dump the stats to PATH (default: {PROFILE_PATH})')
     args = parser.parse_args()
+    if args.update and not args.resume:
+        parser.error("--update needs the saved crawl state; it cannot be combined with --no-resume")
+    if args.update and args.coordinator:
+        parser.error("--update walks the listings itself; it cannot be combined with --coordinator")
+    if args.discover and not args.coordinator:
+        parser.error("--discover only applies with --coordinator")
+    if args.sitemap and args.coordinator and not args.discover:
+        parser.error("--sitemap discovers novels; with --coordinator it needs --discover")
+    if args.replay and (args.update or args.coordinator or args.warc or args.export or args.sitemap):
+        parser.error("--replay works offline on the saved crawl; it cannot be combined with --update, --coordinator, --warc, --export or --sitemap")
 
     # Configure logging
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
     initialize_json_files()
+    configure_cache(args.cache, revalidate_kinds=UPDATE_REVALIDATE_KINDS if args.update else ())
+    configure_raw_archive(args.warc)
+    configure_storage(args.storage)
+    configure_search_index(args.search_index)
+    configure_parser(args.parser, args.targeted_parse)
 
-    # Load or reset state depending on --no-resume
+    # Open the state store (importing a legacy state.json once) and reset it on --no-resume
+    store = StateStore()
+    store.migrate_from_json()
     if not args.resume:
-        state = {"current_page": 1, "stories_crawled_count": 0, "processed_novels": {}}
-        save_state(state)
-    state = load_state()
-    current_page_num = state.get('current_page', 1)
-    stories_crawled_count = state.get('stories_crawled_count', 0)
-    processed_novels = state.get('processed_novels', {})
-
-    while stories_crawled_count < MAX_STORIES_TO_CRAWL:
-        if current_page_num == 1:
-            page_url = urljoin(BASE_URL, HOT_NOVELS_PATH)
-        else:
-            page_url = urljoin(BASE_URL, f"{HOT_NOVELS_PATH}trang-{current_page_num}/")
-        
-        logging.getLogger(__name__).info("\nFetching novel list from: %s", page_url)
-        novel_urls_on_page = get_novel_urls_from_list_page(page_url)
+        store.reset()
+    get_retry_policy().listener = store.record_fetch
+    # IDs come from persistent blocks: in the shared coordinator when other processes crawl too, else in state.db
+    coordinator = Coordinator(args.coordinator).start(discovering=args.discover) if args.coordinator else None
+    configure_id_blocks((coordinator or store).reserve_ids, floors=store.max_ids())
+    if args.replay:
+        try:
+            run_replay(store, args)
+        finally:
+            configure_search_index(None)
+            store.close()
+        return
+    # The sitemap takes the place of the listing pages unless seed lists are named explicitly
+    seed_lists = args.seed_lists if args.seed_lists or not args.sitemap else []
+    frontier = Frontier(store, seed_lists, update=args.update)
+    if coordinator is not None:
+        frontier = LeasedFrontier(coordinator, frontier if args.discover else None)
+    if not args.resume:
+        frontier.reset()
+    if args.sitemap:
+        discover_sitemap(store, args.sitemap)
 
-        if not novel_urls_on_page:
-            print(f"No more novels found on page {current_page_num}. Stopping.")
-            break
+    exporter = CrawlExporter(args.export, args.export_gzip) if args.export else None
+    genres = GenreRegistry(on_new=exporter.genre if exporter else None, id_for=coordinator.genre_id if coordinator else None)
+    # Over a shared queue a window would lease novels other workers could start: rank each lease batch instead
+    window = 1 if coordinator is not None else SCHEDULER_WINDOW
+    scheduler = CrawlScheduler(store, window=window, request_budget=args.request_budget, novel_request_budget=args.novel_request_budget)
+    if coordinator is not None:
+        frontier.order = scheduler.rank
+    session = CrawlSession(store, genres, exporter, update=args.update, dedup=args.dedup, scheduler=scheduler)
 
-        for novel_base_url_from_list in novel_urls_on_page:
-            if stories_crawled_count >= MAX_STORIES_TO_CRAWL:
-                break
+    workers = parse_stage_workers(parser, args.workers) if args.concurrency > 1 else None
+    metrics_server = serve_metrics(args.metrics_port) if args.metrics_port else None
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        with StatsReporter(args.stats_file, args.stats_interval):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                run_crawl(session, frontier, args, workers)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finish_run(session, coordinator)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        configure_raw_archive(None)
+        configure_search_index(None)
+        frontier.save()
+        if coordinator is not None:
+            coordinator.close()
+        store.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if profiler is not None:
+            report_profile(profiler, args.profile)
 
-            # Ensure novel_base_url_from_list ends with a '/' for consistent urljoin
-            novel_base_url = novel_base_url_from_list.rstrip('/') + '/'
+def run_crawl(session, frontier, args, workers=None):
+    if args.concurrency > 1:
+        if args.extract_workers > 0:
+            # Keep every extraction process fed unless the parse stage was sized explicitly.
+            workers.setdefault('parse', 2 * args.extract_workers)
+        with make_extractor(args.extract_workers) as extractor:
+            asyncio.run(crawl_pipelined(session, frontier, args.concurrency, args.per_host, workers, extractor))
+    else:
+        crawl(session, frontier)
 
-            novel_detail = scrape_novel_details(novel_base_url)
-            if not novel_detail:
-                logging.getLogger(__name__).warning("Failed to scrape details for novel: %s. Skipping.", novel_base_url)
-                continue
-            
-            # Handle Genres
-            processed_genre_ids_for_novel = []
-            for genre_name in novel_detail.pop('scraped_genre_names', []):
-                if not genre_name: continue
-                genre_name_clean = genre_name.strip()
-                if genre_name_clean not in existing_genre_names_to_id:
-                    genre_id_str = generate_genre_id()
-                    genre_slug = create_slug_from_text(genre_name_clean)
-                    genre_desc = f"{genre_name_clean} {genre_id_str}"
-                    created_g, updated_g = generate_random_genre_dates()
-                    
-                    new_genre = {
-                        "genreId": genre_id_str,
-                        "name": genre_name_clean,
-                        "description": genre_desc,
-                        "slug": genre_slug,
-                        "isActive": True,
-                        "created": created_g,
-                        "updated": updated_g,
-                        "_class": "com.content.content_service.models.GenreEntity"
-                    }
-                    genres_data.append(new_genre)
-                    existing_genre_names_to_id[genre_name_clean] = genre_id_str
-                    processed_genre_ids_for_novel.append(genre_id_str)
+def run_replay(store, args):
+    """--replay: rebuilds every archived novel's folder from the raw archive, without network access."""
+    genres = GenreRegistry()
+    with StatsReporter(args.stats_file, args.stats_interval):
+        counts = replay_archive(store, genres, args.replay, workers=args.replay_workers, storage=args.storage, dedup=args.dedup)
+    logging.getLogger(__name__).info("Replay finished. Novels rebuilt: %d, chapters: %d, unreadable novel pages: %d, failed: %d",
+                                     counts['novels'], counts['chapters'], counts['missing'], counts['failed'])
+    if get_search_index() is not None:
+        # Replay workers in their own processes write without the index; catch up from the rebuilt folders
+        counts = update_index(get_search_index(), DATA_DIR)
+        logging.getLogger(__name__).info("Search index: %d chapters indexed, %d removed", counts['indexed'], counts['removed'])
+    logging.getLogger(__name__).info("Metrics: %s", get_metrics().describe())
+
+def report_profile(profiler, path, limit=30):
+    """Dumps cProfile stats to path (for pstats/snakeviz) and logs the top functions by cumulative and own time.
+
+    Only the main thread is profiled: the event loop and the blocking crawl, not writer threads or extraction processes.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    profiler.dump_stats(path)
+    for sort_key in ('cumulative', 'tottime'):
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort_key).print_stats(limit)
+        logging.getLogger(__name__).info("Profile, top %d functions by %s time:\n%s", limit, sort_key, out.getvalue())
+    logging.getLogger(__name__).info("Profile stats written to %s", path)
+
+def crawl(session, frontier):
+    """Blocking crawl, one request at a time (listing pages are prefetched by the frontier).
+
+    The scheduler hands out novels best first; up to scheduler.active of them
+    are in progress at once and take turns of scheduler.slice_size page fetches.
+    """
+    scheduler = session.scheduler
+    novel_budget = MAX_STORIES_TO_CRAWL - session.already_crawled
+    entries = scheduler.ordered(frontier.entries(get_listing_entries))
+    active = collections.deque()  # (entry, crawl_novel generator, counts toward novel_budget) of the novels in progress, in turn order
+    admitting = True
+    try:
+        while True:
+            waiting = False
+            while admitting and len(active) < scheduler.active and not scheduler.exhausted:
+                entry = next(entries, None)
+                if entry is None:
+                    admitting = False
+                    break
+                if entry is WAITING:
+                    # Other workers (or this one) hold every queued novel; come back after a turn or a poll interval
+                    waiting = True
+                    break
+                counts = session.counts_toward_budget(entry.url)
+                if counts and session.counted + sum(item[2] for item in active) >= novel_budget:
+                    admitting = False  # resumed novels come first, so only new ones are left
+                    break
+                active.append((entry, crawl_novel(session, entry), counts))
+            if not active:
+                if waiting:
+                    time.sleep(frontier.poll)
+                    continue
+                break
+            entry, steps, counts = active.popleft()
+            try:
+                for _ in range(scheduler.slice_size):
+                    next(steps)
+            except StopIteration as done:
+                if done.value is DEFERRED:
+                    frontier.deferred(entry)
                 else:
-                    processed_genre_ids_for_novel.append(existing_genre_names_to_id[genre_name_clean])
-            novel_detail['genreList'] = list(set(processed_genre_ids_for_novel))
+                    frontier.decided(entry, done.value)
+                scheduler.finished(entry.url)
+            else:
+                active.append((entry, steps, counts))
+    finally:
+        for entry, steps, _ in active:
+            steps.close()
+        entries.close()
 
-            # decide folder name early so we can detect existing progress
-            folder_name = create_slug_from_text(novel_detail.get('title') or novel_detail.get('slug') or novel_detail['novelId'])
-            novel_dir = os.path.join('data', folder_name)
+def crawl_novel(session, entry):
+    """Crawls one novel from the frontier, yielding after every page fetch so that novels can take turns.
 
-            # If already completed, skip
-            processed_info = processed_novels.get(folder_name, {})
-            if processed_info.get('completed'):
-                logging.getLogger(__name__).info("Skipping already completed novel: %s (%s)", novel_detail.get('title'), folder_name)
-                continue
+    Returns (as the generator's value) False when its page could not be fetched, DEFERRED when the run's
+    request budget ran out first, and True once it is decided.
+    """
+    scheduler = session.scheduler
+    novel_base_url = entry.url
+    if not session.should_fetch_novel(novel_base_url, *entry.listing):
+        return True
+    if not scheduler.spend(novel_base_url):
+        return DEFERRED
+
+    novel_detail = scrape_novel_details(novel_base_url)
+    yield
+    if not novel_detail:
+        logging.getLogger(__name__).warning("Failed to scrape details for novel: %s. Skipping.", novel_base_url)
+        return False
+
+    chapter_links = novel_detail.pop('scraped_chapter_links', [])
+    chapter_list_pages = novel_detail.pop('scraped_chapter_list_pages', 1)
+    folder_name, start_chapter = session.prepare_novel(novel_detail, novel_base_url, entry.listing, chapter_links, chapter_list_pages)
+    if folder_name is None:
+        return True
+
+    # Prefer the novel's own chapter list; probe chuong-N/ in order only when it has none.
+    chapter_plan = session.pending_chapters(novel_base_url, discover_chapters(novel_base_url, chapter_links, chapter_list_pages, start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL), start_chapter)
+    if chapter_links:
+        scheduler.spend(novel_base_url, len(chapter_list_pages_to_fetch(len(chapter_links), chapter_list_pages, start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL)), force=True)
+    if chapter_plan is None:
+        logging.getLogger(__name__).info("Starting sequential chapter scrape for novel '%s' from chapter %d up to %d.", novel_detail['title'], start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL)
+        # Construct chapter URL: e.g., novel_base_url + "chuong-1/"
+        chapter_candidates = ((num, urljoin(novel_base_url, f"chuong-{num}/")) for num in range(start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL + 1))
+    else:
+        logging.getLogger(__name__).info("Found %d chapters to scrape for novel '%s' in its chapter list (from chapter %d up to %d).", len(chapter_plan), novel_detail['title'], start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL)
+        chapter_candidates = chapter_plan
+
+    job = NovelJob(novel_base_url, entry.page, novel_detail, folder_name, start_chapter, chapter_plan)
+    job.writer = session.open_writer(novel_detail)
+    # A listed novel is complete once every listed chapter is saved; a probed one only at the chapter cap.
+    complete = chapter_plan is not None
+    for chapter_num_to_try, chapter_url in chapter_candidates:
+        if not scheduler.spend(novel_base_url):
+            # Out of requests for this novel or this run; it stays incomplete and is resumed next run
+            complete = False
+            break
+        # Pass chapter_num_to_try as chapter_number_expected
+        chapter_detail = scrape_chapter_details(chapter_url, novel_detail['novelId'], chapter_num_to_try)
+        yield
 
-            # Scrape Chapters sequentially for this novel (resume-aware)
-            start_chapter = get_existing_chapter_max(novel_dir) + 1
-            if start_chapter > MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL:
-                logging.getLogger(__name__).info("Novel folder already has max chapters (%d). Marking completed.", start_chapter-1)
-                processed_novels[folder_name] = {"last_chapter": start_chapter-1, "completed": True}
-                state['processed_novels'] = processed_novels
-                save_state(state)
+        if not chapter_detail:
+            if chapter_plan is not None:
+                # A listed chapter failed; skip it rather than truncating the novel.
+                logging.getLogger(__name__).warning("  Skipping chapter %d of '%s' (URL: %s) after an error.", chapter_num_to_try, novel_detail['title'], chapter_url)
+                session.record_chapter(job, chapter_num_to_try, None)
+                complete = False
                 continue
+            # scrape_chapter_details returned None, meaning chapter likely doesn't exist or major error
+            logging.getLogger(__name__).info("  Stopping chapter scrape for '%s' at chapter %d (URL: %s) due to error or chapter not found.", novel_detail['title'], chapter_num_to_try, chapter_url)
+            break # Stop trying chapters for this novel
 
-            logging.getLogger(__name__).info("Starting sequential chapter scrape for novel '%s' from chapter %d up to %d.", novel_detail['title'], start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL)
-            novel_total_word_count = 0
-            chapter_ids_for_this_novel = []
-            chapters_scraped_for_this_novel_count = 0
-            chapters_for_this_novel = []
-            for chapter_num_to_try in range(start_chapter, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL + 1):
-                # Construct chapter URL: e.g., novel_base_url + "chuong-1/"
-                # Ensure novel_base_url ends with a slash.
-                chapter_url = urljoin(novel_base_url, f"chuong-{chapter_num_to_try}/")
-                
-                # Pass chapter_num_to_try as chapter_number_expected
-                chapter_detail = scrape_chapter_details(chapter_url, novel_detail['novelId'], chapter_num_to_try)
-                
-                if chapter_detail:
-                    chapters_data.append(chapter_detail)
-                    chapters_for_this_novel.append(chapter_detail)
-                    chapter_ids_for_this_novel.append(chapter_detail['chapterId'])
-                    novel_total_word_count += chapter_detail.get('wordCount', 0)
-                    chapters_scraped_for_this_novel_count +=1
-                else:
-                    # scrape_chapter_details returned None, meaning chapter likely doesn't exist or major error
-                    logging.getLogger(__name__).info("  Stopping chapter scrape for '%s' at chapter %d (URL: %s) due to error or chapter not found.", novel_detail['title'], chapter_num_to_try, chapter_url)
-                    break # Stop trying chapters for this novel
-
-                # Persist partial progress: save novel (metadata + all chapters collected so far) and update state
-                try:
-                    save_novel(novel_detail, chapters_for_this_novel, base_dir='data')
-                except Exception as e:
-                    logging.getLogger(__name__).warning("Failed to save partial novel '%s': %s", novel_detail.get('title'), e)
-
-                processed_novels[folder_name] = {"last_chapter": start_chapter + chapters_scraped_for_this_novel_count - 1, "completed": False}
-                state['current_page'] = current_page_num
-                state['stories_crawled_count'] = stories_crawled_count
-                state['processed_novels'] = processed_novels
-                save_state(state)
-            
-            novel_detail['chapterList'] = chapter_ids_for_this_novel
-            novel_detail['chapterCount'] = len(chapter_ids_for_this_novel)
-            novel_detail['wordCount'] = novel_total_word_count
-            
-            logging.getLogger(__name__).info("  Scraped %d chapters for novel '%s'.", chapters_scraped_for_this_novel_count, novel_detail['title'])
-            
-            # Save novel metadata and chapters to disk (data/<novel-slug>/)
-            try:
-                novel_dir = save_novel(novel_detail, chapters_for_this_novel, base_dir='data')
-            except Exception as e:
-                novel_dir = None
-                logging.getLogger(__name__).warning("Failed to save novel '%s' to disk: %s", novel_detail.get('title'), e)
-
-            novels_data.append(novel_detail)
-            stories_crawled_count += 1
-            logging.getLogger(__name__).info("Successfully processed novel %d/%d: %s", stories_crawled_count, MAX_STORIES_TO_CRAWL, novel_detail['title'])
-            if novel_dir:
-                logging.getLogger(__name__).info("  Saved to: %s", novel_dir)
-
-            if stories_crawled_count >= MAX_STORIES_TO_CRAWL:
-                break
-        
-        current_page_num += 1
+        # Persist partial progress
+        if not session.save_chapter(job, chapter_num_to_try, chapter_detail) and chapter_plan is None:
+            # A probe that lands on a repeated chapter has run past the last real one (a soft 404)
+            logging.getLogger(__name__).info("  Stopping chapter scrape for '%s' at chapter %d (URL: %s): the page repeats an earlier chapter.", novel_detail['title'], chapter_num_to_try, chapter_url)
+            break
+
+        if chapter_plan is None and chapter_num_to_try >= MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL:
+            complete = True
+
+    # Save novel metadata and outstanding chapters to disk (data/<novel-slug>/)
+    novel_dir = session.finalize_novel(job)
+    session.finish_novel(job, novel_dir, complete)
+    return True
+
+def parse_stage_workers(parser, specs):
+    workers = {}
+    for spec in specs:
+        stage, _, count = spec.partition('=')
+        if stage not in STAGES or not count.isdigit() or int(count) < 1:
+            parser.error(f"invalid --workers value {spec!r}; expected STAGE=N with STAGE in {', '.join(STAGES)}")
+        workers[stage] = int(count)
+    return workers
 
-    # Persist genres to data/genres.json (others are saved per-novel)
-    genres_path = os.path.join('data', 'genres.json')
-    with open(genres_path, 'w', encoding='utf-8') as f:
-        json.dump(genres_data, f, ensure_ascii=False, indent=2)
+async def crawl_pipelined(session, frontier, concurrency, per_host, workers, extractor=None):
+    """Concurrent crawl: listing, novel, chapter, parse and persist stages overlap through bounded queues."""
+    async with AsyncFetcher(max_in_flight=concurrency, per_host=per_host) as fetcher:
+        pipeline = CrawlPipeline(
+            fetcher,
+            session,
+            frontier,
+            already_crawled=session.already_crawled,
+            workers=workers,
+            extractor=extractor,
+        )
+        await pipeline.run()
 
-    logging.getLogger(__name__).info("\nCrawling finished. Total novels: %d, Total chapters: %d, Total genres: %d", len(novels_data), len(chapters_data), len(genres_data))
+def finish_run(session, coordinator=None):
+    # genres.json is kept up to date by the registry and novels are saved per-novel, so only report totals
+    logging.getLogger(__name__).info("\nCrawling finished. Novels this run: %d, Total novels: %d, Total chapters: %d, Total genres: %d",
+                                     session.finished, session.store.stories_crawled_count, session.store.chapter_count(), len(session.genres))
+    totals = session.store.fetch_totals()
+    if totals['urls']:
+        logging.getLogger(__name__).info("Fetch retries: %d, failed fetches: %d, over %d URLs (see the fetches table in %s)",
+                                         totals['retries'], totals['failures'], totals['urls'], session.store.path)
+    logging.getLogger(__name__).info("Scheduler: %s", session.scheduler.describe())
+    if coordinator is not None:
+        counts = coordinator.counts()
+        logging.getLogger(__name__).info("Coordinator queue: %d queued, %d leased, %d done, %d failed",
+                                         counts['queued'], counts['leased'], counts['done'], counts['failed'])
+    logging.getLogger(__name__).info("Metrics: %s", get_metrics().describe())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
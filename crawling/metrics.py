@@ -0,0 +1,327 @@
+"""Crawl metrics: counters, latency histograms and gauges.
+
+One Metrics instance is shared by the whole process (get_metrics()), like
+the rate limiter. Recording is a dict update under a lock, cheap enough to
+leave on for every request.
+
+What gets recorded:
+  stage_seconds{stage}  latency histogram per stage:
+                        dns, connect (async engine only), ttfb, download,
+                        parse (HTML -> tree), extract (tree -> dict),
+                        fingerprint (chapter SimHash), save, metadata, fsync
+                        (NovelWriter), index (search.py postings writes),
+                        state (state.db writes)
+  http_requests         requests sent (cache hits excluded)
+  http_responses{status}, http_errors{error}, http_bytes, cache{result}
+  http_retries{reason}, http_failures{reason}, circuit_opens{host}  (retry.py)
+  chapters{result}, novels{result}, frontier_entries{result}  (new/seen/unchanged/changed listing and sitemap entries)
+  coordinator_enqueued, coordinator_leases, coordinator_reclaims  (coordinator.py)
+  warc_records{kind}, warc_bytes  (warc.py), replay_novels{result}, replay_chapters  (replay.py)
+  sitemap_files{result}, sitemap_urls{kind}  (sitemap.py: sitemap files read/unchanged, novel/chapter URLs found)
+  search_chapters{result}  (search.py: chapters indexed/unchanged/removed)
+  scheduler_requests, scheduler_budget_stops{budget}  (scheduler.py: page fetches charged, run/novel budget refusals)
+  queue_depth{queue}, requests_in_flight  gauges sampled when a snapshot is taken
+
+A snapshot is plain JSON (StatsReporter writes one to a file periodically)
+and render_prometheus() gives the Prometheus text format served by
+serve_metrics().
+"""
+import bisect
+import http.server
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from .config import METRICS_FILE, METRICS_INTERVAL
+except Exception:
+    from config import METRICS_FILE, METRICS_INTERVAL
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_PREFIX = 'crawler_'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _label_text(key):
+    return ','.join(f"{name}={value}" for name, value in key)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the open-ended bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self._counters = {}  # name -> {label key: value}
+            self._histograms = {}  # name -> {label key: Histogram}
+            self._gauges = {}  # name -> {label key: callable}
+
+    # --- recording ---------------------------------------------------------------------
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def observe_stage(self, stage, seconds):
+        self.observe('stage_seconds', seconds, stage=stage)
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the block into stage_seconds{stage}, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+
+    def gauge(self, name, sample, **labels):
+        """Registers sample() as the current value of a gauge; it is called on every snapshot."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = sample
+
+    def drop_gauges(self, name):
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    # --- reading -----------------------------------------------------------------------
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def counter_total(self, name):
+        with self._lock:
+            return sum(self._counters.get(name, {}).values())
+
+    def _sample_gauges(self):
+        with self._lock:
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+        values = {}
+        for name, series in gauges.items():
+            for key, sample in series.items():
+                try:
+                    values.setdefault(name, {})[key] = sample()
+                except Exception:
+                    continue  # a gauge whose owner is gone
+        return values
+
+    def snapshot(self):
+        """Everything recorded so far as a JSON-serialisable dict."""
+        gauges = self._sample_gauges()
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            counters = {name: {_label_text(key): value for key, value in series.items()} for name, series in self._counters.items()}
+            histograms = {name: {_label_text(key): h.summary() for key, h in series.items()} for name, series in self._histograms.items()}
+            requests = sum(self._counters.get('http_requests', {}).values())
+            transferred = sum(self._counters.get('http_bytes', {}).values())
+        return {
+            'time': time.time(),
+            'uptime': round(uptime, 3),
+            'requests_per_second': round(requests / uptime, 3) if uptime else 0.0,
+            'bytes_per_second': round(transferred / uptime, 1) if uptime else 0.0,
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': {name: {_label_text(key): value for key, value in series.items()} for name, series in gauges.items()},
+        }
+
+    def render_prometheus(self):
+        """The Prometheus text exposition format (version 0.0.4)."""
+        def labels_text(key, extra=()):
+            pairs = list(key) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + '}'
+
+        gauges = self._sample_gauges()
+        lines = []
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            for name, series in sorted(self._counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f"{metric}{labels_text(key)} {value}" for key, value in sorted(series.items()))
+            for name, series in sorted(self._histograms.items()):
+                metric = PROMETHEUS_PREFIX + name
+                lines.append(f"# TYPE {metric} histogram")
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f"{metric}_bucket{labels_text(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric}_bucket{labels_text(key, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{metric}_sum{labels_text(key)} {h.sum}")
+                    lines.append(f"{metric}_count{labels_text(key)} {h.count}")
+        for name, series in sorted(gauges.items()):
+            metric = PROMETHEUS_PREFIX + name
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(f"{metric}{labels_text(key)} {value}" for key, value in sorted(series.items()))
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}uptime_seconds gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}uptime_seconds {uptime:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def describe(self):
+        """One-line summary for the log."""
+        snap = self.snapshot()
+        stages = snap['histograms'].get('stage_seconds', {})
+        parts = [f"{snap['requests_per_second']:.2f} req/s", f"{snap['bytes_per_second'] / 1024:.1f} KiB/s"]
+        for stage in ('ttfb', 'download', 'parse', 'extract', 'save', 'state'):
+            summary = stages.get(f"stage={stage}")
+            if summary and summary['count']:
+                parts.append(f"{stage} p50={summary['p50'] * 1000:.1f}ms")
+        return ', '.join(parts)
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The process-wide metrics registry."""
+    return _metrics
+
+
+def write_stats(path, metrics=None):
+    """Writes a snapshot to path atomically."""
+    snap = (metrics or _metrics).snapshot()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.stats.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(snap, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class StatsReporter:
+    """Rewrites a JSON stats file every `interval` seconds from a daemon thread, and once more on stop().
+
+    Use as a context manager around the crawl.
+    """
+
+    def __init__(self, path=METRICS_FILE, interval=METRICS_INTERVAL, metrics=None):
+        self.path = path
+        self.interval = max(0.1, float(interval))
+        self.metrics = metrics or _metrics
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stats-reporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            write_stats(self.path, self.metrics)
+        except OSError as e:
+            logging.getLogger(__name__).warning("Could not write stats to %s: %s", self.path, e)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def serve_metrics(port, host='127.0.0.1', metrics=None):
+    """Serves /metrics (Prometheus text) and /stats.json on a daemon thread. Returns the server; call shutdown() to stop it."""
+    metrics = metrics or _metrics
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path in ('/', '/metrics'):
+                body, content_type = metrics.render_prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/stats.json':
+                body, content_type = json.dumps(metrics.snapshot()).encode('utf-8'), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.getLogger(__name__).debug("metrics endpoint: " + format, *args)
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-endpoint', daemon=True).start()
+    logging.getLogger(__name__).info("Serving metrics on http://%s:%d/metrics", host, server.server_address[1])
+    return server
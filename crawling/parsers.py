@@ -0,0 +1,81 @@
+"""Parser backends for the extraction functions in fetcher.py.
+
+A backend turns raw page bytes into the BeautifulSoup tree the extractors
+query. Two things make it faster than a plain `BeautifulSoup(content,
+'html.parser')`:
+
+- the tree builder can be lxml's C parser instead of the pure-Python one;
+- with targeted parsing, only the sub-trees a page kind's extractors read are
+  built (SoupStrainer), so navigation, ads and footers never become Tag
+  objects.
+
+Both keep the extractors' output identical, because they still run the same
+selectors against BeautifulSoup tags and bs4 does the serialisation for
+`content` and `description`.
+"""
+import logging
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from .config import PARSER_BACKEND, TARGETED_PARSING
+except Exception:
+    from config import PARSER_BACKEND, TARGETED_PARSING
+
+BACKENDS = ('html.parser', 'lxml')
+
+# Classes of the top-level elements each extractor reads. Every selector in
+# fetcher.extract_* is rooted at one of these, so their sub-trees are enough.
+PAGE_CLASSES = {
+    'listing': ('list-truyen', 'truyen-title'),
+    'novel': ('title', 'book', 'info', 'desc-text', 'list-chapter', 'pagination'),
+    'chapter_list': ('list-chapter', 'pagination'),
+    'chapter': ('chapter-title', 'chapter-c'),
+}
+
+_strainers = {}
+
+
+def _strainer(kind):
+    strainer = _strainers.get(kind)
+    if strainer is None:
+        wanted = frozenset(PAGE_CLASSES[kind])
+
+        def has_wanted_class(value):
+            # bs4 may hand over a single class or the whole space-separated value.
+            return value is not None and not wanted.isdisjoint(value.split())
+
+        strainer = _strainers[kind] = SoupStrainer(class_=has_wanted_class)
+    return strainer
+
+
+def backend_available(name):
+    if name == 'html.parser':
+        return True
+    if name == 'lxml':
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    return False
+
+
+class ParserBackend:
+    def __init__(self, name=PARSER_BACKEND, targeted=TARGETED_PARSING):
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown parser backend {name!r}; expected one of {', '.join(BACKENDS)}")
+        if not backend_available(name):
+            logging.getLogger(__name__).warning("Parser backend %s is not installed; falling back to html.parser", name)
+            name = 'html.parser'
+        self.name = name
+        self.targeted = targeted
+
+    def parse(self, content, kind=None):
+        """Parses raw page bytes. With a known kind and targeted parsing only its sub-trees are built."""
+        if self.targeted and kind in PAGE_CLASSES:
+            return BeautifulSoup(content, self.name, parse_only=_strainer(kind))
+        return BeautifulSoup(content, self.name)
+
+    def __repr__(self):
+        return f"ParserBackend({self.name!r}, targeted={self.targeted})"
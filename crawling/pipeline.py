@@ -0,0 +1,379 @@
+"""Staged producer/consumer crawl pipeline.
+
+    listing -> novel detail -> chapter fetch -> parse/extract -> persist
+
+Every arrow is a bounded asyncio.Queue, so a slow stage makes the stages in
+front of it wait instead of letting work pile up in memory, while network
+I/O, HTML extraction and disk writes of different novels overlap. Each stage
+runs its own number of workers (PIPELINE_WORKERS). Extraction goes through an
+extractor object, so it can run in-process or in a process pool.
+
+The pipeline only moves work between stages; crawl bookkeeping (genres,
+resume checks, crawl state, counting finished novels) is supplied by the
+caller as a hooks object so the blocking and the pipelined crawl share it.
+Novels come from a frontier.Frontier, which prefetches listing pages and
+drops novels seen before; the listing stage's worker count is how many
+listing pages it fetches ahead. The hooks' scheduler (scheduler.py) ranks
+the novels, meters page fetches against the run's budgets and has the
+novels in progress take turns at the chapter stage.
+"""
+import asyncio
+import collections
+import logging
+from urllib.parse import urljoin
+
+try:
+    from .config import PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, CHAPTER_WINDOW, MAX_STORIES_TO_CRAWL, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL
+    from .extract_pool import InlineExtractor
+    from .async_fetcher import discover_chapters_async
+    from .fetcher import chapter_list_pages_to_fetch
+    from .metrics import get_metrics
+    from .frontier import DEFERRED
+except Exception:
+    from config import PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, CHAPTER_WINDOW, MAX_STORIES_TO_CRAWL, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL
+    from extract_pool import InlineExtractor
+    from async_fetcher import discover_chapters_async
+    from fetcher import chapter_list_pages_to_fetch
+    from metrics import get_metrics
+    from frontier import DEFERRED
+
+STAGES = ('listing', 'novel', 'chapter', 'parse', 'persist')
+
+# Cheap check on raw chapter bytes so the probe can stop without waiting for extraction.
+CHAPTER_CONTENT_MARKER = b'chapter-c'
+
+_STOP = object()
+
+
+class NovelJob:
+    """A novel admitted past the detail stage, plus its in-order persistence buffer.
+
+    Chapters are tracked by sequence position: the index in `plan` when the
+    chapter list is known, or the offset from start_chapter while probing.
+    """
+
+    def __init__(self, url, page_num, detail, folder_name, start_chapter, plan=None):
+        self.url = url
+        self.page_num = page_num
+        self.detail = detail
+        self.folder_name = folder_name
+        self.start_chapter = start_chapter
+        self.plan = plan  # [(chapter_number, url)] from the chapter list, or None to probe
+        self.chapters = []  # saver.chapter_summary of each chapter scraped in this run
+        self.pending = {}  # seq -> (chapter number, parsed chapter or None)
+        self.next_seq = 0
+        self.fetched = 0  # chapters the fetch stage emitted so far
+        self.end_seq = None  # number of chapters the fetch stage emitted in all
+        self.truncated = False
+        self.writer = None
+        self.failed = 0  # planned chapters that could not be fetched or extracted
+        self.reached_max = False  # a probe got all the way to the chapter cap
+        self.out_of_budget = False  # the scheduler's request budget stopped fetching early
+        self.fingerprints = None  # fingerprint.FingerprintIndex of the novel's chapters, loaded by the first save
+        self.entry = None  # the frontier entry the novel came from; reported decided once the novel finishes
+
+class CrawlPipeline:
+    """Runs one crawl through the five stages.
+
+    Hooks (called on the event loop thread unless noted; see main.CrawlSession):
+      scheduler: scheduler.CrawlScheduler ordering novels, metering fetches and sizing chapter turns
+      should_fetch_novel(novel_url, listing_latest, listing_label) -> bool, before the novel page is fetched
+      counts_toward_budget(novel_url) -> whether the novel uses up one of the run's max_stories (resumed ones do not)
+      prepare_novel(novel_detail, novel_url, listing, chapter_links, chapter_list_pages)
+        -> (folder_name, start_chapter) or (None, None) to skip
+      pending_chapters(novel_url, plan, start_chapter) -> the planned chapters still to fetch
+      open_writer(novel_detail) -> saver.NovelWriter for the novel; runs in a worker thread
+      save_chapter(job, chapter_number, chapter) -> False when the chapter repeats another one (soft 404),
+        else hands it to job.writer; runs in a worker thread
+      record_chapter(job, chapter_number, None) for a chapter that failed
+      finalize_novel(job) -> novel_dir after the final flush; runs in a worker thread
+      finish_novel(job, novel_dir, complete)
+    """
+
+    def __init__(self, fetcher, hooks, frontier, already_crawled, workers=None, queue_size=PIPELINE_QUEUE_SIZE,
+                 max_stories=MAX_STORIES_TO_CRAWL, max_chapters=MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, extractor=None,
+                 chapter_window=CHAPTER_WINDOW):
+        self.fetcher = fetcher
+        self.hooks = hooks
+        self.frontier = frontier
+        self.extractor = extractor or InlineExtractor()
+        self.workers = dict(PIPELINE_WORKERS)
+        self.workers.update(workers or {})
+        self.queue_size = queue_size
+        self.max_chapters = max_chapters
+        self.chapter_window = max(1, int(chapter_window))
+        self.novel_budget = max(0, max_stories - already_crawled)
+        self.scheduler = hooks.scheduler
+        self._admitted = 0  # novels admitted that count toward novel_budget
+        self._ready = collections.deque()  # novels between two chapter turns
+        self._fetching = 0  # novels in a chapter turn right now
+
+    def _over_budget(self, novel_url):
+        return self._admitted >= self.novel_budget and self.hooks.counts_toward_budget(novel_url)
+
+    async def run(self):
+        n = {stage: max(1, int(self.workers.get(stage, 1))) for stage in STAGES}
+        self.novel_q = asyncio.Queue(self.queue_size)
+        self.chapter_q = asyncio.Queue(self.queue_size)
+        self.parse_q = asyncio.Queue(self.queue_size)
+        # Persistence is sharded by novel so one novel's chapters are always
+        # written, in order, by the same worker.
+        self.persist_qs = [asyncio.Queue(self.queue_size) for _ in range(n['persist'])]
+        # Novels past the detail stage, each holding a slot until its last chapter is fetched
+        self._active_slots = asyncio.Semaphore(max(self.scheduler.active, n['chapter']))
+        self._rotation = asyncio.Condition()
+        metrics = get_metrics()
+        for name, q in (('novel', self.novel_q), ('chapter', self.chapter_q), ('parse', self.parse_q)):
+            metrics.gauge('queue_depth', q.qsize, queue=name)
+        metrics.gauge('queue_depth', lambda: sum(q.qsize() for q in self.persist_qs), queue='persist')
+
+        stages = [
+            ([self._listing_worker(n['listing'])], [self.novel_q] * n['novel']),
+            ([self._novel_worker() for _ in range(n['novel'])], [self.chapter_q] * n['chapter']),
+            ([self._chapter_worker() for _ in range(n['chapter'])], [self.parse_q] * n['parse']),
+            ([self._parse_worker() for _ in range(n['parse'])], self.persist_qs),
+            ([self._persist_worker(q) for q in self.persist_qs], []),
+        ]
+        running = [[asyncio.create_task(coro) for coro in coros] for coros, _ in stages]
+        # Shut the stages down front to back: once every worker of a stage has
+        # finished, each worker of the next stage gets one stop marker.
+        try:
+            for tasks, (_, downstream) in zip(running, stages):
+                await asyncio.gather(*tasks)
+                for q in downstream:
+                    await q.put(_STOP)
+        finally:
+            metrics.drop_gauges('queue_depth')
+
+    # --- stage 1: listing discovery -------------------------------------------------
+    async def _listing_worker(self, prefetch):
+        entries = self.scheduler.ordered_async(self.frontier.entries_async(self._listing_entries, prefetch))
+        try:
+            async for entry in entries:
+                if self._over_budget(entry.url) or self.scheduler.exhausted:
+                    break  # resumed novels come first, so only new ones are left
+                await self.novel_q.put(entry)
+        finally:
+            await entries.aclose()
+
+    async def _listing_entries(self, page_url):
+        content = await self.fetcher.fetch_raw(page_url, 'listing')
+        return await self.extractor.listing_entries_async(content, page_url) if content else []
+
+    # --- stage 2: novel detail ------------------------------------------------------
+    async def _novel_worker(self):
+        while True:
+            item = await self.novel_q.get()
+            if item is _STOP:
+                return
+            if self._over_budget(item.url) or self.scheduler.exhausted:
+                # Drain what listing queued before the budget ran out; the frontier lists it again next run
+                self.frontier.deferred(item)
+                continue
+            decided = False
+            try:
+                decided = await self._scrape_novel(item)
+            except Exception:
+                logging.getLogger(__name__).exception("Novel stage failed for %s", item.url)
+            if decided is DEFERRED:
+                self.frontier.deferred(item)
+            elif decided is not None:
+                self.frontier.decided(item, decided)
+
+    async def _scrape_novel(self, entry):
+        """Admits one frontier entry. Returns False when the novel page could not be fetched, True when the
+        novel needs no work, DEFERRED when a budget kept it from starting, and None when it was admitted
+        (the frontier hears about it once it finishes)."""
+        novel_url, listing = entry.url, entry.listing
+        if not self.hooks.should_fetch_novel(novel_url, *listing):
+            return True
+        if not self.scheduler.spend(novel_url):
+            return DEFERRED  # out of requests this run; listed (or queued) again next time
+        logging.getLogger(__name__).info("Scraping novel details from: %s", novel_url)
+        content = await self.fetcher.fetch_raw(novel_url, 'novel')
+        if content is None:
+            logging.getLogger(__name__).warning("Failed to scrape details for novel: %s. Skipping.", novel_url)
+            return False
+        novel_detail = await self.extractor.novel_async(content, novel_url)
+        chapter_links = novel_detail.pop('scraped_chapter_links', [])
+        chapter_list_pages = novel_detail.pop('scraped_chapter_list_pages', 1)
+        folder_name, start_chapter = self.hooks.prepare_novel(novel_detail, novel_url, listing, chapter_links, chapter_list_pages)
+        if folder_name is None:
+            return True
+        counts = self.hooks.counts_toward_budget(novel_url)
+        if counts and self._admitted >= self.novel_budget:
+            return DEFERRED  # registered but not crawled: listed (or queued) again next time
+        self._admitted += counts
+        plan = await discover_chapters_async(self.fetcher, novel_url, chapter_links, chapter_list_pages, start_chapter, self.max_chapters)
+        if chapter_links:
+            list_pages = chapter_list_pages_to_fetch(len(chapter_links), chapter_list_pages, start_chapter, self.max_chapters)
+            self.scheduler.spend(novel_url, len(list_pages), force=True)
+        plan = self.hooks.pending_chapters(novel_url, plan, start_chapter)
+        if plan is None:
+            logging.getLogger(__name__).info("Starting sequential chapter scrape for novel '%s' from chapter %d up to %d.", novel_detail['title'], start_chapter, self.max_chapters)
+        else:
+            logging.getLogger(__name__).info("Found %d chapters to scrape for novel '%s' in its chapter list (from chapter %d up to %d).", len(plan), novel_detail['title'], start_chapter, self.max_chapters)
+        await self._active_slots.acquire()
+        job = NovelJob(novel_url, entry.page, novel_detail, folder_name, start_chapter, plan)
+        job.entry = entry
+        job.writer = await asyncio.to_thread(self.hooks.open_writer, novel_detail)
+        await self.chapter_q.put(job)
+        return None
+
+    # --- stage 3: chapter fetching --------------------------------------------------
+    async def _chapter_worker(self):
+        # Novels take turns: after one turn of chapters a novel goes to the back of
+        # the rotation, and new novels start as soon as they arrive.
+        stopping = False
+        while True:
+            if not stopping and not self.chapter_q.empty():
+                job = self.chapter_q.get_nowait()
+            elif self._ready:
+                job = self._ready.popleft()
+            elif stopping:
+                # No new novels; stay until no other worker can hand a novel back to the rotation.
+                async with self._rotation:
+                    await self._rotation.wait_for(lambda: self._ready or not self._fetching)
+                if not self._ready:
+                    return
+                continue
+            else:
+                job = await self.chapter_q.get()
+            if job is _STOP:
+                stopping = True
+                continue
+            self._fetching += 1
+            try:
+                done = await self._fetch_turn(job)
+            except Exception:
+                logging.getLogger(__name__).exception("Chapter stage failed for %s", job.url)
+                done = True
+            finally:
+                self._fetching -= 1
+            if done:
+                self._active_slots.release()
+                self.scheduler.finished(job.url)
+                await self.parse_q.put((job, job.fetched, None, None, None))  # end-of-novel marker
+            else:
+                self._ready.append(job)
+            async with self._rotation:
+                self._rotation.notify_all()
+
+    async def _fetch_turn(self, job):
+        """Fetches the novel's next turn of chapters. Returns True once it has nothing left to fetch."""
+        if job.plan is None:
+            return await self._probe_chapters(job)
+        return await self._fetch_planned_chapters(job)
+
+    async def _probe_chapters(self, job):
+        # Without a chapter list, chapters are probed in order and the first missing one ends the novel.
+        for _ in range(self.scheduler.slice_size):
+            number = job.start_chapter + job.fetched
+            if number > self.max_chapters:
+                job.reached_max = True
+                return True
+            if job.truncated:
+                # The persist stage found a repeated chapter (a soft 404); probing further only finds more.
+                return True
+            if not self.scheduler.spend(job.url):
+                job.out_of_budget = True
+                return True
+            chapter_url = urljoin(job.url, f"chuong-{number}/")
+            logging.getLogger(__name__).info("  Attempting to scrape chapter: %s", chapter_url)
+            content = await self.fetcher.fetch_raw(chapter_url, 'chapter')
+            if content is None or CHAPTER_CONTENT_MARKER not in content:
+                logging.getLogger(__name__).info("  Stopping chapter scrape for '%s' at chapter %d (URL: %s) due to error or chapter not found.", job.detail['title'], number, chapter_url)
+                return True
+            await self.parse_q.put((job, job.fetched, number, chapter_url, content))
+            job.fetched += 1
+        return False
+
+    async def _fetch_planned_chapters(self, job):
+        # Known chapter URLs of one turn are fetched concurrently through a sliding
+        # window; the persist stage puts them back in order.
+        window = asyncio.Semaphore(self.chapter_window)
+        turn = []
+        for seq in range(job.fetched, min(len(job.plan), job.fetched + self.scheduler.slice_size)):
+            if not self.scheduler.spend(job.url):
+                job.out_of_budget = True
+                break
+            turn.append((seq, *job.plan[seq]))
+
+        async def fetch_one(seq, number, chapter_url):
+            async with window:
+                logging.getLogger(__name__).info("  Attempting to scrape chapter: %s", chapter_url)
+                content = await self.fetcher.fetch_raw(chapter_url, 'chapter')
+                if content is not None and CHAPTER_CONTENT_MARKER not in content:
+                    content = None
+                if content is None:
+                    logging.getLogger(__name__).warning("  Skipping chapter %d of '%s' (URL: %s) after an error.", number, job.detail['title'], chapter_url)
+                await self.parse_q.put((job, seq, number, chapter_url, content))
+
+        await asyncio.gather(*(fetch_one(seq, number, chapter_url) for seq, number, chapter_url in turn))
+        job.fetched += len(turn)
+        return job.out_of_budget or job.fetched >= len(job.plan)
+
+    # --- stage 4: parsing / extraction ----------------------------------------------
+    async def _parse_worker(self):
+        while True:
+            item = await self.parse_q.get()
+            if item is _STOP:
+                return
+            job, seq, number, chapter_url, content = item
+            if chapter_url is None:
+                chapter = _STOP
+            elif content is None:
+                chapter = None
+            else:
+                try:
+                    chapter = await self.extractor.chapter_async(content, chapter_url, job.detail['novelId'], number)
+                except Exception:
+                    logging.getLogger(__name__).exception("Extraction failed for %s", chapter_url)
+                    chapter = None
+            await self.persist_qs[hash(job.url) % len(self.persist_qs)].put((job, seq, number, chapter))
+
+    # --- stage 5: persistence -------------------------------------------------------
+    async def _persist_worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is _STOP:
+                return
+            job, seq, number, chapter = item
+            try:
+                if chapter is _STOP:
+                    job.end_seq = seq
+                else:
+                    job.pending[seq] = (number, chapter)
+                await self._flush_in_order(job)
+            except Exception:
+                logging.getLogger(__name__).exception("Persist stage failed for %s", job.url)
+
+    async def _flush_in_order(self, job):
+        # Chapters arrive out of order; release them strictly in sequence. A
+        # failed or repeated chapter ends a probed novel but is only skipped in a planned one.
+        while job.next_seq in job.pending:
+            number, chapter = job.pending.pop(job.next_seq)
+            job.next_seq += 1
+            if chapter is None and job.plan is None:
+                job.truncated = True
+            elif chapter is None:
+                job.failed += 1
+                self.hooks.record_chapter(job, number, None)
+            if chapter is None or job.truncated:
+                continue
+            saved = await asyncio.to_thread(self.hooks.save_chapter, job, number, chapter)
+            if not saved and job.plan is None:
+                job.truncated = True
+
+        if job.end_seq is not None and job.next_seq >= job.end_seq:
+            novel_dir = await asyncio.to_thread(self.hooks.finalize_novel, job)
+            # Nothing is left to fetch once every listed chapter is saved, or a probe reached the cap.
+            if job.out_of_budget:
+                complete = False
+            elif job.plan is not None:
+                complete = job.failed == 0
+            else:
+                complete = job.reached_max and not job.truncated
+            self.hooks.finish_novel(job, novel_dir, complete)
+            if job.entry is not None:
+                self.frontier.decided(job.entry)
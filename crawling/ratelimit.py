@@ -0,0 +1,158 @@
+"""Adaptive per-host request rate limiting.
+
+Every host gets a token bucket whose refill rate follows AIMD: each healthy
+response adds a small fixed step to the rate, while a 429/503, a Retry-After
+header, a network error or a latency spike well above the host's baseline
+multiplies it down. Retry-After additionally blocks the host until the given
+time. One limiter instance is shared by the blocking and the async fetcher.
+"""
+import asyncio
+import email.utils
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from .config import (RATE_LIMIT_INITIAL, RATE_LIMIT_MIN, RATE_LIMIT_MAX, RATE_LIMIT_BURST,
+                         RATE_LIMIT_INCREASE, RATE_LIMIT_DECREASE, RATE_LIMIT_LATENCY_FACTOR)
+except Exception:
+    from config import (RATE_LIMIT_INITIAL, RATE_LIMIT_MIN, RATE_LIMIT_MAX, RATE_LIMIT_BURST,
+                        RATE_LIMIT_INCREASE, RATE_LIMIT_DECREASE, RATE_LIMIT_LATENCY_FACTOR)
+
+THROTTLE_STATUSES = (429, 503)
+LATENCY_SLACK = 0.25  # Seconds above baseline that never count as a spike, whatever the ratio
+
+
+def parse_retry_after(value, now=None):
+    """Converts a Retry-After header (delta seconds or HTTP date) to seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+class _HostBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency = None
+        self.baseline_latency = None
+        self.last_decrease = 0.0
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, initial_rate=RATE_LIMIT_INITIAL, min_rate=RATE_LIMIT_MIN, max_rate=RATE_LIMIT_MAX,
+                 burst=RATE_LIMIT_BURST, increase=RATE_LIMIT_INCREASE, decrease=RATE_LIMIT_DECREASE,
+                 latency_factor=RATE_LIMIT_LATENCY_FACTOR):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).netloc or url
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _HostBucket(self.initial_rate, self.burst)
+        return bucket
+
+    def _reserve(self, url):
+        """Takes one token for url's host and returns how long the caller must wait before sending."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(self._host(url))
+            bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            # Tokens may go negative: each caller reserves its own future slot,
+            # so concurrent waiters are spaced out instead of waking together.
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            return max(wait, bucket.blocked_until - now)
+
+    def acquire(self, url):
+        """Blocks until a request to url's host is allowed."""
+        wait = self._reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        """Waits (without blocking the event loop) until a request to url's host is allowed."""
+        wait = self._reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record(self, url, status=None, latency=None, retry_after=None):
+        """Feeds one response outcome back into the host's rate.
+
+        status None means the request failed at the network level.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(self._host(url))
+            if retry_after:
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+                bucket.tokens = min(bucket.tokens, 0)
+
+            congested = status is None or status in THROTTLE_STATUSES or bool(retry_after)
+            if latency is not None and status is not None and status < 500:
+                bucket.latency = latency if bucket.latency is None else 0.8 * bucket.latency + 0.2 * latency
+                if bucket.baseline_latency is None:
+                    bucket.baseline_latency = bucket.latency
+                else:
+                    # Track the fastest recent latency but let it drift up slowly,
+                    # so a permanently slower origin is not treated as congested forever.
+                    bucket.baseline_latency = min(bucket.latency, bucket.baseline_latency * 1.01)
+                threshold = max(bucket.baseline_latency * self.latency_factor, bucket.baseline_latency + LATENCY_SLACK)
+                if bucket.latency > threshold:
+                    congested = True
+
+            if congested:
+                # Decrease at most once per refill interval so one burst of
+                # failures from requests already in flight counts as one signal.
+                if now - bucket.last_decrease >= 1.0 / bucket.rate:
+                    bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+                    bucket.last_decrease = now
+            elif status is not None and status < 400:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def current_rate(self, url_or_host):
+        """Current allowed requests/s for a host (accepts a URL or a bare host)."""
+        with self._lock:
+            bucket = self._buckets.get(self._host(url_or_host))
+            return bucket.rate if bucket else self.initial_rate
+
+    def rates(self):
+        """Snapshot of {host: requests/s} for logging."""
+        with self._lock:
+            return {host: bucket.rate for host, bucket in self._buckets.items()}
+
+    def describe(self):
+        return ", ".join(f"{host}={rate:.2f} req/s" for host, rate in sorted(self.rates().items())) or "no hosts yet"
+
+
+_rate_limiter = AdaptiveRateLimiter()
+
+
+def get_rate_limiter():
+    """The process-wide limiter shared by every fetcher."""
+    return _rate_limiter
@@ -0,0 +1,232 @@
+"""Offline re-extraction of a crawl from its raw response archive (main.py --replay).
+
+A fixed selector in extract_novel_details or extract_chapter_details used to
+need a fresh crawl to reach the pages already saved. replay_archive rebuilds
+every novel folder from the archived pages (warc.py) instead, in a process
+pool and without a single request:
+
+1. a worker re-extracts the novel page and plans its chapters from the
+   archived chapter list pages, or from the run of archived chuong-N/ pages
+   for a novel that was probed;
+2. the parent gives the novel and its chapters their IDs (the ones in the
+   state store when the novel is known, new ones from the ID blocks
+   otherwise) and registers its genres;
+3. a worker re-extracts the chapters and writes the folder with save_novel
+   into a scratch folder, which then replaces data/<novel-slug>/;
+4. the parent records the chapters' new hashes and word counts.
+
+A rebuilt novel keeps its IDs and the synthetic fields of its saved
+metadata.json; only what is extracted from the pages can change.
+
+Chapters the state store marks as duplicates stay out, and with dedup on a
+chapter whose text repeats an earlier one of the novel is dropped as well.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urljoin
+
+try:
+    from .config import MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, REPLAY_WORKERS, WARC_DIR, DATA_DIR, DUPLICATE_DETECTION
+    from .fetcher import configure_parser, get_parser, parse_html, extract_novel_details, extract_chapter_details, discover_chapters
+    from .fingerprint import simhash
+    from .ids import generate_novel_id, generate_chapter_id, use_local_counters
+    from .metrics import get_metrics
+    from .saver import configure_storage, chapter_text, text_hash, novel_folder_name, save_novel
+    from .utils import generate_random_novel_numeric_fields
+    from .warc import WarcArchive
+except Exception:
+    from config import MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, REPLAY_WORKERS, WARC_DIR, DATA_DIR, DUPLICATE_DETECTION
+    from fetcher import configure_parser, get_parser, parse_html, extract_novel_details, extract_chapter_details, discover_chapters
+    from fingerprint import simhash
+    from ids import generate_novel_id, generate_chapter_id, use_local_counters
+    from metrics import get_metrics
+    from saver import configure_storage, chapter_text, text_hash, novel_folder_name, save_novel
+    from utils import generate_random_novel_numeric_fields
+    from warc import WarcArchive
+
+_archive = None  # the worker's own handle on the archive
+
+
+def _init_worker(archive_dir, log_level, parser_name, targeted, storage, own_process=True):
+    global _archive
+    if own_process:
+        logging.basicConfig(level=log_level, format='%(asctime)s %(levelname)s %(name)s[%(process)d]: %(message)s')
+        configure_parser(parser_name, targeted)
+        if storage:
+            configure_storage(storage)
+        use_local_counters()  # IDs are handed out by the parent
+    _archive = WarcArchive(archive_dir)
+
+
+def _archived_soup(url, kind):
+    content = _archive.get(url)
+    return parse_html(content, kind) if content is not None else None
+
+
+def _read_novel(novel_url):
+    """Worker: (novel dict, chapter plan [(number, url)]) from the archived pages, or None when the novel page is unreadable."""
+    soup = _archived_soup(novel_url, 'novel')
+    if soup is None:
+        return None
+    novel = extract_novel_details(soup, novel_url)
+    links = novel.pop('scraped_chapter_links', [])
+    pages = novel.pop('scraped_chapter_list_pages', 1)
+    plan = discover_chapters(novel_url, links, pages, 1, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, fetch=_archived_soup)
+    if plan is None:
+        # A probed novel: its chapters are the run of chuong-N/ pages the crawl got to
+        plan = []
+        for number in range(1, MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL + 1):
+            chapter_url = urljoin(novel_url, f"chuong-{number}/")
+            if chapter_url not in _archive:
+                break
+            plan.append((number, chapter_url))
+    return novel, [(number, url) for number, url in plan if url in _archive]
+
+
+def _keep_synthetic_fields(novel, novel_dir):
+    """Carries the saved novel's synthetic fields (views, ratings, dates) over, so a replay only changes what is extracted."""
+    try:
+        with open(os.path.join(novel_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return
+    for key in generate_random_novel_numeric_fields():
+        if key in saved:
+            novel[key] = saved[key]
+
+
+def _rebuild_novel(novel, folder_name, chapters, base_dir, previous_folder, dedup):
+    """Worker: re-extracts chapters [(number, url, chapter_id)] and swaps in the rebuilt base_dir/folder_name.
+
+    Returns (saved [(number, chapter_id, content hash, simhash, word count)], duplicates [(number, content hash)]).
+    """
+    saved, duplicates, extracted = [], [], []
+    seen = set()
+    for number, url, chapter_id in chapters:
+        soup = _archived_soup(url, 'chapter')
+        chapter = extract_chapter_details(soup, url, novel['novelId'], number) if soup is not None else None
+        if chapter is None:
+            continue
+        text = chapter_text(chapter)
+        digest = text_hash(text)
+        if dedup and (not text or digest in seen):
+            duplicates.append((number, digest))
+            continue
+        seen.add(digest)
+        chapter['chapterId'] = chapter_id
+        extracted.append(chapter)
+        saved.append((number, chapter_id, digest, simhash(text) if dedup else None, chapter.get('wordCount', 0)))
+    novel['chapterList'] = [chapter['chapterId'] for chapter in extracted]
+    novel['chapterCount'] = len(extracted)
+    novel['wordCount'] = sum(chapter.get('wordCount', 0) for chapter in extracted)
+
+    target = os.path.join(base_dir, folder_name)
+    _keep_synthetic_fields(novel, target if os.path.exists(target) or not previous_folder else os.path.join(base_dir, previous_folder))
+
+    scratch = tempfile.mkdtemp(prefix='.replay-', dir=base_dir)
+    try:
+        built = save_novel(novel, extracted, scratch)
+        if os.path.exists(target):
+            os.rename(target, os.path.join(scratch, '.previous'))
+        os.rename(built, target)
+        if previous_folder and previous_folder != folder_name:
+            shutil.rmtree(os.path.join(base_dir, previous_folder), ignore_errors=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return saved, duplicates
+
+
+class _Replay:
+    """Parent-side bookkeeping: IDs, genres and the state store."""
+
+    def __init__(self, store, genres, base_dir, dedup):
+        self.store = store
+        self.genres = genres
+        self.base_dir = base_dir
+        self.dedup = dedup
+        self.counts = {'novels': 0, 'chapters': 0, 'missing': 0, 'failed': 0}
+
+    def prepare(self, novel_url, novel, plan):
+        """Arguments for _rebuild_novel: the novel with its stored (or new) IDs and genres."""
+        progress = self.store.novel(novel_url)
+        novel['novelId'] = progress['novel_id'] if progress and progress['novel_id'] else generate_novel_id()
+        novel['genreList'] = self.genres.register(novel.pop('scraped_genre_names', []))
+        chapter_ids, duplicates = {}, set()
+        if progress is not None:
+            chapter_ids = {number: chapter_id for number, chapter_id, _ in self.store.chapter_summaries(novel_url)}
+            duplicates = self.store.saved_chapters(novel_url, ('duplicate',))
+        chapters = [(number, url, chapter_ids.get(number) or generate_chapter_id()) for number, url in plan if number not in duplicates]
+        return novel, novel_folder_name(novel), chapters, self.base_dir, progress['folder_slug'] if progress else None, self.dedup
+
+    def rebuilt(self, novel_url, novel, folder_name, saved, duplicates):
+        store = self.store
+        known = store.novel(novel_url) is not None
+        store.upsert_novel(novel_url, folder_name, novel.get('title'), novel['novelId'])
+        for number, chapter_id, digest, signature, words in saved:
+            store.record_chapter(novel_url, number, chapter_id, 'saved', content_hash=digest, word_count=words, simhash=signature)
+        for number, digest in duplicates:
+            store.record_chapter(novel_url, number, status='duplicate', content_hash=digest)
+        if not known:
+            store.mark_novel(novel_url, False)  # a later crawl picks up whatever the archive did not have
+        self.counts['novels'] += 1
+        self.counts['chapters'] += len(saved)
+        get_metrics().inc('replay_novels', result='rebuilt')
+        get_metrics().inc('replay_chapters', len(saved))
+        logging.getLogger(__name__).info("Replayed novel '%s': %d chapters into %s", novel.get('title'), len(saved), folder_name)
+
+
+def replay_archive(store, genres, archive_dir=WARC_DIR, base_dir=DATA_DIR, workers=REPLAY_WORKERS, storage=None, dedup=DUPLICATE_DETECTION):
+    """Rebuilds the folder of every novel page in the archive under base_dir. Returns counts of novels, chapters, missing and failed.
+
+    workers > 1 runs extraction and saving in that many processes; otherwise on one thread.
+    """
+    archive = WarcArchive(archive_dir)
+    try:
+        novel_urls = iter(archive.urls('novel'))
+    finally:
+        archive.close()
+    own_process = bool(workers and int(workers) > 1)
+    workers = int(workers) if own_process else 1
+    initargs = (archive_dir, logging.getLogger().getEffectiveLevel(), get_parser().name, get_parser().targeted, storage, own_process)
+    executor_class = ProcessPoolExecutor if own_process else ThreadPoolExecutor
+    replay = _Replay(store, genres, base_dir, dedup)
+    os.makedirs(base_dir, exist_ok=True)
+
+    with executor_class(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        pending = {}  # future -> (novel URL, novel dict once it is being rebuilt)
+
+        def top_up():
+            # A bounded window of novels in flight keeps memory flat on a full catalog
+            while len(pending) < 2 * workers:
+                novel_url = next(novel_urls, None)
+                if novel_url is None:
+                    return
+                pending[executor.submit(_read_novel, novel_url)] = (novel_url, None)
+
+        top_up()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                novel_url, novel = pending.pop(future)
+                try:
+                    result = future.result()
+                    if novel is None:
+                        if result is None:
+                            replay.counts['missing'] += 1
+                            get_metrics().inc('replay_novels', result='missing')
+                            logging.getLogger(__name__).warning("Archived novel page of %s is unreadable; skipping it.", novel_url)
+                            continue
+                        job = replay.prepare(novel_url, *result)
+                        pending[executor.submit(_rebuild_novel, *job)] = (novel_url, job)
+                    else:
+                        replay.rebuilt(novel_url, novel[0], novel[1], *result)
+                except Exception:
+                    replay.counts['failed'] += 1
+                    get_metrics().inc('replay_novels', result='failed')
+                    logging.getLogger(__name__).exception("Replay failed for %s", novel_url)
+            top_up()
+    return replay.counts
@@ -0,0 +1,198 @@
+"""Retry policy and per-host circuit breaker for page fetches.
+
+A failed request is classified first:
+
+- retried: connect/read timeouts, dropped connections, truncated bodies and
+  the statuses in RETRY_STATUSES (429 and the 5xx an overloaded origin
+  sends). The wait before each new attempt grows exponentially with full
+  jitter; a Retry-After header sets its floor.
+- final: 404/410 (the page does not exist, which is how a chapter probe
+  ends) and every other client error.
+
+The circuit breaker counts consecutive failures (network errors and 5xx) per
+host. Once CIRCUIT_FAILURE_THRESHOLD is reached the circuit opens and every
+worker about to fetch from that host waits out the cooldown, instead of
+burning through a chapter list with requests that cannot succeed. When the
+cooldown ends one trial request goes out: success closes the circuit, a
+failure reopens it with the cooldown doubled (up to CIRCUIT_MAX_COOLDOWN).
+A failed trial does not use up the URL's attempts, so a long outage pauses
+the crawl rather than skipping pages.
+
+Retries and failures are counted in metrics (http_retries{reason},
+http_failures{reason}, circuit_opens{host}) and reported to the policy's
+listener, which main.py points at the state store. Like the rate limiter,
+one policy and one breaker are shared by the blocking and the async fetcher.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from .config import (RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_AFTER_MAX,
+                         CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN)
+    from .metrics import get_metrics
+except Exception:
+    from config import (RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_AFTER_MAX,
+                        CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_MAX_COOLDOWN)
+    from metrics import get_metrics
+
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+NOT_FOUND_STATUSES = (404, 410)  # final answers rather than failures: not counted or reported
+TRIAL_POLL = 0.5  # Seconds between checks while a host's trial request is out
+
+
+def failure_reason(status=None, error=None):
+    """Short label for a failed attempt: the HTTP status, or the exception's class name."""
+    return str(status) if status is not None else type(error).__name__
+
+
+def _host(url):
+    return urlsplit(url).netloc or url
+
+
+class RetryPolicy:
+    """Decides whether and when a failed fetch is attempted again."""
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 retry_after_max=RETRY_AFTER_MAX, rng=None):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_after_max = retry_after_max
+        self.rng = rng or random.Random()
+        self.listener = None  # listener(url, retries, error): after a fetch that was retried or failed for good
+
+    def retry_delay(self, failures, status=None, retryable=False, retry_after=None):
+        """Seconds to wait before the next attempt, or None when the failure is final.
+
+        failures is the number of failed attempts charged to the URL so far.
+        status decides for HTTP errors; retryable for errors without a
+        response (timeouts, dropped connections).
+        """
+        if status is not None:
+            retryable = status in RETRY_STATUSES
+        if not retryable or failures >= self.max_attempts:
+            return None
+        delay = self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** max(0, failures - 1)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.retry_after_max))
+        return delay
+
+    def retrying(self, url, failures, reason, delay):
+        get_metrics().inc('http_retries', reason=reason)
+        logging.getLogger(__name__).info("Retrying %s in %.1fs after %s (%d of %d attempts used)", url, delay, reason, failures, self.max_attempts)
+
+    def finished(self, url, retries, reason=None, status=None):
+        """Reports the end of a fetch: reason None for a success, else why it failed for good."""
+        if reason is not None:
+            if status in NOT_FOUND_STATUSES:
+                return
+            get_metrics().inc('http_failures', reason=reason)
+        elif not retries:
+            return
+        if self.listener is not None:
+            try:
+                self.listener(url, retries, reason)
+            except Exception as e:
+                logging.getLogger(__name__).warning("Could not record fetch outcome for %s: %s", url, e)
+
+
+class _Circuit:
+    def __init__(self, cooldown):
+        self.failures = 0  # consecutive
+        self.cooldown = cooldown
+        self.opened_until = 0.0  # 0: closed
+        self.trial = False  # half-open: one request is testing the host
+
+
+class CircuitBreaker:
+    """Pauses every fetch to a host after consecutive failures, then lets one trial request through."""
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN, max_cooldown=CIRCUIT_MAX_COOLDOWN):
+        self.threshold = max(1, int(threshold))
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def admit(self, url):
+        """(seconds to wait before asking again, or 0 to send now; whether the request is the host's trial)."""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits.get(_host(url))
+            if circuit is None or not circuit.opened_until:
+                return 0.0, False
+            if now < circuit.opened_until:
+                remaining = circuit.opened_until - now
+                return (min(remaining, TRIAL_POLL) if circuit.trial else remaining), False
+            # Cooldown over (or the last trial never reported back): this caller is the trial.
+            circuit.trial = True
+            circuit.opened_until = now + circuit.cooldown
+            return 0.0, True
+
+    def wait(self, url):
+        """Blocks while the host's circuit is open. Returns True when the request about to go out is its trial."""
+        while True:
+            wait, trial = self.admit(url)
+            if wait <= 0:
+                return trial
+            time.sleep(wait)
+
+    async def wait_async(self, url):
+        """Waits (without blocking the event loop) while the host's circuit is open; returns like wait()."""
+        while True:
+            wait, trial = self.admit(url)
+            if wait <= 0:
+                return trial
+            await asyncio.sleep(wait)
+
+    def record(self, url, status=None):
+        """Feeds one attempt's outcome back: a status, or None for a network-level failure."""
+        host = _host(url)
+        failed = status is None or status >= 500
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                if not failed:
+                    return
+                circuit = self._circuits[host] = _Circuit(self.cooldown)
+            if not failed:
+                if circuit.opened_until:
+                    logging.getLogger(__name__).info("Host %s is answering again; closing its circuit.", host)
+                circuit.failures = 0
+                circuit.opened_until = 0.0
+                circuit.trial = False
+                circuit.cooldown = self.cooldown
+                return
+            circuit.failures += 1
+            if circuit.trial:
+                circuit.trial = False
+                circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+            elif circuit.opened_until or circuit.failures < self.threshold:
+                return
+            circuit.opened_until = time.monotonic() + circuit.cooldown
+            cooldown, failures = circuit.cooldown, circuit.failures
+        get_metrics().inc('circuit_opens', host=host)
+        logging.getLogger(__name__).warning("Host %s failed %d times in a row; pausing requests to it for %.0fs.", host, failures, cooldown)
+
+    def is_open(self, url_or_host):
+        with self._lock:
+            circuit = self._circuits.get(_host(url_or_host))
+            return bool(circuit and circuit.opened_until)
+
+
+_retry_policy = RetryPolicy()
+_circuit_breaker = CircuitBreaker()
+
+
+def get_retry_policy():
+    """The process-wide retry policy shared by every fetcher."""
+    return _retry_policy
+
+
+def get_circuit_breaker():
+    """The process-wide circuit breaker shared by every fetcher."""
+    return _circuit_breaker
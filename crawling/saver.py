@@ -1,26 +1,124 @@
+import hashlib
 import os
 import json
+import logging
+import queue
 import re
+import tempfile
+import threading
+import time
 
 try:
-    from .utils import create_slug_from_text
+    from .textnorm import slugify, safe_filename, html_to_text
+    from .metrics import get_metrics
+    from .config import WRITER_METADATA_EVERY, WRITER_METADATA_INTERVAL, WRITER_FSYNC_BATCH, WRITER_BACKGROUND, CHAPTER_STORAGE, ARCHIVE_CODEC, DATA_DIR
 except Exception:
-    from utils import create_slug_from_text
+    from textnorm import slugify, safe_filename, html_to_text
+    from metrics import get_metrics
+    from config import WRITER_METADATA_EVERY, WRITER_METADATA_INTERVAL, WRITER_FSYNC_BATCH, WRITER_BACKGROUND, CHAPTER_STORAGE, ARCHIVE_CODEC, DATA_DIR
 
-def _safe_filename(text: str) -> str:
-    # Simple sanitizer for filenames
-    text = text.strip()
-    text = re.sub(r'[\\/:*?"<>|]+', '-', text)
-    return text
+_CHAPTER_FILE_RE = re.compile(r'^(\d+)')
+# `NNN - CHAxxxxxxx - title.txt`; the chapter ID segment is optional, as in chapter_filename.
+_CHAPTER_NAME_RE = re.compile(r'^(\d+)(?: - (CHA\d+))? - (.*)\.txt$')
+
+STORAGES = ('txt', 'archive')
+_storage = CHAPTER_STORAGE
+_archive_codec = ARCHIVE_CODEC
+_search_index = None
+
+
+def configure_storage(storage=CHAPTER_STORAGE, codec=ARCHIVE_CODEC):
+    """Selects how new chapters are stored: one .txt file each, or the packed archive (archive.py)."""
+    global _storage, _archive_codec
+    if storage not in STORAGES:
+        raise ValueError(f"Unknown chapter storage {storage!r}; expected one of {', '.join(STORAGES)}")
+    _storage, _archive_codec = storage, codec
+
+
+def configure_search_index(path=None):
+    """Indexes every chapter written from now on in the full-text index at path (see search.py); None flushes and closes it."""
+    global _search_index
+    if _search_index is not None:
+        _search_index.close()
+    _search_index = _search_module().SearchIndex(path) if path else None
+    return _search_index
+
+
+def get_search_index():
+    return _search_index
+
+
+def _archive_module():
+    # Imported lazily: archive.py builds on the helpers in this module.
+    try:
+        from . import archive
+    except Exception:
+        import archive
+    return archive
+
+
+def _search_module():
+    # Imported lazily, like archive.py
+    try:
+        from . import search
+    except Exception:
+        import search
+    return search
+
+def chapter_filename(ch: dict) -> str:
+    """File name of a chapter inside its novel folder: `NNN - CHAxxxxxxx - title.txt`."""
+    ch_number = ch.get('chapterNumber', 0)
+    ch_id = ch.get('chapterId') or ''
+    ch_title = ch.get('title') or f'chapter-{ch_number}'
+    safe_title = safe_filename(ch_title)
+    # Include chapter id in filename if available
+    id_segment = f" - {ch_id}" if ch_id else ""
+    return f"{ch_number:03d}{id_segment} - {safe_title}.txt"
+
+
+def parse_chapter_filename(name: str):
+    """(chapterNumber, chapterId, title) from a name built by chapter_filename, or None."""
+    m = _CHAPTER_NAME_RE.match(name)
+    if not m:
+        return None
+    return int(m.group(1)), m.group(2) or '', m.group(3)
+
+
+def content_hash(ch: dict) -> str:
+    """Digest of the text written for a chapter; equal digests mean the saved file would not change."""
+    return text_hash(chapter_text(ch))
+
+
+def text_hash(text: str) -> str:
+    """content_hash of already saved chapter text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def chapter_summary(ch: dict) -> dict:
+    """The chapter fields a novel keeps once the chapter is saved (see main.summarize_novel)."""
+    return {'chapterId': ch.get('chapterId'), 'chapterNumber': ch.get('chapterNumber'), 'wordCount': ch.get('wordCount', 0)}
+
+
+def chapter_text(ch: dict) -> str:
+    """Plain text written for a chapter."""
+    content_text = ch.get('plainTextContent') or ch.get('content') or ''
+    if not ch.get('plainTextContent') and ch.get('content'):
+        content_text = html_to_text(content_text)
+    return content_text
+
+
+def novel_folder_name(novel: dict) -> str:
+    return slugify(novel.get('title') or novel.get('slug') or novel.get('novelId'))
 
 
 def get_existing_chapter_max(novel_dir: str) -> int:
     """Return the max chapterNumber already saved in novel_dir (based on leading numeric filename), 0 if none."""
     if not os.path.isdir(novel_dir):
         return 0
-    max_num = 0
+    archive = _archive_module()
+    max_num = max(archive.read_index(novel_dir), default=0) if archive.has_archive(novel_dir) else 0
     for name in os.listdir(novel_dir):
-        m = re.match(r'^(\d+)', name)
+        m = _CHAPTER_FILE_RE.match(name)
         if m:
             try:
                 num = int(m.group(1))
@@ -30,43 +128,289 @@ def get_existing_chapter_max(novel_dir: str) -> int:
                 continue
     return max_num
 
-def save_novel(novel: dict, chapters: list, base_dir: str = 'data') -> str:
+
+def iter_saved_chapters(novel_dir: str):
+    """Yields {chapterNumber, chapterId, title, text} for every chapter saved in novel_dir, in chapter order.
+
+    Reads both layouts; a chapter in the archive wins over a .txt file with the same number.
+    """
+    archive = _archive_module()
+    files = {}
+    for name in os.listdir(novel_dir):
+        parsed = parse_chapter_filename(name)
+        if parsed:
+            files.setdefault(parsed[0], (parsed, name))
+    with archive.ChapterArchive(novel_dir) as packed:
+        for number in sorted(set(files) | set(packed.index)):
+            if number in packed:
+                yield packed.read(number)
+                continue
+            (_, chapter_id, title), name = files[number]
+            with open(os.path.join(novel_dir, name), 'r', encoding='utf-8') as f:
+                yield {'chapterNumber': number, 'chapterId': chapter_id, 'title': title, 'text': f.read()}
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class NovelWriter:
+    """Incremental writer for one novel folder.
+
+    The folder is listed once when the writer opens; after that the writer
+    remembers which chapter numbers are on disk, so adding a chapter costs one
+    file write no matter how many came before it. metadata.json is rewritten
+    (atomically) only every `metadata_every` chapters or `metadata_interval`
+    seconds, and once more on close. Chapter files are fsynced in batches of
+    `fsync_batch` together with the folder (0 leaves durability to the OS);
+    `on_durable` callbacks passed to add() run once their chapter's batch is
+    synced, so crawl state never gets ahead of the disk. A chapter skipped
+    because its number is already on disk takes that copy's chapterId before
+    its callback runs, so the state store records the ID the file carries.
+
+    With `storage='archive'` chapters are appended to the novel's packed
+    archive instead of separate files; chapters already in either form count
+    as on disk.
+
+    With `background=True` the disk work runs on a writer thread and add()
+    only queues; close() (or flush()) waits for it to drain.
+
+    With a search index configured (configure_search_index), every chapter
+    written is queued for it as well.
+    """
+
+    def __init__(self, novel: dict, base_dir: str = DATA_DIR, metadata_every=WRITER_METADATA_EVERY,
+                 metadata_interval=WRITER_METADATA_INTERVAL, fsync_batch=WRITER_FSYNC_BATCH, background=WRITER_BACKGROUND,
+                 storage=None):
+        self.novel = novel
+        self.novel_dir = os.path.join(base_dir, novel_folder_name(novel))
+        self.metadata_every = max(1, int(metadata_every))
+        self.metadata_interval = metadata_interval
+        self.fsync_batch = max(0, int(fsync_batch))
+        os.makedirs(self.novel_dir, exist_ok=True)
+
+        self.on_disk = {}  # chapter number -> file name
+        for name in os.listdir(self.novel_dir):
+            m = _CHAPTER_FILE_RE.match(name)
+            if m:
+                self.on_disk.setdefault(int(m.group(1)), name)
+        archive = _archive_module()
+        self._archive = None
+        if (storage or _storage) == 'archive':
+            self._archive = archive.ArchiveWriter(self.novel_dir, _archive_codec)
+        for number in (self._archive.index if self._archive else archive.read_index(self.novel_dir)):
+            self.on_disk.setdefault(number, archive.PACK_NAME)
+
+        self._metadata_dirty = True
+        self._since_metadata = 0
+        self._metadata_written_at = 0.0
+        self._unsynced = []  # paths written since the last fsync batch
+        self._callbacks = []  # on_durable callbacks waiting for that batch
+        self._closed = False
+        self.error = None
+
+        self.background = bool(background)
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=f"writer-{os.path.basename(self.novel_dir)}", daemon=True)
+            self._thread.start()
+
+    # --- public API --------------------------------------------------------------------
+    def add(self, chapter: dict, on_durable=None, replace=False):
+        """Writes one chapter unless its number is already on disk (or replaces it with replace=True)."""
+        self._submit(self._add, chapter, on_durable, replace)
+
+    def saved_text(self, number):
+        """Text of a chapter already on disk, or None. Reads the disk directly; call flush() first if needed."""
+        name = self.on_disk.get(number)
+        if name is None:
+            return None
+        archive = _archive_module()
+        if name == archive.PACK_NAME:
+            with archive.ChapterArchive(self.novel_dir) as packed:
+                return packed.read(number)['text'] if number in packed else None
+        try:
+            with open(os.path.join(self.novel_dir, name), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def add_many(self, chapters):
+        for ch in chapters:
+            self.add(ch)
+
+    def update_metadata(self, novel: dict = None):
+        """Marks metadata.json for rewrite (with a new novel dict if given) at the next flush."""
+        self._submit(self._update_metadata, novel)
+
+    def flush(self):
+        """Writes pending metadata, syncs pending chapters and waits for the writer thread to catch up."""
+        self._submit(self._flush)
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self) -> str:
+        """Flushes everything and stops the writer thread. Returns the novel folder."""
+        if self._closed:
+            return self.novel_dir
+        self._closed = True
+        try:
+            if self._queue is not None:
+                self._queue.put((self._flush, (), True))
+                self._thread.join()
+            else:
+                self._flush()
+        finally:
+            if self._archive is not None:
+                self._archive.close()
+        return self.novel_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- queueing ----------------------------------------------------------------------
+    def _submit(self, func, *args):
+        if self._closed:
+            raise RuntimeError(f"NovelWriter for {self.novel_dir} is closed")
+        if self._queue is None:
+            func(*args)
+        else:
+            self._queue.put((func, args, False))
+
+    def _run(self):
+        while True:
+            func, args, last = self._queue.get()
+            try:
+                func(*args)
+            except Exception as e:
+                # Keep draining so close() never hangs; the caller sees the error on the writer.
+                self.error = e
+                logging.getLogger(__name__).warning("Writing to %s failed: %s", self.novel_dir, e)
+            finally:
+                self._queue.task_done()
+            if last:
+                return
+
+    # --- disk work (writer thread, or the caller's thread without one) -----------------
+    def _add(self, chapter, on_durable, replace=False):
+        number = chapter.get('chapterNumber', 0)
+        previous = self.on_disk.get(number)
+        archive = _archive_module()
+        if previous is not None and not replace:
+            chapter['chapterId'] = self._saved_chapter_id(number) or chapter.get('chapterId')
+        elif self._archive is not None or previous == archive.PACK_NAME:
+            # A replaced chapter stays in the layout it was saved in; the later archive frame wins.
+            with get_metrics().timer('save'):
+                if self._archive is None:
+                    self._archive = archive.ArchiveWriter(self.novel_dir, _archive_codec)
+                self._archive.append(chapter)
+                self.on_disk[number] = archive.PACK_NAME
+                self._unsynced.append(self._archive.pack_path)
+                if previous is not None and previous != archive.PACK_NAME:
+                    os.remove(os.path.join(self.novel_dir, previous))
+        else:
+            with get_metrics().timer('save'):
+                filename = chapter_filename(chapter)
+                path = os.path.join(self.novel_dir, filename)
+                with open(path, 'w', encoding='utf-8') as cf:
+                    cf.write(chapter_text(chapter))
+                self.on_disk[number] = filename
+                self._unsynced.append(path)
+                if previous is not None and previous != filename:
+                    os.remove(os.path.join(self.novel_dir, previous))
+        if _search_index is not None and (previous is None or replace):
+            try:
+                _search_index.add(os.path.basename(self.novel_dir), number, chapter_text(chapter))
+            except Exception as e:
+                # The chapter is on disk; `search.py update` indexes whatever a failing index missed
+                logging.getLogger(__name__).warning("Indexing chapter %d of %s failed: %s", number, self.novel_dir, e)
+        if on_durable is not None:
+            self._callbacks.append(on_durable)
+
+        self._since_metadata += 1
+        if self._since_metadata >= self.metadata_every or time.monotonic() - self._metadata_written_at >= self.metadata_interval:
+            self._write_metadata()
+        if not self.fsync_batch or len(self._unsynced) >= self.fsync_batch:
+            self._sync()
+
+    def _saved_chapter_id(self, number):
+        """chapterId of the copy of a chapter on disk, or None when its file name carries none."""
+        name = self.on_disk.get(number)
+        archive = _archive_module()
+        if name == archive.PACK_NAME:
+            with archive.ChapterArchive(self.novel_dir) as packed:
+                return packed.read(number)['chapterId'] if number in packed else None
+        m = _CHAPTER_NAME_RE.match(name or '')
+        return m.group(2) if m else None
+
+    def _update_metadata(self, novel):
+        if novel is not None:
+            self.novel = novel
+        self._metadata_dirty = True
+
+    def _flush(self):
+        if self._metadata_dirty or self._since_metadata:
+            self._write_metadata()
+        self._sync()
+
+    def _write_metadata(self):
+        with get_metrics().timer('metadata'):
+            self._write_metadata_file()
+
+    def _write_metadata_file(self):
+        metadata_path = os.path.join(self.novel_dir, 'metadata.json')
+        fd, tmp = tempfile.mkstemp(dir=self.novel_dir, prefix='.metadata.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as mf:
+                json.dump(self.novel, mf, ensure_ascii=False, indent=2)
+            os.replace(tmp, metadata_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if self.fsync_batch:
+            self._unsynced.append(metadata_path)
+        self._metadata_dirty = False
+        self._since_metadata = 0
+        self._metadata_written_at = time.monotonic()
+
+    def _sync(self):
+        if self.fsync_batch and self._unsynced:
+            with get_metrics().timer('fsync'):
+                for path in dict.fromkeys(self._unsynced):
+                    if self._archive is not None and path == self._archive.pack_path:
+                        self._archive.sync()  # pack and index together
+                    else:
+                        _fsync_path(path)
+                # New directory entries are only durable once the folder itself is synced.
+                _fsync_path(self.novel_dir)
+        self._unsynced = []
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def save_novel(novel: dict, chapters: list, base_dir: str = DATA_DIR) -> str:
     """Save a single novel's metadata and chapters to disk.
 
     - novel: dict with novel metadata
     - chapters: list of chapter dicts (should include 'chapterNumber' and 'plainTextContent' or 'content')
-    - base_dir: where to create the novel folder (default 'data')
+    - base_dir: where to create the novel folder (default DATA_DIR)
+
+    Chapters whose number is already on disk are not rewritten. For a novel
+    that grows chapter by chapter, keep a NovelWriter open instead.
 
     Returns the path to the novel folder.
     """
-    title = novel.get('title') or novel.get('slug') or novel.get('novelId')
-    folder_name = create_slug_from_text(title)
-    novel_dir = os.path.join(base_dir, folder_name)
-    os.makedirs(novel_dir, exist_ok=True)
-
-    # Write metadata.json
-    metadata_path = os.path.join(novel_dir, 'metadata.json')
-    with open(metadata_path, 'w', encoding='utf-8') as mf:
-        json.dump(novel, mf, ensure_ascii=False, indent=2)
-
-    # Write chapters. Do not overwrite existing chapter files (append behavior):
-    for ch in chapters:
-        ch_number = ch.get('chapterNumber', 0)
-        ch_id = ch.get('chapterId') or ''
-        ch_title = ch.get('title') or f'chapter-{ch_number}'
-        safe_title = _safe_filename(ch_title)
-        # Include chapter id in filename if available
-        id_segment = f" - {ch_id}" if ch_id else ""
-        filename = f"{ch_number:03d}{id_segment} - {safe_title}.txt"
-        path = os.path.join(novel_dir, filename)
-        # If file already exists, skip writing to preserve previous content (append behavior)
-        if os.path.exists(path):
-            continue
-        content_text = ch.get('plainTextContent') or ch.get('content') or ''
-        if not ch.get('plainTextContent') and ch.get('content'):
-            # naive strip HTML tags
-            content_text = re.sub(r'<[^>]+>', '', content_text)
-        with open(path, 'w', encoding='utf-8') as cf:
-            cf.write(content_text)
-
-    return novel_dir
+    writer = NovelWriter(novel, base_dir, background=False)
+    writer.add_many(chapters)
+    return writer.close()
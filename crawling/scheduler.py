@@ -0,0 +1,183 @@
+"""Priority crawl scheduler with per-run request budgets.
+
+The crawl used to take novels in listing order and each novel's chapters
+depth-first, so one long novel could use up a whole crawl window while new
+novels waited. The CrawlScheduler sits between the frontier and the crawl:
+
+- order: entries are drawn from the frontier into a window of `window`
+  novels and handed out best first: novels resumed from an earlier run
+  before any new listing entry, and within each group by priority. Over a
+  coordinator the window is 1 and each leased batch is ranked with rank()
+  instead, so a worker never leases more novels than it is about to start.
+  A novel's priority is a weighted sum
+  (SCHEDULER_WEIGHTS) of four scores in [0, 1]:
+    rank       how early the frontier listed it (1 for the first entry)
+    staleness  time since the state store last touched it (1 when unknown
+               or older than SCHEDULER_STALE_DAYS)
+    missing    chapters the listing (or the chapter cap) says are not saved yet
+    failures   failed chapters and failed fetches under its URL, subtracted
+- budgets: every page fetch is charged to the run (request_budget) and to
+  its novel (novel_request_budget); 0 means unlimited. A novel whose budget
+  is spent stops fetching and stays incomplete, so the next run resumes it
+  (without counting it toward MAX_STORIES_TO_CRAWL a second time);
+  once the run's budget is spent no new novel is started and the ones in
+  progress stop at their next chapter.
+- interleaving: up to `active` novels are crawled at once and take turns of
+  `slice_size` chapters each, breadth first, in the blocking crawl and in
+  the pipeline alike.
+
+Page fetches are counted whether or not the HTTP cache answers them, so a
+budget buys the same pages on every run.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+try:
+    from .config import (MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, SCHEDULER_WEIGHTS, SCHEDULER_WINDOW, SCHEDULER_RANK_SCALE, SCHEDULER_STALE_DAYS,
+                         SCHEDULER_FAILURE_SCALE, SCHEDULER_REQUEST_BUDGET, SCHEDULER_NOVEL_REQUEST_BUDGET, SCHEDULER_ACTIVE_NOVELS,
+                         SCHEDULER_CHAPTER_SLICE)
+    from .frontier import WAITING
+    from .metrics import get_metrics
+except Exception:
+    from config import (MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL, SCHEDULER_WEIGHTS, SCHEDULER_WINDOW, SCHEDULER_RANK_SCALE, SCHEDULER_STALE_DAYS,
+                        SCHEDULER_FAILURE_SCALE, SCHEDULER_REQUEST_BUDGET, SCHEDULER_NOVEL_REQUEST_BUDGET, SCHEDULER_ACTIVE_NOVELS,
+                        SCHEDULER_CHAPTER_SLICE)
+    from frontier import WAITING
+    from metrics import get_metrics
+
+
+class CrawlScheduler:
+    """Orders frontier entries by priority and meters page fetches against the run's budgets. Thread-safe."""
+
+    def __init__(self, store, weights=None, window=SCHEDULER_WINDOW, request_budget=SCHEDULER_REQUEST_BUDGET,
+                 novel_request_budget=SCHEDULER_NOVEL_REQUEST_BUDGET, active=SCHEDULER_ACTIVE_NOVELS, slice_size=SCHEDULER_CHAPTER_SLICE,
+                 max_chapters=MAX_CHAPTERS_TO_SCRAPE_PER_NOVEL):
+        self.store = store
+        self.weights = dict(SCHEDULER_WEIGHTS)
+        self.weights.update(weights or {})
+        self.window = max(1, int(window))
+        self.request_budget = max(0, int(request_budget))
+        self.novel_request_budget = max(0, int(novel_request_budget))
+        self.active = max(1, int(active))
+        self.slice_size = max(1, int(slice_size))
+        self.max_chapters = max_chapters
+        self.requests = 0  # page fetches charged this run
+        self._by_novel = {}  # novel URL -> page fetches charged this run
+        self._lock = threading.Lock()
+        self._listed = itertools.count()
+
+    # --- priority --------------------------------------------------------------------
+    def scores(self, entry, rank):
+        """The four priority scores of a frontier entry (see the module docstring)."""
+        progress = self.store.novel(entry.url)
+        latest = min(entry.latest, self.max_chapters) if entry.latest is not None else None
+        if progress is None:
+            staleness = 1.0
+            missing = (latest if latest is not None else self.max_chapters) / self.max_chapters
+            failures = 0.0
+        else:
+            age_days = (time.time() - (progress['updated_at'] or 0)) / 86400
+            staleness = min(1.0, max(0.0, age_days / SCHEDULER_STALE_DAYS))
+            target = latest if latest is not None else (progress['last_chapter'] if progress['completed'] else self.max_chapters)
+            missing = max(0, target - progress['last_chapter']) / self.max_chapters
+            failures = min(1.0, self.store.failure_count(entry.url) / SCHEDULER_FAILURE_SCALE)
+        return {
+            'rank': 1.0 / (1.0 + rank / SCHEDULER_RANK_SCALE),
+            'staleness': staleness,
+            'missing': min(1.0, missing),
+            'failures': failures,
+        }
+
+    def priority(self, entry, rank=0):
+        weights = self.weights
+        scores = self.scores(entry, rank)
+        return (weights['rank'] * scores['rank'] + weights['staleness'] * scores['staleness']
+                + weights['missing'] * scores['missing'] - weights['failures'] * scores['failures'])
+
+    def _push(self, heap, entry):
+        heapq.heappush(heap, self._key(entry))
+
+    def _key(self, entry):
+        rank = next(self._listed)
+        # heapq is a min-heap; resumed novels (no seed list) go first and the rank breaks ties in listing order
+        return (entry.seed is not None, -self.priority(entry, rank), rank, entry)
+
+    def rank(self, entries):
+        """A batch of entries (e.g. one coordinator lease), best first."""
+        return [key[3] for key in sorted(self._key(entry) for entry in entries)]
+
+    def ordered(self, entries):
+        """Frontier entries, best first within a window of `window` entries."""
+        heap = []
+        try:
+            for entry in entries:
+                if entry is WAITING:
+                    # Nothing new for now: hand out what the window holds first
+                    yield heapq.heappop(heap)[3] if heap else WAITING
+                    continue
+                self._push(heap, entry)
+                if len(heap) >= self.window:
+                    yield heapq.heappop(heap)[3]
+                if self.exhausted:
+                    return
+            while heap and not self.exhausted:
+                yield heapq.heappop(heap)[3]
+        finally:
+            close = getattr(entries, 'close', None)
+            if close is not None:
+                close()
+
+    async def ordered_async(self, entries):
+        """ordered() for an async iterator of entries (Frontier.entries_async)."""
+        heap = []
+        try:
+            async for entry in entries:
+                self._push(heap, entry)
+                if len(heap) >= self.window:
+                    yield heapq.heappop(heap)[3]
+                if self.exhausted:
+                    return
+            while heap and not self.exhausted:
+                yield heapq.heappop(heap)[3]
+        finally:
+            await entries.aclose()
+
+    # --- budgets ---------------------------------------------------------------------
+    @property
+    def exhausted(self):
+        """Whether the run's request budget is spent."""
+        return bool(self.request_budget) and self.requests >= self.request_budget
+
+    def spend(self, novel_url, requests=1, force=False):
+        """Charges page fetches to the run and to the novel.
+
+        Returns False, charging nothing, when either budget cannot cover them;
+        force charges fetches that were already made (e.g. chapter list pages).
+        """
+        with self._lock:
+            used = self._by_novel.get(novel_url, 0)
+            if not force:
+                if self.request_budget and self.requests + requests > self.request_budget:
+                    get_metrics().inc('scheduler_budget_stops', budget='run')
+                    return False
+                if self.novel_request_budget and used + requests > self.novel_request_budget:
+                    get_metrics().inc('scheduler_budget_stops', budget='novel')
+                    return False
+            self.requests += requests
+            self._by_novel[novel_url] = used + requests
+        get_metrics().inc('scheduler_requests', requests)
+        return True
+
+    def finished(self, novel_url):
+        """Forgets a novel's count once it is done (a later entry for it starts afresh)."""
+        with self._lock:
+            spent = self._by_novel.pop(novel_url, 0)
+        if self.novel_request_budget and spent >= self.novel_request_budget:
+            logging.getLogger(__name__).info("  Request budget of %d spent on %s; the rest waits for the next run.", self.novel_request_budget, novel_url)
+
+    def describe(self):
+        budget = self.request_budget or 'unlimited'
+        return f"{self.requests} page fetches charged (run budget: {budget})"
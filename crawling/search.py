@@ -0,0 +1,449 @@
+"""Incremental full-text index over saved chapters (main.py --search-index).
+
+Finding a phrase in a crawl used to mean grepping every data/<slug>/*.txt
+file. SearchIndex keeps an inverted index in one SQLite file
+(data/search.db) instead, updated as NovelWriter saves chapters:
+
+- text is tokenized on word characters after fold_text(), the folding
+  slugify() uses, so `Tiên Hiệp`, `tien hiep` and `TIÊN HIỆP` all match;
+- every term has posting blocks of (chapter, positions) entries. A block
+  holds varint deltas: the chapter's doc ID minus the previous one, the
+  byte length of its positions, then the positions as deltas. So a common
+  term costs a byte or two per chapter, and a query can skip the
+  positions of chapters it does not need;
+- chapters are buffered and written SEARCH_FLUSH_DOCS at a time, one
+  transaction and one new block per term. Once a term has more than
+  SEARCH_MAX_BLOCKS blocks, its newest ones are merged, size-tiered, so
+  each entry is rewritten a logarithmic number of times;
+- a re-saved chapter with new text gets a new doc ID, and its old entries
+  are skipped until a merge or compact() drops them. Unchanged text, by
+  content hash, is not indexed again.
+
+Queries AND together bare words and "quoted phrases". Terms are read
+rarest first, and later blocks outside the candidates' doc ID range are
+skipped. Phrases are checked on the positions of the chapters left. A hit
+is (novel folder slug, chapter number).
+
+Chapters buffered when a crawl dies, or saved without the index, are
+picked up by `update`, which also drops chapters that left the disk:
+
+    python crawling/search.py update [--data-dir data]   # index new and changed chapters
+    python crawling/search.py query 'kiếm "tiên hiệp"'  # novel slug and chapter number per hit
+    python crawling/search.py compact                    # one block per term, removed chapters dropped
+"""
+import argparse
+import collections
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    from .config import SEARCH_INDEX_PATH, SEARCH_FLUSH_DOCS, SEARCH_MAX_BLOCKS, DATA_DIR
+    from .export import novel_dirs
+    from .metrics import get_metrics
+    from .saver import iter_saved_chapters, text_hash
+    from .textnorm import fold_text
+except Exception:
+    from config import SEARCH_INDEX_PATH, SEARCH_FLUSH_DOCS, SEARCH_MAX_BLOCKS, DATA_DIR
+    from export import novel_dirs
+    from metrics import get_metrics
+    from saver import iter_saved_chapters, text_hash
+    from textnorm import fold_text
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc INTEGER PRIMARY KEY AUTOINCREMENT,
+    novel TEXT NOT NULL,
+    chapter INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    UNIQUE (novel, chapter)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    first_doc INTEGER NOT NULL,
+    last_doc INTEGER NOT NULL,
+    docs INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS postings_term ON postings (term, first_doc);
+CREATE TABLE IF NOT EXISTS removed (doc INTEGER PRIMARY KEY);
+"""
+MAX_TERM_LENGTH = 64  # longer runs of word characters are not words; they still take a position
+_WORD_RE = re.compile(r'\w+')
+_QUERY_RE = re.compile(r'"([^"]*)"?|(\S+)')
+_SQL_CHUNK = 500
+
+Hit = collections.namedtuple('Hit', 'novel chapter')
+
+
+def tokenize(text):
+    """Folded words of text in order: `Tiên Hiệp Kỳ Duyên!` -> ['tien', 'hiep', 'ky', 'duyen']."""
+    return _WORD_RE.findall(fold_text(text))
+
+
+def parse_query(query):
+    """Word groups of a query: one per bare word and per quoted phrase; a group of several words is a phrase.
+
+    A bare word that folds to several (`kiếm-hiệp`) is a phrase too.
+    """
+    groups = []
+    for phrase, word in _QUERY_RE.findall(query):
+        words = tokenize(phrase or word)
+        if words:
+            groups.append(words)
+    return groups
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos):
+    byte = data[pos]
+    pos += 1
+    if byte < 0x80:
+        return byte, pos
+    n, shift = byte & 0x7f, 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _encode_positions(positions):
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        _put_varint(out, position - previous)
+        previous = position
+    return bytes(out)
+
+
+def _decode_positions(data, start, end):
+    positions = []
+    position = 0
+    while start < end:
+        delta, start = _get_varint(data, start)
+        position += delta
+        positions.append(position)
+    return positions
+
+
+def _iter_block(data):
+    """(doc, start, end) of every entry of a posting block; data[start:end] holds its encoded positions."""
+    doc = 0
+    pos = 0
+    size = len(data)
+    while pos < size:
+        delta, pos = _get_varint(data, pos)
+        length, pos = _get_varint(data, pos)
+        doc += delta
+        yield doc, pos, pos + length
+        pos += length
+
+
+class _Block:
+    """A posting block being built, entries in increasing doc order."""
+    __slots__ = ('first', 'last', 'docs', 'data')
+
+    def __init__(self):
+        self.first = None
+        self.last = 0
+        self.docs = 0
+        self.data = bytearray()
+
+    def add(self, doc, positions):
+        if self.first is None:
+            self.first = doc
+        _put_varint(self.data, doc - self.last)
+        _put_varint(self.data, len(positions))
+        self.data += positions
+        self.last = doc
+        self.docs += 1
+
+
+def _tiered_suffix(sizes):
+    """How many of the newest blocks (sizes oldest first) to merge: at least two, plus every older block no larger than them."""
+    count, total = 0, 0
+    while count < len(sizes) and (count < 2 or sizes[-count - 1] <= total):
+        count += 1
+        total += sizes[-count]
+    return count
+
+
+class SearchIndex:
+    """Inverted index of chapter text in a SQLite file. Thread-safe; several processes can share the file."""
+
+    def __init__(self, path=SEARCH_INDEX_PATH, flush_docs=SEARCH_FLUSH_DOCS, max_blocks=SEARCH_MAX_BLOCKS):
+        self.path = path
+        self.flush_docs = max(1, int(flush_docs))
+        self.max_blocks = max(2, int(max_blocks))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._pending = {}  # (novel, chapter) -> (content hash, {term: [positions]})
+
+    def close(self):
+        with self._lock:
+            try:
+                self.flush()
+            finally:
+                self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- writing ---------------------------------------------------------------------
+    def add(self, novel, chapter, text):
+        """Queues a chapter's text under (novel folder slug, chapter number). Returns False when that text is indexed already."""
+        digest = text_hash(text)
+        key = (novel, chapter)
+        with self._lock:
+            queued = self._pending.get(key)
+            if queued is not None and queued[0] == digest:
+                return False
+            if queued is None:
+                row = self._conn.execute("SELECT hash FROM docs WHERE novel = ? AND chapter = ?", key).fetchone()
+                if row is not None and row[0] == digest:
+                    get_metrics().inc('search_chapters', result='unchanged')
+                    return False
+        terms = {}
+        for position, term in enumerate(tokenize(text)):
+            if len(term) <= MAX_TERM_LENGTH:
+                terms.setdefault(term, []).append(position)
+        with self._lock:
+            self._pending[key] = (digest, terms)
+            if len(self._pending) >= self.flush_docs:
+                self.flush()
+        return True
+
+    def remove(self, novel, chapters=None):
+        """Drops the given chapter numbers of a novel (all of them by default). Returns how many were indexed."""
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == novel and (chapters is None or key[1] in chapters)]:
+                del self._pending[key]
+            rows = self._conn.execute("SELECT doc, chapter FROM docs WHERE novel = ?", (novel,)).fetchall()
+            docs = [(doc,) for doc, chapter in rows if chapters is None or chapter in chapters]
+            if not docs:
+                return 0
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM docs WHERE doc = ?", docs)
+                self._conn.executemany("INSERT OR IGNORE INTO removed (doc) VALUES (?)", docs)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        get_metrics().inc('search_chapters', len(docs), result='removed')
+        return len(docs)
+
+    def flush(self):
+        """Writes the queued chapters: new doc IDs, one new block per term, then merges of terms with too many blocks."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            conn = self._conn
+            with get_metrics().timer('index'):
+                # IMMEDIATE: doc IDs and blocks of concurrent writers must not interleave
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    blocks = {}
+                    indexed = 0
+                    for key, (digest, terms) in pending.items():
+                        row = conn.execute("SELECT doc, hash FROM docs WHERE novel = ? AND chapter = ?", key).fetchone()
+                        if row is not None:
+                            if row[1] == digest:
+                                continue
+                            conn.execute("DELETE FROM docs WHERE doc = ?", (row[0],))
+                            conn.execute("INSERT OR IGNORE INTO removed (doc) VALUES (?)", (row[0],))
+                        doc = conn.execute("INSERT INTO docs (novel, chapter, hash) VALUES (?, ?, ?)", (*key, digest)).lastrowid
+                        indexed += 1
+                        for term, positions in terms.items():
+                            block = blocks.get(term)
+                            if block is None:
+                                block = blocks[term] = _Block()
+                            block.add(doc, _encode_positions(positions))
+                    conn.executemany("INSERT INTO postings (term, first_doc, last_doc, docs, data) VALUES (?, ?, ?, ?, ?)",
+                                     [(term, block.first, block.last, block.docs, bytes(block.data)) for term, block in blocks.items()])
+                    self._merge_crowded(list(blocks))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            get_metrics().inc('search_chapters', indexed, result='indexed')
+
+    def _merge_crowded(self, terms):
+        conn = self._conn
+        crowded = []
+        for start in range(0, len(terms), _SQL_CHUNK):
+            chunk = terms[start:start + _SQL_CHUNK]
+            crowded.extend(row[0] for row in conn.execute(
+                f"SELECT term FROM postings WHERE term IN ({','.join('?' * len(chunk))}) GROUP BY term HAVING COUNT(*) > ?",
+                (*chunk, self.max_blocks)))
+        if not crowded:
+            return
+        removed = {row[0] for row in conn.execute("SELECT doc FROM removed")}
+        for term in crowded:
+            rows = conn.execute("SELECT first_doc, docs FROM postings WHERE term = ? ORDER BY first_doc", (term,)).fetchall()
+            count = _tiered_suffix([docs for _, docs in rows])
+            self._rewrite(term, rows[-count][0], removed)
+
+    def _rewrite(self, term, from_doc, removed):
+        """Replaces the term's blocks starting at from_doc with one, without the removed docs. Call inside a transaction."""
+        conn = self._conn
+        merged = _Block()
+        for (data,) in conn.execute("SELECT data FROM postings WHERE term = ? AND first_doc >= ? ORDER BY first_doc", (term, from_doc)).fetchall():
+            for doc, start, end in _iter_block(data):
+                if doc not in removed:
+                    merged.add(doc, data[start:end])
+        conn.execute("DELETE FROM postings WHERE term = ? AND first_doc >= ?", (term, from_doc))
+        if merged.docs:
+            conn.execute("INSERT INTO postings (term, first_doc, last_doc, docs, data) VALUES (?, ?, ?, ?, ?)",
+                         (term, merged.first, merged.last, merged.docs, bytes(merged.data)))
+
+    def compact(self, batch=1000):
+        """Merges every term into one block and drops the entries of removed chapters. Returns the terms rewritten."""
+        self.flush()
+        conn = self._conn
+        with self._lock:
+            removed = {row[0] for row in conn.execute("SELECT doc FROM removed")}
+            rewrite_all = bool(removed)
+            terms = [row[0] for row in conn.execute("SELECT term FROM postings GROUP BY term HAVING COUNT(*) > ? ORDER BY term",
+                                                    (0 if rewrite_all else 1,))]
+        for start in range(0, len(terms), batch):
+            # A transaction per batch, so crawlers writing to the same file are held up only briefly
+            with self._lock:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for term in terms[start:start + batch]:
+                        self._rewrite(term, 0, removed)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        with self._lock:
+            if removed:
+                conn.executemany("DELETE FROM removed WHERE doc = ?", [(doc,) for doc in removed])
+            conn.execute("VACUUM")
+        return len(terms)
+
+    # --- reading ---------------------------------------------------------------------
+    def novels(self):
+        """Slugs of the novels with indexed chapters."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT novel FROM docs")}
+
+    def chapters(self, novel):
+        """Chapter numbers of a novel in the index."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT chapter FROM docs WHERE novel = ?", (novel,))}
+
+    def search(self, query, limit=None):
+        """Hits (novel, chapter) holding every word and phrase of the query, sorted by novel and chapter."""
+        groups = parse_query(query)
+        if not groups:
+            return []
+        self.flush()
+        conn = self._conn
+        with self._lock:
+            frequency = {}
+            for term in {term for group in groups for term in group}:
+                frequency[term] = conn.execute("SELECT COALESCE(SUM(docs), 0) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                if not frequency[term]:
+                    return []
+            entries = {}  # term -> {doc: (block, start, end)} of the candidates
+            candidates = None
+            for term in sorted(frequency, key=frequency.get):
+                found = {}
+                low, high = (min(candidates), max(candidates)) if candidates else (0, 0)
+                for first, last, data in conn.execute("SELECT first_doc, last_doc, data FROM postings WHERE term = ? ORDER BY first_doc", (term,)):
+                    if candidates is None:
+                        found.update((doc, (data, start, end)) for doc, start, end in _iter_block(data))
+                    elif last >= low and first <= high:
+                        found.update((doc, (data, start, end)) for doc, start, end in _iter_block(data) if doc in candidates)
+                entries[term] = found
+                candidates = found.keys() if candidates is None else candidates & found.keys()
+                if not candidates:
+                    return []
+            phrases = [group for group in groups if len(group) > 1]
+            docs = [doc for doc in candidates if all(self._has_phrase(doc, phrase, entries) for phrase in phrases)]
+            hits = []
+            for start in range(0, len(docs), _SQL_CHUNK):
+                chunk = docs[start:start + _SQL_CHUNK]
+                hits.extend(Hit(novel, chapter) for novel, chapter in conn.execute(
+                    f"SELECT novel, chapter FROM docs WHERE doc IN ({','.join('?' * len(chunk))})", chunk))
+        hits.sort()
+        return hits[:limit] if limit else hits
+
+    @staticmethod
+    def _has_phrase(doc, phrase, entries):
+        positions = [set(_decode_positions(*entries[term][doc])) for term in phrase]
+        return any(all(first + offset in positions[offset] for offset in range(1, len(phrase))) for first in positions[0])
+
+
+def update_index(index, data_dir=DATA_DIR):
+    """Brings the index in line with the chapters saved under data_dir. Returns counts of novels, chapters, indexed and removed."""
+    counts = {'novels': 0, 'chapters': 0, 'indexed': 0, 'removed': 0}
+    on_disk = set()
+    for novel_dir in novel_dirs(data_dir):
+        novel = os.path.basename(novel_dir)
+        on_disk.add(novel)
+        saved = set()
+        for chapter in iter_saved_chapters(novel_dir):
+            saved.add(chapter['chapterNumber'])
+            counts['indexed'] += index.add(novel, chapter['chapterNumber'], chapter['text'])
+        counts['novels'] += 1
+        counts['chapters'] += len(saved)
+        gone = index.chapters(novel) - saved
+        if gone:
+            counts['removed'] += index.remove(novel, gone)
+    for novel in index.novels() - on_disk:
+        counts['removed'] += index.remove(novel)
+    index.flush()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the full-text index of saved chapters')
+    parser.add_argument('command', choices=('update', 'query', 'compact'))
+    parser.add_argument('query', nargs='*', help='Words and "quoted phrases" that must all occur (query)')
+    parser.add_argument('--index', default=SEARCH_INDEX_PATH, metavar='PATH', help=f'Index file (default: {SEARCH_INDEX_PATH})')
+    parser.add_argument('--data-dir', default=DATA_DIR, metavar='DIR', help='Novel folders to index (update)')
+    parser.add_argument('--limit', type=int, default=0, metavar='N', help='Print at most N hits (query; 0: all)')
+    args = parser.parse_intermixed_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.command == 'query' and not args.query:
+        parser.error("query needs the words to look for")
+    with SearchIndex(args.index) as index:
+        if args.command == 'update':
+            counts = update_index(index, args.data_dir)
+            logging.getLogger(__name__).info("Indexed %d of %d chapters in %d novels; %d removed",
+                                             counts['indexed'], counts['chapters'], counts['novels'], counts['removed'])
+        elif args.command == 'compact':
+            logging.getLogger(__name__).info("Rewrote %d terms in %s", index.compact(), args.index)
+        else:
+            started = time.perf_counter()
+            hits = index.search(' '.join(args.query), args.limit)
+            for hit in hits:
+                print(f"{hit.novel}\t{hit.chapter}")
+            logging.getLogger(__name__).info("%d hits in %.1f ms", len(hits), (time.perf_counter() - started) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Sitemap discovery: the site's whole catalog from its sitemaps (main.py --sitemap).
+
+Walking listing pages only reaches the lists in SEED_LISTS, at one request
+per page of novels, and a novel page without a chapter list is probed
+chuong-1/, chuong-2/, ... until a request fails. A sitemap index names the
+whole catalog in a few hundred files of up to 50 000 URLs each.
+discover_sitemap:
+
+- reads the index (SITEMAP_URL) and every child sitemap it names through
+  the crawl's fetcher (HTTP cache, rate limiter, retries, WARC archive) and
+  parses them with an XML pull parser, inflating .xml.gz files chunk by
+  chunk as they are fed in, so not even a 50 000-URL file becomes a tree in
+  memory;
+- sorts each <url> into a novel page (<slug>/) or a chapter page
+  (<slug>/chuong-N/) and records the novel in the state store's
+  sitemap_novels table with its highest chapter number and latest lastmod,
+  a batch of SITEMAP_BATCH novels per transaction;
+- skips a child sitemap whose lastmod is the one it had when it was last
+  read in full (meta key sitemap_files).
+
+The frontier hands the recorded novels out after the resumed ones and
+before any listing page, with the highest chapter as the listing's latest
+chapter. It drops a completed novel whose lastmod is no newer than the one
+it was last crawled against, without a request.
+"""
+import calendar
+import logging
+import re
+import time
+import zlib
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import XMLPullParser, ParseError
+
+try:
+    from .config import BASE_URL, SITEMAP_URL, SITEMAP_SKIP_SEGMENTS, SITEMAP_BATCH
+    from .fetcher import fetch_raw
+    from .metrics import get_metrics
+except Exception:
+    from config import BASE_URL, SITEMAP_URL, SITEMAP_SKIP_SEGMENTS, SITEMAP_BATCH
+    from fetcher import fetch_raw
+    from metrics import get_metrics
+
+FILES_META_KEY = 'sitemap_files'
+
+_CHUNK = 64 * 1024
+_PATH_RE = re.compile(r'^/([^/]+)/(?:chuong-(\d+)/?)?$')
+_LASTMOD_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:T(\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?(Z|[+-]\d{2}:\d{2})?)?$')
+
+
+def parse_lastmod(text):
+    """Seconds since the epoch of a W3C datetime (2024-05-01, 2024-05-01T10:00:00+07:00), or None."""
+    m = _LASTMOD_RE.match((text or '').strip())
+    if not m:
+        return None
+    year, month, day, hour, minute, second, zone = m.groups()
+    seconds = calendar.timegm((int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0)))
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds -= offset if zone[0] == '+' else -offset
+    return float(seconds)
+
+
+def _chunks(content):
+    """content in pieces of _CHUNK bytes, inflated on the fly when it is gzip."""
+    if content[:2] == b'\x1f\x8b':
+        inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for start in range(0, len(content), _CHUNK):
+            data = inflate.decompress(content[start:start + _CHUNK])
+            if data:
+                yield data
+        yield inflate.flush()
+        return
+    for start in range(0, len(content), _CHUNK):
+        yield content[start:start + _CHUNK]
+
+
+def iter_sitemap(content):
+    """Yields (tag, loc, lastmod) for every <sitemap> of an index or <url> of a urlset, in document order.
+
+    tag is 'sitemap' or 'url'; lastmod is seconds since the epoch or None. Parsed elements are
+    dropped as soon as they are read. A malformed document ends the iteration with a warning.
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    root = None
+    try:
+        for chunk in _chunks(content):
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                tag = elem.tag.rsplit('}', 1)[-1]
+                if tag not in ('url', 'sitemap'):
+                    continue
+                loc = lastmod = None
+                for child in elem:
+                    name = child.tag.rsplit('}', 1)[-1]
+                    if name == 'loc':
+                        loc = (child.text or '').strip()
+                    elif name == 'lastmod':
+                        lastmod = parse_lastmod(child.text)
+                root.clear()
+                if loc:
+                    yield tag, loc, lastmod
+        parser.close()
+    except (ParseError, zlib.error) as e:
+        logging.getLogger(__name__).warning("Stopped reading a malformed sitemap: %s", e)
+
+
+def classify(url, base_url=BASE_URL):
+    """(novel URL, chapter number or None) of a novel or chapter page URL on base_url's host, else None."""
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    if parts.netloc and parts.netloc != base.netloc:
+        return None
+    m = _PATH_RE.match(parts.path)
+    if not m or m.group(1) in SITEMAP_SKIP_SEGMENTS or '.' in m.group(1):
+        return None
+    novel_url = f"{base.scheme}://{base.netloc}/{m.group(1)}/"
+    return novel_url, int(m.group(2)) if m.group(2) else None
+
+
+class _Batch:
+    """Novels of the sitemap being read, aggregated until SITEMAP_BATCH of them are written at once."""
+
+    def __init__(self, store, size):
+        self.store = store
+        self.size = size
+        self.novels = {}  # novel URL -> [latest chapter, lastmod]
+        self.counts = {'novels': 0, 'chapters': 0}
+
+    def add(self, url, lastmod, base_url):
+        page = classify(url, base_url)
+        if page is None:
+            return
+        novel_url, number = page
+        self.counts['chapters' if number else 'novels'] += 1
+        novel = self.novels.setdefault(novel_url, [None, None])
+        if number and (novel[0] is None or number > novel[0]):
+            novel[0] = number
+        if lastmod is not None and (novel[1] is None or lastmod > novel[1]):
+            novel[1] = lastmod
+        if len(self.novels) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.novels:
+            self.store.add_sitemap_novels([(url, latest, lastmod) for url, (latest, lastmod) in self.novels.items()])
+            self.novels.clear()
+
+
+def discover_sitemap(store, sitemap_url=SITEMAP_URL, fetch=None, base_url=BASE_URL, batch=SITEMAP_BATCH):
+    """Reads the sitemap index at sitemap_url (or a single urlset) into the state store's sitemap_novels table.
+
+    fetch(url, kind) -> bytes or None (default: fetcher.fetch_raw). Returns counts of the sitemap files
+    read and skipped and of the novel and chapter URLs found.
+    """
+    fetch = fetch or fetch_raw
+    files = store.get_meta(FILES_META_KEY) or {}
+    counts = {'sitemaps': 0, 'skipped': 0, 'novels': 0, 'chapters': 0}
+    found = _Batch(store, batch)
+
+    def read(url):
+        content = fetch(url, 'sitemap')
+        if content is None:
+            logging.getLogger(__name__).warning("Could not fetch sitemap %s", url)
+            return None
+        counts['sitemaps'] += 1
+        get_metrics().inc('sitemap_files', result='read')
+        return iter_sitemap(content)
+
+    started = time.time()
+    index = read(sitemap_url)
+    for tag, loc, lastmod in index or ():
+        if tag == 'url':
+            found.add(loc, lastmod, base_url)  # sitemap_url is a plain urlset
+            continue
+        if lastmod is not None and files.get(loc) == lastmod:
+            counts['skipped'] += 1
+            get_metrics().inc('sitemap_files', result='unchanged')
+            continue
+        records = read(loc)
+        if records is None:
+            continue
+        for child_tag, url, url_lastmod in records:
+            if child_tag == 'url':
+                found.add(url, url_lastmod, base_url)
+        found.flush()
+        if lastmod is not None:
+            # Everything in it is recorded, so an unchanged copy can be skipped next time
+            files[loc] = lastmod
+            store.set_meta(FILES_META_KEY, files)
+    found.flush()
+    counts.update(found.counts)
+    get_metrics().inc('sitemap_urls', found.counts['novels'], kind='novel')
+    get_metrics().inc('sitemap_urls', found.counts['chapters'], kind='chapter')
+    logging.getLogger(__name__).info("Sitemap %s: %d files read, %d unchanged, %d novel and %d chapter URLs in %.1fs",
+                                     sitemap_url, counts['sitemaps'], counts['skipped'], counts['novels'], counts['chapters'],
+                                     time.time() - started)
+    return counts
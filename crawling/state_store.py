@@ -0,0 +1,422 @@
+"""Crawl state in SQLite (WAL mode).
+
+Replaces the whole-file rewrite of `data/state.json`: every update touches
+only the rows it changes, so recording a chapter costs the same at novel
+10 000 as at novel 1. Novels are keyed by URL (with their URL slug and data/
+folder slug indexed), which makes "is this novel done?" one index lookup that
+can run before the novel page is even fetched.
+
+Tables:
+  meta      key/value crawl counters (frontier_pages, stories_crawled_count, ...)
+  listing_pages  listing pages seen, per seed list, and how many novels they held
+  novels    one row per novel: folder, title, novelId, last chapter, completed,
+            and the change signals --update compares (listing latest chapter,
+            chapter-list signature, sitemap lastmod), and whether it counts toward
+            stories_crawled_count
+  sitemap_novels  novels found by main.py --sitemap and not crawled yet, with
+            their highest chapter and latest lastmod
+  chapters  one row per chapter attempt: chapterId, status ('saved'/'failed'/
+            'duplicate'), content hash, SimHash and word count
+  fetches   URLs whose fetch was retried or failed for good: retry and
+            failure counts and the last error (see retry.py)
+  id_blocks next free NOV/CHA/GEN number, reserved in blocks (see ids.py)
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urljoin
+
+try:
+    from .config import BASE_URL, STATE_DB_PATH, DATA_DIR
+    from .fingerprint import to_signed, from_signed
+    from .ids import ID_BLOCKS_SCHEMA, reserve_block
+    from .metrics import get_metrics
+except Exception:
+    from config import BASE_URL, STATE_DB_PATH, DATA_DIR
+    from fingerprint import to_signed, from_signed
+    from ids import ID_BLOCKS_SCHEMA, reserve_block
+    from metrics import get_metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS listing_pages (
+    url TEXT PRIMARY KEY,
+    seed TEXT,
+    page_num INTEGER,
+    novel_count INTEGER,
+    fetched_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS novels (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE,
+    url_slug TEXT,
+    folder_slug TEXT,
+    title TEXT,
+    novel_id TEXT,
+    last_chapter INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    listing_latest INTEGER,
+    listing_label TEXT,
+    chapter_signal TEXT,
+    counted INTEGER NOT NULL DEFAULT 0,
+    sitemap_lastmod REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS novels_url_slug ON novels (url_slug);
+CREATE INDEX IF NOT EXISTS novels_folder_slug ON novels (folder_slug);
+CREATE TABLE IF NOT EXISTS chapters (
+    novel INTEGER NOT NULL REFERENCES novels (id),
+    number INTEGER NOT NULL,
+    chapter_id TEXT,
+    status TEXT NOT NULL,
+    content_hash TEXT,
+    simhash INTEGER,
+    word_count INTEGER,
+    updated_at REAL,
+    PRIMARY KEY (novel, number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sitemap_novels (
+    url TEXT PRIMARY KEY,
+    latest INTEGER,
+    lastmod REAL
+);
+CREATE TABLE IF NOT EXISTS fetches (
+    url TEXT PRIMARY KEY,
+    retries INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL
+) WITHOUT ROWID;
+"""
+
+# Columns added after the first release of the schema; added in place to older databases.
+ADDED_COLUMNS = {
+    'novels': (('listing_latest', 'INTEGER'), ('listing_label', 'TEXT'), ('chapter_signal', 'TEXT'),
+               ('counted', 'INTEGER NOT NULL DEFAULT 0'), ('sitemap_lastmod', 'REAL')),
+    'chapters': (('content_hash', 'TEXT'), ('word_count', 'INTEGER'), ('simhash', 'INTEGER')),
+}
+
+
+def url_slug(novel_url):
+    return novel_url.rstrip('/').split('/')[-1]
+
+
+class StateStore:
+    """Thread-safe handle on the crawl state database."""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits do not fsync; a power loss can drop the last
+        # few updates but never corrupts the database.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute(ID_BLOCKS_SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row['name'] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, sql_type in columns:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+                    if name == 'counted':
+                        # Earlier versions counted every novel they finished, so the ones on record are counted already
+                        self._conn.execute("UPDATE novels SET counted = 1")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _transaction(self, statements):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- meta counters ---------------------------------------------------------------
+    def get_meta(self, key, default=None):
+        row = self._execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def set_meta(self, key, value):
+        self._execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                      (key, json.dumps(value)))
+
+    @property
+    def current_page(self):
+        """Resume page of the hot list saved before frontier_pages existed (and by state.json)."""
+        return self.get_meta('current_page', 1)
+
+    @property
+    def stories_crawled_count(self):
+        return self.get_meta('stories_crawled_count', 0)
+
+    def increment_stories_crawled(self, novel_url=None):
+        """Counts a crawled novel and returns the count; a novel_url is counted only the first time, however many runs it takes."""
+        with self._lock:
+            if novel_url is not None and not self._conn.execute(
+                    "UPDATE novels SET counted = 1 WHERE url = ? AND counted = 0", (novel_url,)).rowcount:
+                return self.stories_crawled_count
+            count = self.stories_crawled_count + 1
+            self.set_meta('stories_crawled_count', count)
+            return count
+
+    def reset(self):
+        """Forgets all progress (--no-resume). ID blocks are kept, so IDs stay unique across runs."""
+        self._transaction([
+            ("DELETE FROM chapters", ()),
+            ("DELETE FROM novels", ()),
+            ("DELETE FROM listing_pages", ()),
+            ("DELETE FROM fetches", ()),
+            ("DELETE FROM sitemap_novels", ()),
+            ("DELETE FROM meta WHERE key IN ('current_page', 'frontier_pages', 'stories_crawled_count', 'sitemap_files')", ()),
+        ])
+
+    # --- listing pages ---------------------------------------------------------------
+    def record_page(self, url, seed, page_num, novel_count):
+        self._execute("INSERT OR REPLACE INTO listing_pages (url, seed, page_num, novel_count, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                      (url, seed, page_num, novel_count, time.time()))
+
+    # --- sitemap discoveries ---------------------------------------------------------
+    def add_sitemap_novels(self, rows):
+        """Records novels found in a sitemap, rows [(url, latest chapter, lastmod)], keeping the highest of each."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("""INSERT INTO sitemap_novels (url, latest, lastmod) VALUES (?, ?, ?)
+                    ON CONFLICT (url) DO UPDATE SET latest = COALESCE(MAX(latest, excluded.latest), latest, excluded.latest),
+                    lastmod = COALESCE(MAX(lastmod, excluded.lastmod), lastmod, excluded.lastmod)""", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def sitemap_novels(self, batch=500):
+        """Yields the sitemap_novels rows as dicts, in discovery order, a batch at a time."""
+        last = 0
+        while True:
+            rows = self._execute("SELECT rowid, url, latest, lastmod FROM sitemap_novels WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                 (last, batch)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last = rows[-1]['rowid']
+
+    def remove_sitemap_novel(self, novel_url):
+        self._execute("DELETE FROM sitemap_novels WHERE url = ?", (novel_url,))
+
+    def set_sitemap_lastmod(self, novel_url, lastmod):
+        """Stores the sitemap lastmod the novel was last crawled against."""
+        self._execute("UPDATE novels SET sitemap_lastmod = ? WHERE url = ?", (lastmod, novel_url))
+
+    # --- novels ----------------------------------------------------------------------
+    def novel(self, novel_url=None, folder_slug=None):
+        """The novel's row as a dict, looked up by URL, or None.
+
+        folder_slug finds a row that has no URL yet; a row with another URL is a different
+        novel, even when both titles slugify to the same folder.
+        """
+        row = None
+        if novel_url:
+            row = self._execute("SELECT * FROM novels WHERE url = ?", (novel_url,)).fetchone()
+        if row is None and folder_slug:
+            row = self._execute("SELECT * FROM novels WHERE folder_slug = ? AND url IS NULL LIMIT 1", (folder_slug,)).fetchone()
+        return dict(row) if row else None
+
+    def is_novel_done(self, novel_url):
+        """O(1) check used before the novel page is fetched."""
+        row = self._execute("SELECT completed FROM novels WHERE url = ?", (novel_url,)).fetchone()
+        return bool(row and row['completed'])
+
+    def incomplete_novels(self):
+        """URLs of the novels started but not completed, oldest first."""
+        rows = self._execute("SELECT url FROM novels WHERE completed = 0 AND url IS NOT NULL ORDER BY updated_at").fetchall()
+        return [row['url'] for row in rows]
+
+    def upsert_novel(self, novel_url, folder_slug=None, title=None, novel_id=None):
+        """Creates or updates the novel's row and returns it.
+
+        A row known only by folder (e.g. migrated from state.json without a URL) is adopted by the URL.
+        """
+        with self._lock:
+            existing = self.novel(novel_url, folder_slug)
+            now = time.time()
+            if existing is None:
+                self._execute("INSERT INTO novels (url, url_slug, folder_slug, title, novel_id, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                              (novel_url, url_slug(novel_url), folder_slug, title, novel_id, now))
+            else:
+                self._execute("""UPDATE novels SET url = ?, url_slug = ?, folder_slug = COALESCE(?, folder_slug),
+                                 title = COALESCE(?, title), novel_id = COALESCE(?, novel_id), updated_at = ? WHERE id = ?""",
+                              (novel_url, url_slug(novel_url), folder_slug, title, novel_id, now, existing['id']))
+            return self.novel(novel_url)
+
+    def mark_novel(self, novel_url, completed, last_chapter=None):
+        with get_metrics().timer('state'):
+            self._execute("UPDATE novels SET completed = ?, last_chapter = COALESCE(?, last_chapter), updated_at = ? WHERE url = ?",
+                          (int(bool(completed)), last_chapter, time.time(), novel_url))
+
+    def set_signals(self, novel_url, listing_latest=None, listing_label=None, chapter_signal=None):
+        """Stores the change signals last seen for the novel (None keeps the stored value)."""
+        self._execute("""UPDATE novels SET listing_latest = COALESCE(?, listing_latest), listing_label = COALESCE(?, listing_label),
+                         chapter_signal = COALESCE(?, chapter_signal), updated_at = ? WHERE url = ?""",
+                      (listing_latest, listing_label, chapter_signal, time.time(), novel_url))
+
+    # --- chapters --------------------------------------------------------------------
+    def record_chapter(self, novel_url, number, chapter_id=None, status='saved', content_hash=None, word_count=None, simhash=None):
+        """Records one chapter outcome, advancing the novel's last_chapter, in a single transaction.
+
+        simhash is the chapter's unsigned 64-bit fingerprint.SimHash; it is stored signed.
+        """
+        with get_metrics().timer('state'), self._lock:
+            novel = self.novel(novel_url)
+            if novel is None:
+                novel = self.upsert_novel(novel_url)
+            now = time.time()
+            statements = [
+                ("""INSERT INTO chapters (novel, number, chapter_id, status, content_hash, simhash, word_count, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (novel, number) DO UPDATE SET chapter_id = COALESCE(excluded.chapter_id, chapter_id),
+                    status = CASE WHEN status = 'saved' AND excluded.status = 'failed' THEN status ELSE excluded.status END,
+                    content_hash = COALESCE(excluded.content_hash, content_hash), simhash = COALESCE(excluded.simhash, simhash),
+                    word_count = COALESCE(excluded.word_count, word_count), updated_at = excluded.updated_at""",
+                 (novel['id'], number, chapter_id, status, content_hash, None if simhash is None else to_signed(simhash), word_count, now)),
+            ]
+            if status == 'saved':
+                statements.append(("UPDATE novels SET last_chapter = MAX(last_chapter, ?), updated_at = ? WHERE id = ?",
+                                   (number, now, novel['id'])))
+            self._transaction(statements)
+
+    def chapter(self, novel_url, number):
+        """The chapter's row as a dict (chapter_id, status, content_hash, word_count), or None."""
+        row = self._execute("""SELECT c.* FROM chapters c JOIN novels n ON n.id = c.novel
+                               WHERE n.url = ? AND c.number = ?""", (novel_url, number)).fetchone()
+        return dict(row) if row else None
+
+    def chapter_summaries(self, novel_url):
+        """(number, chapter_id, word_count) of every saved chapter of the novel, in chapter order."""
+        rows = self._execute("""SELECT c.number, c.chapter_id, c.word_count FROM chapters c JOIN novels n ON n.id = c.novel
+                                WHERE n.url = ? AND c.status = 'saved' ORDER BY c.number""", (novel_url,)).fetchall()
+        return [(row['number'], row['chapter_id'], row['word_count'] or 0) for row in rows]
+
+    def saved_chapters(self, novel_url, statuses=('saved',)):
+        """Chapter numbers of the novel recorded with one of the statuses (by default: saved)."""
+        rows = self._execute(f"""SELECT c.number FROM chapters c JOIN novels n ON n.id = c.novel
+                                 WHERE n.url = ? AND c.status IN ({', '.join('?' * len(statuses))})""", (novel_url, *statuses)).fetchall()
+        return {row['number'] for row in rows}
+
+    def chapter_fingerprints(self, novel_url):
+        """(number, content_hash, simhash or None) of every saved chapter of the novel."""
+        rows = self._execute("""SELECT c.number, c.content_hash, c.simhash FROM chapters c JOIN novels n ON n.id = c.novel
+                                WHERE n.url = ? AND c.status = 'saved'""", (novel_url,)).fetchall()
+        return [(row['number'], row['content_hash'], None if row['simhash'] is None else from_signed(row['simhash'])) for row in rows]
+
+    def chapter_count(self, status='saved'):
+        return self._execute("SELECT COUNT(*) AS n FROM chapters WHERE status = ?", (status,)).fetchone()['n']
+
+    def first_failed_chapter(self, novel_url):
+        row = self._execute("""SELECT MIN(c.number) AS number FROM chapters c JOIN novels n ON n.id = c.novel
+                               WHERE n.url = ? AND c.status = 'failed'""", (novel_url,)).fetchone()
+        return row['number'] if row else None
+
+    def failure_count(self, novel_url):
+        """Failed chapters of the novel plus failed fetches of its page and every URL under it."""
+        chapters = self._execute("""SELECT COUNT(*) AS n FROM chapters c JOIN novels n ON n.id = c.novel
+                                    WHERE n.url = ? AND c.status = 'failed'""", (novel_url,)).fetchone()['n']
+        # The URLs under novel_url are exactly the keys in [novel_url, novel_url with its last character bumped)
+        upper = novel_url[:-1] + chr(ord(novel_url[-1]) + 1)
+        fetches = self._execute("SELECT COALESCE(SUM(failures), 0) AS n FROM fetches WHERE url >= ? AND url < ?", (novel_url, upper)).fetchone()['n']
+        return chapters + fetches
+
+    # --- fetch outcomes --------------------------------------------------------------
+    def record_fetch(self, url, retries=0, error=None):
+        """Adds one fetch outcome for url: the retries it took, and error when it failed for good."""
+        self._execute("""INSERT INTO fetches (url, retries, failures, last_error, updated_at) VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT (url) DO UPDATE SET retries = retries + excluded.retries, failures = failures + excluded.failures,
+                         last_error = COALESCE(excluded.last_error, last_error), updated_at = excluded.updated_at""",
+                      (url, retries, 1 if error else 0, error, time.time()))
+
+    def fetch_totals(self):
+        """{'urls', 'retries', 'failures'} summed over every recorded fetch."""
+        row = self._execute("SELECT COUNT(*) AS urls, COALESCE(SUM(retries), 0) AS retries, COALESCE(SUM(failures), 0) AS failures FROM fetches").fetchone()
+        return dict(row)
+
+    # --- IDs -------------------------------------------------------------------------
+    def reserve_ids(self, kind, count, floor=0):
+        """First number of a block of count IDs of kind ('novel', 'chapter', 'genre'), above floor."""
+        with self._lock:
+            return reserve_block(self._conn, kind, count, floor)
+
+    def max_ids(self):
+        """Highest NOV and CHA numbers on record, so ID blocks start above IDs minted before they existed."""
+        novel = self._execute("SELECT MAX(CAST(SUBSTR(novel_id, 4) AS INTEGER)) AS n FROM novels WHERE novel_id LIKE 'NOV%'").fetchone()['n']
+        chapter = self._execute("SELECT MAX(CAST(SUBSTR(chapter_id, 4) AS INTEGER)) AS n FROM chapters WHERE chapter_id LIKE 'CHA%'").fetchone()['n']
+        return {'novel': novel or 0, 'chapter': chapter or 0}
+
+    # --- migration -------------------------------------------------------------------
+    def migrate_from_json(self, state_path=os.path.join(DATA_DIR, 'state.json'), data_dir=DATA_DIR):
+        """One-time import of a legacy state.json. Returns the number of novels imported.
+
+        state.json keys novels by data/ folder; the folder's metadata.json supplies the URL slug, so
+        folders without one are skipped. Imported novels count as crawled already, like the rows the
+        `counted` column upgrade finds.
+        """
+        if self.get_meta('migrated_state_json') or not os.path.exists(state_path):
+            return 0
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning("Could not read %s for migration: %s", state_path, e)
+            return 0
+
+        imported = skipped = 0
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for folder_slug, info in (legacy.get('processed_novels') or {}).items():
+                    try:
+                        with open(os.path.join(data_dir, folder_slug, 'metadata.json'), 'r', encoding='utf-8') as mf:
+                            meta = json.load(mf)
+                    except (OSError, ValueError):
+                        meta = {}
+                    slug = meta.get('slug')
+                    if not slug:
+                        skipped += 1
+                        continue
+                    self._conn.execute(
+                        """INSERT INTO novels (url, url_slug, folder_slug, title, novel_id, last_chapter, completed, counted, updated_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?) ON CONFLICT (url) DO NOTHING""",
+                        (urljoin(BASE_URL, slug + '/'), slug, folder_slug, meta.get('title'), meta.get('novelId'),
+                         int(info.get('last_chapter') or 0), int(bool(info.get('completed'))), now))
+                    imported += 1
+                for key in ('current_page', 'stories_crawled_count'):
+                    if key in legacy:
+                        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(legacy[key])))
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_state_json', ?)", (json.dumps(state_path),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if skipped:
+            logging.getLogger(__name__).warning("Skipped %d novels from %s without a readable metadata.json slug", skipped, state_path)
+        logging.getLogger(__name__).info("Migrated %d novels from %s into %s", imported, state_path, self.path)
+        return imported
@@ -0,0 +1,154 @@
+"""Batch generation of the synthetic novel and chapter fields.
+
+utils.generate_random_novel_numeric_fields / generate_random_chapter_fields
+make one entity per call: a dozen random draws, datetime arithmetic and a
+strftime per date. Rebuilding an export of millions of chapters spends
+most of its time there. The batch functions here generate N entities in one
+go: with NumPy each field is one vectorized draw, and dates are computed
+and formatted as datetime64 arrays. Without NumPy they fall back to the
+per-entity generators.
+
+Output matches the per-entity functions: the same keys and value ranges,
+viewsToday <= viewsThisWeek <= viewsThisMonth <= viewsThisYear <=
+totalViews, publicationDate <= created <= updated <= now, and dates as
+{"$date": "YYYY-MM-DDTHH:MM:SS.mmmZ"}. A seed (seed_for(novel_id)) makes
+a batch reproducible for the same seed, now and backend. The NumPy and
+pure-Python streams differ from each other.
+
+    fields = chapter_fields_batch(len(chapters), seed=seed_for(novel_id))
+    for chapter, extra in zip(chapters, iter_chapter_fields(seed_for(novel_id))): ...
+"""
+import hashlib
+import random
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency; the pure-Python generators are used instead
+    np = None
+
+try:
+    from .utils import generate_random_novel_numeric_fields, generate_random_chapter_fields, utc_now
+except Exception:
+    from utils import generate_random_novel_numeric_fields, generate_random_chapter_fields, utc_now
+
+BACKENDS = ('numpy', 'python')
+START_YEAR = 2021
+FIRST_CHUNK = 64  # iter_chapter_fields draws this many entities first, doubling per batch...
+CHUNK_SIZE = 4096  # ...up to this many
+
+
+def default_backend():
+    return 'numpy' if np is not None else 'python'
+
+
+def seed_for(*key):
+    """Stable 64-bit seed for a key such as a novel ID (the same in every process and run)."""
+    digest = hashlib.blake2b('\x1f'.join(map(str, key)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _resolve(backend):
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}; choose one of {', '.join(BACKENDS)}")
+    if backend == 'numpy' and np is None:
+        raise RuntimeError("numpy is required for the numpy backend (pip install numpy)")
+    return backend
+
+
+# --- NumPy ---------------------------------------------------------------------------
+def _random_days(rng, n, now):
+    """Dates (datetime64[D]) with a random year from START_YEAR to last year, month and day 1-28."""
+    last_year = now.year - 1 if now.year > START_YEAR else START_YEAR
+    years = rng.integers(START_YEAR, last_year, n, endpoint=True)
+    months = (years - 1970) * 12 + rng.integers(0, 12, n)
+    return months.astype('datetime64[M]').astype('datetime64[D]') + rng.integers(0, 28, n).astype('timedelta64[D]')
+
+
+def _minutes(rng, n, days, hours, minutes=60):
+    """Random offsets of [0, days] days, [0, hours) hours and [0, minutes) minutes, as timedelta64[m]."""
+    total = rng.integers(0, days, n, endpoint=True) * 1440 + rng.integers(0, hours, n) * 60
+    if minutes:
+        total = total + rng.integers(0, minutes, n)
+    return total.astype('timedelta64[m]')
+
+
+def _json_dates(values):
+    return [{"$date": text + 'Z'} for text in np.datetime_as_string(values, unit='ms').tolist()]
+
+
+def _chapter_fields_numpy(rng, n, now):
+    now64 = np.datetime64(now, 'us')
+    views = rng.integers(0, 100000, n, endpoint=True).tolist()
+    premium = (rng.integers(0, 2, n) == 1).tolist()
+    created = (_random_days(rng, n, now) + _minutes(rng, n, 0, 24)).astype('datetime64[us]')
+    updated = created + _minutes(rng, n, 30, 24, 0)
+    created = np.minimum(created, now64)
+    updated = np.maximum(np.minimum(updated, now64), created)
+    return [{"viewCount": v, "isPremium": p, "created": c, "updated": u}
+            for v, p, c, u in zip(views, premium, _json_dates(created), _json_dates(updated))]
+
+
+def _novel_fields_numpy(rng, n, now):
+    now64 = np.datetime64(now, 'us')
+    rating_average = np.round(rng.uniform(0.0, 10.0, n), 1)
+    views = rng.integers(1000, 1000000, n, endpoint=True)
+    rating = rng.integers((views * 0.01).astype(np.int64), (views * 0.2).astype(np.int64), endpoint=True)
+    likes = rng.integers(0, views // 2, endpoint=True)
+    comments = rng.integers(0, likes // 2, endpoint=True)
+    upvotes = rng.integers(0, likes, endpoint=True)
+    follow = rng.integers(0, (views * 0.1).astype(np.int64), endpoint=True)
+    year = rng.integers(0, views, endpoint=True)
+    month = rng.integers(0, year, endpoint=True)
+    week = rng.integers(0, month, endpoint=True)
+    today = rng.integers(0, week, endpoint=True)
+
+    publication = _random_days(rng, n, now).astype('datetime64[us]') + rng.integers(0, 86400 * 10**6, n).astype('timedelta64[us]')
+    created = publication + _minutes(rng, n, 30, 24)
+    updated = created + _minutes(rng, n, 10, 24)
+    publication = np.minimum(publication, now64)
+    created = np.maximum(np.minimum(created, now64), publication)
+    updated = np.maximum(np.minimum(updated, now64), created)
+
+    columns = (rating_average.tolist(), rating.tolist(), likes.tolist(), views.tolist(), comments.tolist(), upvotes.tolist(),
+               follow.tolist(), today.tolist(), week.tolist(), month.tolist(), year.tolist(),
+               _json_dates(publication), _json_dates(created), _json_dates(updated))
+    keys = ("ratingAverage", "totalRating", "totalLikes", "totalViews", "totalComments", "totalUpvotes", "totalFollow",
+            "viewsToday", "viewsThisWeek", "viewsThisMonth", "viewsThisYear", "publicationDate", "created", "updated")
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+# --- public API ----------------------------------------------------------------------
+def chapter_fields_batch(n, seed=None, now=None, backend=None):
+    """Synthetic fields (viewCount, isPremium, created, updated) for n chapters, as a list of dicts."""
+    now = now or utc_now()
+    if _resolve(backend) == 'numpy':
+        return _chapter_fields_numpy(np.random.default_rng(seed), n, now)
+    rng = random.Random(seed)
+    return [generate_random_chapter_fields(rng, now) for _ in range(n)]
+
+
+def novel_fields_batch(n, seed=None, now=None, backend=None):
+    """Synthetic counters and dates for n novels, as a list of dicts."""
+    now = now or utc_now()
+    if _resolve(backend) == 'numpy':
+        return _novel_fields_numpy(np.random.default_rng(seed), n, now)
+    rng = random.Random(seed)
+    return [generate_random_novel_numeric_fields(rng, now) for _ in range(n)]
+
+
+def iter_chapter_fields(seed=None, now=None, backend=None, chunk_size=CHUNK_SIZE):
+    """Endless stream of chapter fields from one seeded generator.
+
+    Batches start small and double up to chunk_size, so a short novel does not pay for a full chunk.
+    """
+    now = now or utc_now()
+    if _resolve(backend) == 'numpy':
+        rng = np.random.default_rng(seed)
+        size = min(FIRST_CHUNK, chunk_size)
+        while True:
+            yield from _chapter_fields_numpy(rng, size, now)
+            size = min(size * 2, chunk_size)
+    rng = random.Random(seed)
+    while True:
+        yield generate_random_chapter_fields(rng, now)
@@ -0,0 +1,96 @@
+"""Text normalization for slugs, folder and file names, and chapter text.
+
+- slugify(): the URL/folder slug of a title. Vietnamese letters fold to their
+  ASCII base through one str.translate table (built from the letters' Unicode
+  decomposition), then one regex pass turns every run of non-word characters
+  into '-'. Input is NFC-normalized first, so a decomposed title gets the
+  same slug as a precomposed one. The result is memoized, and a title with no
+  usable characters gets a hash-based fallback ('slug-<8 hex>') instead of a
+  random one, so the same title always maps to the same folder.
+- fold_text(): the same folding without the dashes, for matching text.
+- safe_filename(): chapter titles made safe for file names.
+- html_to_text(), element_text(), word_count(): the chapter text formats
+  every crawl so far has produced, in one place. A chapter is saved as its
+  HTML with the tags removed (entities and spacing kept), while its
+  wordCount counts the words of its <p> paragraphs as the parser reads
+  them. Extraction, the saver and the exporter all go through these.
+"""
+import hashlib
+import re
+import unicodedata
+from functools import lru_cache
+
+SLUG_CACHE_SIZE = 1 << 16
+
+# Vowels (with their circumflex/breve/horn variants) and tone marks of the Vietnamese alphabet.
+_VI_VOWELS = 'aăâeêioôơuưy'
+_VI_TONES = ('', '̀', '́', '̉', '̃', '̣')  # none, grave, acute, hook above, tilde, dot below
+
+
+def _build_fold_table():
+    table = {}
+    for vowel in _VI_VOWELS + _VI_VOWELS.upper():
+        for tone in _VI_TONES:
+            letter = unicodedata.normalize('NFC', vowel + tone)
+            base = unicodedata.normalize('NFD', letter)[0]
+            if letter != base:
+                table[ord(letter)] = base
+    # đ has no decomposition: the stroke is part of the letter
+    table[ord('đ')] = 'd'
+    table[ord('Đ')] = 'D'
+    return table
+
+
+FOLD_TABLE = _build_fold_table()
+_NON_WORD_RE = re.compile(r'\W+')
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|]+')
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def fold_text(text):
+    """Lower-cased text with Vietnamese diacritics removed (đ -> d); everything else unchanged."""
+    return unicodedata.normalize('NFC', text).lower().translate(FOLD_TABLE)
+
+
+def fallback_slug(text):
+    """Slug for a title that has no word characters; stable for the same title."""
+    return 'slug-' + hashlib.blake2b(text.encode('utf-8'), digest_size=4).hexdigest()
+
+
+@lru_cache(maxsize=SLUG_CACHE_SIZE)
+def slugify(text):
+    """`Tiên Hiệp Kỳ Duyên` -> `tien-hiep-ky-duyen`. Empty input gives ''."""
+    if not text:
+        return ""
+    slug = _NON_WORD_RE.sub('-', fold_text(text)).strip('-')
+    return slug or fallback_slug(text)
+
+
+def slugify_many(texts):
+    """slugify() for each text, in order; repeated texts cost one lookup."""
+    return [slugify(text) for text in texts]
+
+
+def safe_filename(text):
+    """Strips the text and replaces runs of characters that are invalid in file names with '-'."""
+    return _UNSAFE_FILENAME_RE.sub('-', text.strip())
+
+
+def html_to_text(markup):
+    """Chapter HTML as saved on disk: tags removed, entities and spacing left as they are."""
+    if not markup or '<' not in markup:
+        return markup or ""
+    return _HTML_TAG_RE.sub('', markup)
+
+
+def element_text(element):
+    """Text of a parsed chapter body (a BeautifulSoup tag): one line per <p>, or all its text when it has none."""
+    paragraphs = element.find_all('p')
+    if paragraphs:
+        return "\n".join(p.get_text(separator=" ", strip=True) for p in paragraphs)
+    return element.get_text(separator=" ", strip=True)
+
+
+def word_count(text):
+    """Whitespace-separated words of a chapter text (its wordCount)."""
+    return len(text.split())
@@ -0,0 +1,318 @@
+"""Raw response archive in WARC format, with a URL index.
+
+fetch_page parses a response and drops its bytes, so applying a fixed
+selector used to mean crawling the site again. With an archive enabled
+(main.py --warc) every page the crawl reads is also appended to
+`data/warc/` as a WARC/1.0 `response` record, each record its own gzip
+member (the usual .warc.gz layout, readable by standard WARC tools), and
+`data/warc/index.db` maps each URL to the file, offset and length of its
+latest record plus the kind of page it is (listing, novel, chapter_list,
+chapter). replay.py re-extracts a whole crawl from there without touching
+the network.
+
+Pages served from the HTTP cache or revalidated with a 304 are archived
+too, unless the archive already holds the URL. Every process writes its own
+files (`crawl-<time>-<pid>-<n>.warc.gz`, rotated at WARC_MAX_FILE_SIZE), so
+crawlers sharing a data/ tree only share the SQLite index.
+
+    python crawling/warc.py get URL [--dir data/warc]     # archived body to stdout
+    python crawling/warc.py reindex [--dir data/warc]     # rebuild index.db from the .warc.gz files
+"""
+import argparse
+import base64
+import calendar
+import gzip
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    from .config import WARC_DIR, WARC_MAX_FILE_SIZE
+    from .metrics import get_metrics
+except Exception:
+    from config import WARC_DIR, WARC_MAX_FILE_SIZE
+    from metrics import get_metrics
+
+INDEX_NAME = 'index.db'
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    url TEXT PRIMARY KEY,
+    kind TEXT,
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    status INTEGER,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_kind ON records (kind, fetched_at);
+"""
+# The body stored is the decoded one, so transfer-level headers no longer describe it
+_DROPPED_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection'}
+_REASONS = {200: 'OK', 304: 'Not Modified'}
+WARCINFO = b'software: truyenfull-crawler\r\nformat: WARC File Format 1.0\r\n'
+
+
+def _open_index(directory):
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(directory, INDEX_NAME), check_same_thread=False, isolation_level=None, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+def _warc_record(headers, block):
+    lines = [b'WARC/1.0']
+    lines.extend(f"{name}: {value}".encode('utf-8') for name, value in headers)
+    lines.append(f"Content-Length: {len(block)}".encode('ascii'))
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + block + b'\r\n\r\n'
+
+
+def _warc_date(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def _http_block(body, status, headers):
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}".rstrip()]
+    for name, value in (headers or {}).items():
+        if name.lower() not in _DROPPED_HEADERS:
+            lines.append(f"{name}: {value}")
+    lines.append(f"Content-Length: {len(body)}")
+    return '\r\n'.join(lines).encode('utf-8') + b'\r\n\r\n' + body
+
+
+def _gzip_member(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def parse_record(data):
+    """(WARC headers dict, HTTP status, HTTP headers dict, body) of one uncompressed WARC record.
+
+    Records other than responses (warcinfo) come back with no status or HTTP headers and their whole block as body.
+    """
+    head, _, rest = data.partition(b'\r\n\r\n')
+    warc_headers = {}
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.decode('utf-8').partition(':')
+        warc_headers[name.strip()] = value.strip()
+    block = rest[:int(warc_headers.get('Content-Length', len(rest)))]
+    if warc_headers.get('WARC-Type') != 'response':
+        return warc_headers, None, {}, block
+    http_head, _, body = block.partition(b'\r\n\r\n')
+    http_lines = http_head.decode('iso-8859-1').split('\r\n')
+    status = int(http_lines[0].split()[1]) if http_lines and len(http_lines[0].split()) > 1 else None
+    http_headers = {}
+    for line in http_lines[1:]:
+        name, _, value = line.partition(':')
+        http_headers[name.strip()] = value.strip()
+    return warc_headers, status, http_headers, body
+
+
+class WarcWriter:
+    """Appends responses to rotating .warc.gz files in directory and indexes them by URL. Thread-safe."""
+
+    def __init__(self, directory=WARC_DIR, max_file_size=WARC_MAX_FILE_SIZE):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self._lock = threading.Lock()
+        self._index = _open_index(directory)
+        self._file = None
+        self._file_name = None
+        self._files_opened = 0
+
+    def record(self, url, body, headers=None, kind=None, status=200, missing_only=False):
+        """Archives one response body; missing_only skips URLs the archive already holds (cache hits, 304s).
+
+        A failing archive is logged and never fails the fetch.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                if missing_only and self._index.execute("SELECT 1 FROM records WHERE url = ?", (url,)).fetchone():
+                    return
+                warc_headers = [
+                    ('WARC-Type', 'response'),
+                    ('WARC-Record-ID', f"<urn:uuid:{uuid.uuid4()}>"),
+                    ('WARC-Date', _warc_date(now)),
+                    ('WARC-Target-URI', url),
+                    ('WARC-Payload-Digest', 'sha1:' + base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')),
+                    ('Content-Type', 'application/http; msgtype=response'),
+                ]
+                member = _gzip_member(_warc_record(warc_headers, _http_block(body, status, headers)))
+                f = self._current_file()
+                offset = f.tell()
+                f.write(member)
+                f.flush()  # the index must never point past what is on disk
+                self._index.execute("""INSERT INTO records (url, kind, file, offset, length, status, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT (url) DO UPDATE SET kind = COALESCE(excluded.kind, kind), file = excluded.file,
+                                       offset = excluded.offset, length = excluded.length, status = excluded.status, fetched_at = excluded.fetched_at""",
+                                    (url, kind, self._file_name, offset, len(member), status, now))
+        except (OSError, sqlite3.Error) as e:
+            logging.getLogger(__name__).warning("Could not archive %s: %s", url, e)
+            return
+        get_metrics().inc('warc_records', kind=kind or 'other')
+        get_metrics().inc('warc_bytes', len(member))
+
+    def _current_file(self):
+        if self._file is not None and self._file.tell() >= self.max_file_size:
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._files_opened += 1
+            self._file_name = f"crawl-{time.strftime('%Y%m%d%H%M%S', time.gmtime())}-{os.getpid()}-{self._files_opened:05d}.warc.gz"
+            self._file = open(os.path.join(self.directory, self._file_name), 'ab')
+            self._file.write(_gzip_member(_warc_record([
+                ('WARC-Type', 'warcinfo'),
+                ('WARC-Record-ID', f"<urn:uuid:{uuid.uuid4()}>"),
+                ('WARC-Date', _warc_date(time.time())),
+                ('WARC-Filename', self._file_name),
+                ('Content-Type', 'application/warc-fields'),
+            ], WARCINFO)))
+        return self._file
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._index.close()
+
+
+class WarcArchive:
+    """Read side: archived bodies by URL, through index.db. Open one per process."""
+
+    def __init__(self, directory=WARC_DIR):
+        self.directory = directory
+        if not os.path.exists(os.path.join(directory, INDEX_NAME)):
+            raise FileNotFoundError(f"No WARC index in {directory}")
+        self._index = _open_index(directory)
+        self._files = {}
+
+    def __contains__(self, url):
+        return self._index.execute("SELECT 1 FROM records WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self._index.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def urls(self, kind=None):
+        """Archived URLs (of one kind), in the order they were first fetched."""
+        if kind is None:
+            rows = self._index.execute("SELECT url FROM records ORDER BY fetched_at")
+        else:
+            rows = self._index.execute("SELECT url FROM records WHERE kind = ? ORDER BY fetched_at", (kind,))
+        return [url for url, in rows]
+
+    def get(self, url):
+        """The archived body of url as bytes, or None when it is not archived or its record is unreadable."""
+        row = self._index.execute("SELECT file, offset, length FROM records WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        file_name, offset, length = row
+        try:
+            f = self._files.get(file_name)
+            if f is None:
+                f = self._files[file_name] = open(os.path.join(self.directory, file_name), 'rb')
+            f.seek(offset)
+            return parse_record(gzip.decompress(f.read(length)))[3]
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            logging.getLogger(__name__).warning("Could not read archived %s: %s", url, e)
+            return None
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        self._index.close()
+
+
+def iter_members(path, chunk_size=1 << 20):
+    """(offset, length, uncompressed record) of every gzip member in a .warc.gz file, read in chunks."""
+    with open(path, 'rb') as f:
+        offset = 0
+        data = b''
+        while True:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            parts = []
+            length = 0
+            while not decompressor.eof:
+                if not data:
+                    data = f.read(chunk_size)
+                    if not data:
+                        return  # end of file, or a member truncated by a crash mid-write
+                parts.append(decompressor.decompress(data))
+                length += len(data) - len(decompressor.unused_data)
+                data = decompressor.unused_data
+            yield offset, length, b''.join(parts)
+            offset += length
+
+
+def _guess_kind(url):
+    if 'sitemap' in url.rstrip('/').rsplit('/', 1)[-1]:
+        return 'sitemap'
+    if '/danh-sach/' in url:
+        return 'listing'
+    if '/chuong-' in url:
+        return 'chapter'
+    if '/trang-' in url:
+        return 'chapter_list'
+    return 'novel'
+
+
+def reindex(directory=WARC_DIR):
+    """Rebuilds index.db from the .warc.gz files (latest record of each URL wins). Returns the records indexed."""
+    path = os.path.join(directory, INDEX_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = _open_index(directory)
+    count = 0
+    try:
+        for file_name in sorted(name for name in os.listdir(directory) if name.endswith('.warc.gz')):
+            for offset, length, record in iter_members(os.path.join(directory, file_name)):
+                warc_headers, status, _, _ = parse_record(record)
+                if warc_headers.get('WARC-Type') != 'response':
+                    continue
+                url = warc_headers['WARC-Target-URI']
+                fetched_at = calendar.timegm(time.strptime(warc_headers['WARC-Date'], '%Y-%m-%dT%H:%M:%SZ'))
+                conn.execute("INSERT OR REPLACE INTO records (url, kind, file, offset, length, status, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (url, _guess_kind(url), file_name, offset, length, status, fetched_at))
+                count += 1
+    finally:
+        conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read or re-index the raw response archive')
+    parser.add_argument('command', choices=('get', 'reindex'))
+    parser.add_argument('url', nargs='?', help='URL to print (get)')
+    parser.add_argument('--dir', default=WARC_DIR, help='Archive folder')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if args.command == 'reindex':
+        logging.getLogger(__name__).info("Indexed %d records in %s", reindex(args.dir), args.dir)
+        return
+    if not args.url:
+        parser.error("get needs a URL")
+    archive = WarcArchive(args.dir)
+    try:
+        body = archive.get(args.url)
+    finally:
+        archive.close()
+    if body is None:
+        sys.exit(f"{args.url} is not archived in {args.dir}")
+    sys.stdout.buffer.write(body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+
+from crawling import archive
+
+
+def chapter(number, text):
+    return {'chapterNumber': number, 'chapterId': f'CHA{number:07d}', 'title': f'Chương {number}', 'plainTextContent': text}
+
+
+def test_append_and_read_back(tmp_path):
+    writer = archive.ArchiveWriter(str(tmp_path), 'zlib')
+    writer.append(chapter(1, 'Một'))
+    writer.append(chapter(2, 'Hai'))
+    writer.close()
+    with archive.ChapterArchive(str(tmp_path)) as packed:
+        assert packed.numbers() == [1, 2]
+        assert packed.read(2) == {'chapterNumber': 2, 'chapterId': 'CHA0000002', 'title': 'Chương 2', 'text': 'Hai'}
+
+
+def test_reappended_chapter_wins(tmp_path):
+    writer = archive.ArchiveWriter(str(tmp_path), 'none')
+    writer.append(chapter(1, 'old'))
+    writer.append(chapter(1, 'new'))
+    writer.close()
+    with archive.ChapterArchive(str(tmp_path)) as packed:
+        assert len(packed) == 1
+        assert packed.read(1)['text'] == 'new'
+
+
+def test_append_after_torn_index_record(tmp_path):
+    writer = archive.ArchiveWriter(str(tmp_path), 'zlib')
+    writer.append(chapter(1, 'Một'))
+    writer.close()
+    index_path = os.path.join(str(tmp_path), archive.INDEX_NAME)
+    with open(index_path, 'ab') as f:
+        f.write(b'\x02\x00\x00')  # an append interrupted mid-record
+    assert set(archive.read_index(str(tmp_path))) == {1}
+
+    writer = archive.ArchiveWriter(str(tmp_path), 'zlib')
+    writer.append(chapter(2, 'Hai'))
+    writer.close()
+    assert os.path.getsize(index_path) == len(archive.INDEX_MAGIC) + 2 * archive.INDEX_RECORD.size
+    with archive.ChapterArchive(str(tmp_path)) as packed:
+        assert packed.numbers() == [1, 2]
+        assert [ch['text'] for ch in packed] == ['Một', 'Hai']
+
+
+def test_pack_and_unpack_round_trip(tmp_path):
+    novel_dir = str(tmp_path)
+    for number in (1, 2):
+        with open(os.path.join(novel_dir, f'{number:03d} - CHA000000{number} - Chương {number}.txt'), 'w', encoding='utf-8') as f:
+            f.write(f'text {number}')
+    assert archive.pack_novel(novel_dir, 'zlib', remove=True) == 2
+    assert sorted(os.listdir(novel_dir)) == [archive.INDEX_NAME, archive.PACK_NAME]
+    assert archive.unpack_novel(novel_dir, remove=True) == 2
+    assert sorted(os.listdir(novel_dir)) == ['001 - CHA0000001 - Chương 1.txt', '002 - CHA0000002 - Chương 2.txt']
@@ -0,0 +1,45 @@
+from crawling import bloom
+
+
+def urls(start, stop):
+    return [f'https://truyenfull.vn/truyen-{i}/' for i in range(start, stop)]
+
+
+def test_no_false_negatives_across_slices():
+    seen = bloom.BloomFilter(capacity=100, error_rate=1e-4)
+    keys = urls(0, 1000)
+    assert all(seen.add(key) for key in keys)
+    assert len(seen._slices) > 1
+    assert all(key in seen for key in keys)
+    assert not seen.add(keys[0])
+    assert len(seen) == len(keys)
+
+
+def test_false_positive_rate_stays_bounded():
+    seen = bloom.BloomFilter(capacity=500, error_rate=1e-3)
+    for key in urls(0, 2000):
+        seen.add(key)
+    false_positives = sum(key in seen for key in urls(2000, 22000))
+    assert false_positives / 20000 < 2 * 1e-3 * 5  # 2 x error_rate is the bound; leave room for chance
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'seen.bloom')
+    seen = bloom.BloomFilter(capacity=50, error_rate=1e-4)
+    for key in urls(0, 300):
+        seen.add(key)
+    seen.save(path)
+    loaded = bloom.BloomFilter.load(path)
+    assert len(loaded) == 300 and len(loaded._slices) == len(seen._slices)
+    assert all(key in loaded for key in urls(0, 300))
+
+
+def test_load_falls_back_to_an_empty_filter(tmp_path):
+    assert len(bloom.BloomFilter.load(str(tmp_path / 'missing.bloom'), 10)) == 0
+    path = tmp_path / 'torn.bloom'
+    seen = bloom.BloomFilter(capacity=10)
+    seen.add('a')
+    seen.save(str(path))
+    path.write_bytes(path.read_bytes()[:-3])
+    loaded = bloom.BloomFilter.load(str(path), 10)
+    assert len(loaded) == 0 and 'a' not in loaded
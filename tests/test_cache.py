@@ -0,0 +1,14 @@
+from crawling import cache
+
+
+def test_revalidate_kinds_override_the_ttl(tmp_path):
+    responses = cache.ResponseCache(str(tmp_path), ttl_rules=[(r"/chuong-\d+/", 3600)], default_ttl=60)
+    url = 'http://x/truyen/chuong-1/'
+    responses.store(url, '<p>Một</p>'.encode('utf-8'), {'ETag': '"v1"'})
+    entry = responses.get(url)
+    assert responses.is_fresh(entry, 'chapter')
+
+    responses.revalidate_kinds = frozenset({'chapter'})
+    assert not responses.is_fresh(entry, 'chapter')
+    assert responses.is_fresh(entry, 'listing')
+    assert responses.conditional_headers(entry) == {'If-None-Match': '"v1"'}
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from crawling import coordinator
+from crawling.frontier import FrontierEntry, WAITING
+
+
+def entries(*names):
+    return [FrontierEntry(f'http://x/{name}/', 10, None, 'danh-sach/truyen-hot/', 1) for name in names]
+
+
+@pytest.fixture
+def workers(tmp_path):
+    path = str(tmp_path / 'coordinator.db')
+    opened = []
+
+    def worker(name, **kwargs):
+        handle = coordinator.Coordinator(path, worker_id=name, **kwargs)
+        opened.append(handle)
+        return handle
+
+    yield worker
+    for handle in opened:
+        handle.close()
+
+
+def test_workers_lease_disjoint_batches(workers):
+    a, b = workers('a'), workers('b')
+    assert a.enqueue(entries('n1', 'n2', 'n3', 'n4', 'n5')) == 5
+    assert a.enqueue(entries('n1')) == 0
+    first = [entry.url for entry in a.lease(2)]
+    second = [entry.url for entry in b.lease(2)]
+    assert first == ['http://x/n1/', 'http://x/n2/'] and second == ['http://x/n3/', 'http://x/n4/']
+    assert not b.finish(first[0])  # not b's lease
+    assert a.finish(first[0])
+    assert a.counts() == {'queued': 1, 'leased': 3, 'done': 1, 'failed': 0}
+
+
+def test_expired_lease_goes_to_another_worker(workers):
+    a, b = workers('a', lease_seconds=0.05), workers('b')
+    a.enqueue(entries('n1'))
+    assert [entry.url for entry in a.lease()] == ['http://x/n1/']
+    assert b.lease() == []
+    time.sleep(0.1)
+    assert [entry.url for entry in b.lease()] == ['http://x/n1/']
+    assert not a.finish('http://x/n1/')  # taken over: a's late report is ignored
+    assert b.finish('http://x/n1/')
+
+
+def test_failed_leases_are_set_aside_after_max_attempts(workers):
+    a = workers('a', max_attempts=2)
+    a.enqueue(entries('n1'))
+    a.lease()
+    a.finish('http://x/n1/', ok=False)
+    assert a.counts()['queued'] == 1
+    a.lease()
+    a.finish('http://x/n1/', ok=False)
+    assert a.counts()['failed'] == 1
+    assert a.lease() == []
+    assert a.enqueue(entries('n1'), reopen=True) == 1
+    assert a.counts()['queued'] == 1
+
+
+def test_released_leases_do_not_use_up_attempts(workers):
+    a = workers('a', max_attempts=2)
+    a.enqueue(entries('n1'))
+    for _ in range(3):  # e.g. a request budget ran out before the novel started, run after run
+        a.lease()
+        assert a.release('http://x/n1/')
+    assert not a.release('http://x/n1/')  # no longer leased
+    a.lease()
+    a.finish('http://x/n1/', ok=False)
+    assert a.counts()['queued'] == 1  # still one attempt left
+
+
+def test_close_hands_leases_back(workers):
+    b = workers('b')
+    a = coordinator.Coordinator(b.path, worker_id='a')
+    a.enqueue(entries('n1', 'n2'))
+    a.lease(2)
+    a.close()
+    assert b.counts()['queued'] == 2
+
+
+def test_leased_frontier_orders_batches_and_waits_on_held_leases(workers):
+    a, b = workers('a'), workers('b')
+    a.enqueue(entries('n1', 'n2', 'n3'))
+    held = b.lease(1)
+    front = coordinator.LeasedFrontier(a, batch=2, poll=0)
+    front.order = lambda batch: sorted(batch, key=lambda entry: entry.url, reverse=True)
+    stream = front.entries(None)
+    assert [next(stream).url, next(stream).url] == ['http://x/n3/', 'http://x/n2/']
+    # Nothing free while b (and a) hold leases: the caller is told to wait rather than blocked
+    assert next(stream) is WAITING
+    front.decided(FrontierEntry('http://x/n2/', None, None, None, None))
+    front.decided(FrontierEntry('http://x/n3/', None, None, None, None))
+    b.finish(held[0].url)
+    assert list(stream) == []
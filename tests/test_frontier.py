@@ -0,0 +1,37 @@
+import pytest
+
+from crawling import frontier, state_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state_store.StateStore(str(tmp_path / 'state.db'))
+    yield store
+    store.close()
+
+
+def crawled(store, url, lastmod):
+    store.upsert_novel(url, url.rstrip('/').rsplit('/', 1)[-1])
+    store.mark_novel(url, True, 10)
+    store.set_sitemap_lastmod(url, lastmod)
+
+
+def test_sitemap_lastmod_is_compared_before_the_filter(store):
+    crawled(store, 'http://x/unchanged/', 100.0)
+    crawled(store, 'http://x/changed/', 100.0)
+    store.add_sitemap_novels([('http://x/unchanged/', 10, 100.0), ('http://x/changed/', 12, 200.0),
+                              ('http://x/seen/', 5, None), ('http://x/new/', 5, None)])
+    front = frontier.Frontier(store, seed_lists=[], bloom_path=None)
+    for url in ('http://x/unchanged/', 'http://x/changed/', 'http://x/seen/'):
+        front.seen.add(url)
+
+    entries = list(front._sitemap_entries())
+
+    assert [entry.url for entry in entries] == ['http://x/changed/', 'http://x/new/']
+    assert entries[0].lastmod == 200.0
+    # Reopened, so the crawl fetches its new chapters instead of skipping it as completed
+    assert not store.is_novel_done('http://x/changed/')
+    assert store.is_novel_done('http://x/unchanged/')
+
+    front.decided(entries[0])
+    assert store.novel('http://x/changed/')['sitemap_lastmod'] == 200.0
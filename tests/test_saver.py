@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from crawling import saver
+
+
+def chapter(number, chapter_id, text):
+    return {'chapterNumber': number, 'chapterId': chapter_id, 'title': f'Chương {number}', 'plainTextContent': text}
+
+
+@pytest.mark.parametrize('storage', ['txt', 'archive'])
+def test_skipped_chapter_reports_the_id_on_disk(tmp_path, storage):
+    novel = {'title': 'Truyện A', 'novelId': 'NOV0000001'}
+    with saver.NovelWriter(novel, str(tmp_path), background=False, storage=storage) as writer:
+        writer.add(chapter(1, 'CHA0000001', 'Một'))
+
+    recorded = []
+    again = chapter(1, 'CHA0000009', 'Một')
+    with saver.NovelWriter(novel, str(tmp_path), background=False, storage=storage) as writer:
+        writer.add(again, lambda: recorded.append(again['chapterId']))
+    assert recorded == ['CHA0000001']
+    assert [saved['chapterId'] for saved in saver.iter_saved_chapters(writer.novel_dir)] == ['CHA0000001']
+    if storage == 'txt':
+        assert sorted(os.listdir(writer.novel_dir)) == ['001 - CHA0000001 - Chương 1.txt', 'metadata.json']
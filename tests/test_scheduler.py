@@ -0,0 +1,71 @@
+import pytest
+
+from crawling import scheduler, state_store
+from crawling.frontier import FrontierEntry, WAITING
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state_store.StateStore(str(tmp_path / 'state.db'))
+    yield store
+    store.close()
+
+
+def listed(name, latest=10):
+    return FrontierEntry(f'http://x/{name}/', latest, None, 'danh-sach/truyen-hot/', 1)
+
+
+def resumed(name):
+    return FrontierEntry(f'http://x/{name}/', None, None, None, None)
+
+
+def test_run_budget(store):
+    crawl = scheduler.CrawlScheduler(store, request_budget=5)
+    assert crawl.spend('http://x/a/', 3)
+    assert not crawl.spend('http://x/b/', 3)  # refused whole, nothing charged
+    assert crawl.requests == 3 and not crawl.exhausted
+    assert crawl.spend('http://x/b/', 2)
+    assert crawl.exhausted
+    assert not crawl.spend('http://x/b/')
+    assert crawl.spend('http://x/b/', force=True)  # already fetched pages are still charged
+    assert crawl.requests == 6
+
+
+def test_novel_budget_resets_when_the_novel_is_finished(store):
+    crawl = scheduler.CrawlScheduler(store, novel_request_budget=2)
+    assert crawl.spend('http://x/a/') and crawl.spend('http://x/a/')
+    assert not crawl.spend('http://x/a/')
+    assert crawl.spend('http://x/b/', 2)
+    crawl.finished('http://x/a/')
+    assert crawl.spend('http://x/a/')
+
+
+def test_unlimited_budgets(store):
+    crawl = scheduler.CrawlScheduler(store, request_budget=0, novel_request_budget=0)
+    assert crawl.spend('http://x/a/', 10 ** 6)
+    assert not crawl.exhausted
+
+
+def test_resumed_novels_go_first_then_by_priority(store):
+    store.upsert_novel('http://x/done/', 'done')
+    store.mark_novel('http://x/done/', True, 10)
+    crawl = scheduler.CrawlScheduler(store, window=10, max_chapters=100, weights={'rank': 0, 'staleness': 0, 'missing': 1, 'failures': 0})
+    entries = [listed('done'), listed('short', latest=2), resumed('old'), listed('long', latest=50)]
+    assert [entry.url for entry in crawl.ordered(iter(entries))] == ['http://x/old/', 'http://x/long/', 'http://x/short/', 'http://x/done/']
+    assert [entry.url for entry in crawl.rank(entries)] == ['http://x/old/', 'http://x/long/', 'http://x/short/', 'http://x/done/']
+
+
+def test_ordered_stops_when_the_run_budget_is_spent(store):
+    crawl = scheduler.CrawlScheduler(store, window=1, request_budget=1)
+    stream = crawl.ordered(iter([listed('a'), listed('b'), listed('c')]))
+    assert next(stream).url == 'http://x/a/'
+    crawl.spend('http://x/a/')
+    assert list(stream) == []
+
+
+def test_ordered_hands_out_the_window_while_waiting(store):
+    crawl = scheduler.CrawlScheduler(store, window=3)
+    stream = crawl.ordered(iter([listed('a'), WAITING, WAITING, listed('b')]))
+    assert next(stream).url == 'http://x/a/'
+    assert next(stream) is WAITING
+    assert [entry.url for entry in stream] == ['http://x/b/']
@@ -0,0 +1,61 @@
+import pytest
+
+from crawling import search
+
+
+@pytest.mark.parametrize('n', [0, 1, 127, 128, 300, 16383, 16384, 2 ** 35 + 7])
+def test_varint_round_trip(n):
+    out = bytearray()
+    search._put_varint(out, n)
+    search._put_varint(out, 5)
+    assert len(out) == max(1, (n.bit_length() + 6) // 7) + 1
+    value, pos = search._get_varint(out, 0)
+    assert value == n
+    assert search._get_varint(out, pos) == (5, len(out))
+
+
+def test_block_round_trip():
+    block = search._Block()
+    postings = {3: [0, 4, 200], 10: [7], 500: [1, 2, 3, 1000]}
+    for doc, positions in postings.items():
+        block.add(doc, search._encode_positions(positions))
+    assert (block.first, block.last, block.docs) == (3, 500, 3)
+    data = bytes(block.data)
+    assert {doc: search._decode_positions(data, start, end) for doc, start, end in search._iter_block(data)} == postings
+
+
+def test_parse_query():
+    assert search.parse_query('Kiếm "Tiên Hiệp" kiếm-hiệp') == [['kiem'], ['tien', 'hiep'], ['kiem', 'hiep']]
+    assert search.parse_query('  "" ') == []
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = search.SearchIndex(str(tmp_path / 'search.db'), flush_docs=2, max_blocks=2)
+    yield index
+    index.close()
+
+
+def test_words_and_phrases(index):
+    index.add('truyen-a', 1, 'Tiêu Viêm luyện đan trong núi.')
+    index.add('truyen-a', 2, 'Núi cao, đan dược và Tiêu Viêm.')
+    index.add('truyen-b', 1, 'Viêm Đế gặp Tiêu Huân Nhi.')
+    assert index.search('tiêu viêm') == [('truyen-a', 1), ('truyen-a', 2), ('truyen-b', 1)]
+    assert index.search('"tiêu viêm"') == [('truyen-a', 1), ('truyen-a', 2)]
+    assert index.search('"viêm tiêu"') == []
+    assert index.search('"luyện đan" núi') == [('truyen-a', 1)]
+    assert index.search('rồng') == []
+
+
+def test_replaced_and_removed_chapters(index):
+    for chapter in range(1, 8):  # several flushes, so terms span merged blocks
+        index.add('truyen-a', chapter, f'chương {chapter} kiếm khí')
+    assert not index.add('truyen-a', 3, 'chương 3 kiếm khí')
+    index.add('truyen-a', 3, 'chương 3 đao quang')
+    assert index.search('kiếm') == [('truyen-a', n) for n in (1, 2, 4, 5, 6, 7)]
+    assert index.search('"đao quang"') == [('truyen-a', 3)]
+    assert index.remove('truyen-a', {1, 2}) == 2
+    assert index.search('kiếm') == [('truyen-a', n) for n in (4, 5, 6, 7)]
+    index.compact()
+    assert index.search('kiếm khí') == [('truyen-a', n) for n in (4, 5, 6, 7)]
+    assert index.chapters('truyen-a') == {3, 4, 5, 6, 7}
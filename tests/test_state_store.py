@@ -0,0 +1,56 @@
+import json
+import os
+
+from crawling import state_store
+from crawling.config import BASE_URL
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_migrate_from_json(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    state_path = os.path.join(data_dir, 'state.json')
+    write_json(state_path, {'processed_novels': {'truyen-a': {'last_chapter': 12, 'completed': True},
+                                                 'no-metadata': {'last_chapter': 3}},
+                            'stories_crawled_count': 2})
+    write_json(os.path.join(data_dir, 'truyen-a', 'metadata.json'), {'slug': 'truyen-a', 'title': 'A', 'novelId': 'NOV0000001'})
+    store = state_store.StateStore(str(tmp_path / 'state.db'))
+    try:
+        assert store.migrate_from_json(state_path, data_dir) == 1
+        novel = store.novel(BASE_URL + 'truyen-a/')
+        assert (novel['last_chapter'], novel['completed'], novel['counted']) == (12, 1, 1)
+        assert store.novel(folder_slug='no-metadata') is None
+        # Already counted: finishing it again does not count it twice
+        assert store.increment_stories_crawled(BASE_URL + 'truyen-a/') == 2
+        assert store.migrate_from_json(state_path, data_dir) == 0
+    finally:
+        store.close()
+
+
+def test_novels_sharing_a_folder_slug_keep_their_own_rows(tmp_path):
+    store = state_store.StateStore(str(tmp_path / 'state.db'))
+    try:
+        store.upsert_novel('http://x/a/', 'same-title', 'Same Title', 'NOV0000001')
+        store.mark_novel('http://x/a/', True, 10)
+        b = store.upsert_novel('http://x/b/', 'same-title', 'Same Title', 'NOV0000002')
+        assert (b['completed'], b['novel_id']) == (0, 'NOV0000002')
+        assert store.novel('http://x/b/', 'same-title')['novel_id'] == 'NOV0000002'
+        a = store.novel('http://x/a/')
+        assert (a['completed'], a['novel_id']) == (1, 'NOV0000001')
+        assert b['id'] != a['id']
+    finally:
+        store.close()
+
+
+def test_row_without_url_is_adopted_by_folder_slug(tmp_path):
+    store = state_store.StateStore(str(tmp_path / 'state.db'))
+    try:
+        store._execute("INSERT INTO novels (folder_slug, novel_id, last_chapter) VALUES ('truyen-a', 'NOV0000001', 4)")
+        adopted = store.upsert_novel('http://x/a/', 'truyen-a')
+        assert (adopted['novel_id'], adopted['last_chapter']) == ('NOV0000001', 4)
+    finally:
+        store.close()
@@ -0,0 +1,24 @@
+from bs4 import BeautifulSoup
+
+from crawling import textnorm
+
+
+def test_slugify():
+    assert textnorm.slugify('Tiên Hiệp Kỳ Duyên!') == 'tien-hiep-ky-duyen'
+    assert textnorm.slugify('!!!').startswith('slug-')
+    assert textnorm.slugify('!!!') == textnorm.slugify.__wrapped__('!!!')  # stable, not random
+
+
+def test_saved_text_keeps_entities_and_glues_tags():
+    assert textnorm.html_to_text('<p>Một &amp; hai</p><p>ba</p>') == 'Một &amp; haiba'
+    assert textnorm.html_to_text('Dòng một<br/>Dòng hai') == 'Dòng mộtDòng hai'
+    assert textnorm.html_to_text(None) == ''
+
+
+def test_word_count_reads_paragraphs_as_parsed():
+    body = BeautifulSoup('<div><p>Một &amp; <i>hai</i></p> lạc <p>ba&nbsp;bốn</p></div>', 'html.parser').div
+    text = textnorm.element_text(body)
+    assert text == 'Một & hai\nba\xa0bốn'
+    assert textnorm.word_count(text) == 5
+    plain = BeautifulSoup('<div>Dòng một<br/>Dòng <b>hai</b></div>', 'html.parser').div
+    assert textnorm.word_count(textnorm.element_text(plain)) == 4